@@ -34,6 +34,8 @@ SCHEMA_DIR='{}/schema'.format(STATIC_DIR)
 SCHEMA_FNAME = 'open_api.yaml'
 
 ICON_CONTENT = 'image/png'
+# Streamed batch responses: one JSON document per line, or one JSON array
+BATCH_CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
     
 # .............................................................................
 class DWC:
@@ -66,6 +68,18 @@ class DWCA:
         'day']
     # Human readable
     CORE_TYPE = '{}/terms/Occurrence'.format(DWC.URL)
+    # Indexing pipeline: archives downloaded at once, processes rewriting 
+    # archives for Solr (None for one per CPU), and files posted to Solr at once
+    DOWNLOAD_WORKERS = 4
+    REWRITE_WORKERS = None
+    POST_WORKERS = 2
+    # Approximate bytes in each range of a core file rewritten in parallel
+    REWRITE_CHUNK_BYTES = 64 * 1024 * 1024
+    # Downloads: bytes written at a time, seconds to wait for the server, and 
+    # times an interrupted download is resumed
+    DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+    DOWNLOAD_TIMEOUT = 60
+    DOWNLOAD_RETRIES = 3
 
 JSON_HEADERS = {'Content-Type': 'application/json'}
 
@@ -314,6 +328,150 @@ class ServiceProvider:
             ServiceProvider.Specify, ServiceProvider.WoRMS, ServiceProvider.Broker]
 
  # .............................................................................
+class CONCURRENCY:
+    """Limits for querying service providers concurrently"""
+    # Query all requested providers at once; False queries one after another
+    FAN_OUT = True
+    # Threads shared by all interactive requests in one (gunicorn worker) process
+    MAX_WORKERS = 16
+    # Seconds to wait for a provider before returning a timeout error for it
+    PROVIDER_TIMEOUT = 20
+    # Seconds to wait for individual providers, overrides PROVIDER_TIMEOUT
+    PROVIDER_TIMEOUTS = {
+        ServiceProvider.IPNI[S2nKey.PARAM]: 30,
+        ServiceProvider.ITISSolr[S2nKey.PARAM]: 15,
+        ServiceProvider.WoRMS[S2nKey.PARAM]: 30,
+        }
+    # Batch requests: items resolved at once, each fanning out to up to 4 providers,
+    # so that provider queries do not wait long for a free thread
+    BATCH_WORKERS = MAX_WORKERS // 4
+    # Threads for the provider queries of batch items, separate from MAX_WORKERS so 
+    # that a large batch does not delay interactive requests
+    BATCH_PROVIDER_WORKERS = BATCH_WORKERS * 4
+    # Maximum number of items in one batch request
+    BATCH_MAX_SIZE = 10000
+
+
+# .............................................................................
+class HTTP_POOL:
+    """Keep-alive connection pools shared by all queries to a provider host"""
+    # Number of host pools to cache in each session adapter
+    POOL_CONNECTIONS = 4
+    # Open connections kept per host, at least one per concurrent provider query
+    POOL_MAXSIZE = CONCURRENCY.MAX_WORKERS
+    # Retry throttled (429) and server error (5xx) responses with exponential backoff
+    RETRY_TOTAL = 3
+    RETRY_BACKOFF_FACTOR = 0.5
+    RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+    # Read timeouts are not retried: a provider too slow to answer once would keep 
+    # the query waiting long past its deadline
+    RETRY_READ = 0
+    # Idempotent methods retried by default; POST requests may not be safe to send 
+    # twice, such as file uploads
+    RETRY_METHODS = ['HEAD', 'GET', 'OPTIONS']
+    # Methods retried for calls that opt in because their POST requests only query 
+    # (iDigBio search, GBIF parser, Solr select)
+    QUERY_RETRY_METHODS = RETRY_METHODS + ['POST']
+    # Seconds to wait to connect to a host, and between bytes of a response.  
+    # Provider queries run with a deadline also wait no longer than the time left.
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 60
+
+
+# .............................................................................
+class SOLR_UPDATE:
+    """Limits for posting documents to a Solr update handler in batches"""
+    # Documents (CSV records) sent in one update request
+    BATCH_SIZE = 5000
+    # Milliseconds within which Solr commits posted documents, instead of a 
+    # commit for each request
+    COMMIT_WITHIN = 10000
+    # Batches uploading at once
+    MAX_IN_FLIGHT = 4
+    # Times a failed batch is sent again, waiting RETRY_WAIT * 2**attempt 
+    # seconds before each; the only retries of updates
+    BATCH_RETRIES = 2
+    RETRY_WAIT = 2
+    # Seconds to wait for Solr to accept one batch
+    TIMEOUT = 120
+
+
+# .............................................................................
+class GUID_FILTER:
+    """Bloom filter of the GUIDs in the Specify resolver index, to answer GUIDs 
+    that are certainly not indexed without querying Solr"""
+    ENABLED = True
+    # Filter shared by all (gunicorn worker) processes, built with 
+    # lmtrex.tools.s2n.guid_filter; if missing, every GUID is queried in Solr
+    FILENAME = '/scratch-path/cache/spcoco_guids.bloom'
+    # Probability that a GUID not in the index is reported as possibly indexed
+    ERROR_RATE = 0.01
+    # A new filter holds this multiple of the GUIDs in the index, and at least 
+    # MIN_CAPACITY, leaving room for GUIDs added when datasets are indexed
+    CAPACITY_FACTOR = 2
+    MIN_CAPACITY = 100000
+    # Filters built longer ago than this (seconds) are ignored, in case GUIDs were
+    # indexed without adding them to the filter; rebuild at least this often
+    MAX_AGE = 24 * 60 * 60
+    # Seconds between checks for a newer filter file
+    RELOAD_INTERVAL = 60
+    # Only index_specify7_dataset on this host adds GUIDs to the filter.  With 
+    # CHECK_INDEX, a filter not updated since the last Solr commit is ignored, 
+    # checked every RELOAD_INTERVAL seconds, so GUIDs posted to Solr another way 
+    # are queried until the filter is rebuilt.  Without it, those GUIDs are 
+    # answered as not found for up to MAX_AGE seconds.  Solr and the broker must 
+    # share a clock.
+    CHECK_INDEX = True
+    # Seconds to wait for Solr when checking the index
+    CHECK_TIMEOUT = 5
+
+# .............................................................................
+class GUID_INDEX:
+    """Memory-mapped index of Specify resolver GUIDs to record URLs, to resolve 
+    GUIDs without querying Solr"""
+    # Records from the index hold only the GUID, dataset and URL 
+    ENABLED = False
+    # Index shared by all (gunicorn worker) processes, built with 
+    # lmtrex.tools.s2n.guid_index; if missing, GUIDs are resolved in Solr
+    FILENAME = '/scratch-path/cache/spcoco_urls.idx'
+    # Seconds after it is built that an index is stale and no longer used
+    MAX_AGE = 24 * 60 * 60
+    # Seconds between checks for a newer index file
+    RELOAD_INTERVAL = 60
+
+# .............................................................................
+class SOLR_EXPORT:
+    """Limits for reading every document in a Solr collection with a cursor"""
+    # Documents returned in one select request
+    PAGE_SIZE = 10000
+    # Field holding the collection's uniqueKey, which the cursor sort must include
+    UNIQUE_KEY = 'id'
+    # Seconds to wait for Solr to return one page
+    TIMEOUT = 120
+
+
+# .............................................................................
+class RESPONSE_CACHE:
+    """Cache of provider responses, keyed on query URL and headers"""
+    ENABLED = True
+    # Responses held in memory by each process, least recently used are evicted first
+    MAXSIZE = 10000
+    # Responses shared by all (gunicorn worker) processes; None to cache in memory only
+    DISK_PATH = '/scratch-path/cache/responses'
+    # Seconds a response remains valid, for providers without a value in TTLS
+    DEFAULT_TTL = 60 * 60
+    TTLS = {
+        ServiceProvider.GBIF[S2nKey.PARAM]: 24 * 60 * 60,
+        ServiceProvider.iDigBio[S2nKey.PARAM]: 6 * 60 * 60,
+        ServiceProvider.IPNI[S2nKey.PARAM]: 24 * 60 * 60,
+        ServiceProvider.ITISSolr[S2nKey.PARAM]: 24 * 60 * 60,
+        ServiceProvider.Lifemapper[S2nKey.PARAM]: 6 * 60 * 60,
+        ServiceProvider.MorphoSource[S2nKey.PARAM]: 6 * 60 * 60,
+        ServiceProvider.Specify[S2nKey.PARAM]: 15 * 60,
+        ServiceProvider.WoRMS[S2nKey.PARAM]: 24 * 60 * 60,
+        }
+    # Seconds an empty ("No match") response remains valid
+    NEGATIVE_TTL = 5 * 60
 
 
 # .............................................................................
@@ -492,6 +650,10 @@ class SPECIFY:
     RECORD_FORMAT = 'http://rs.tdwg.org/dwc.json'
     RESOLVER_COLLECTION = 'spcoco'
     RESOLVER_LOCATION = SYFT_BASE
+    # Solr host of the resolver collection, queried directly to resolve many GUIDs
+    RESOLVER_SOLR_LOCATION = 'notyeti-192.lifemapper.org'
+    # Maximum number of GUIDs resolved in one Solr request
+    RESOLVER_BATCH_SIZE = 500
     
 # ......................................................
 class SYFTER:
@@ -510,12 +672,17 @@ class GBIF:
     SPECIES_ID_FIELD = 'usageKey'
     WAIT_TIME = 180
     LIMIT = 300
+    # Occurrence counts per taxon change slowly, cache them (seconds, entries)
+    COUNT_CACHE_TTL = 6 * 60 * 60
+    COUNT_CACHE_SIZE = 50000
     VIEW_URL = 'https://www.gbif.org'
     REST_URL = 'https://api.gbif.org/v1'
     QUALIFIER = 'gbif:'
 
     SPECIES_SERVICE = 'species'
     PARSER_SERVICE = 'parser/name'
+    # Maximum number of names sent in one POST to the parser
+    PARSER_BATCH_SIZE = 1000
     OCCURRENCE_SERVICE = 'occurrence'
     DATASET_SERVICE = 'dataset'
     ORGANIZATION_SERVICE = 'organization'
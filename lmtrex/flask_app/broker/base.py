@@ -1,13 +1,19 @@
-from flask import Flask, Blueprint, request, json
-from werkzeug.exceptions import HTTPException
+import concurrent.futures
+import contextvars
+from flask import Flask, Blueprint, Response, request, json
+from http import HTTPStatus
+from werkzeug.exceptions import BadRequest, HTTPException
 
 import lmtrex.tools.s2n.utils as lmutil
-from lmtrex.common.lmconstants import (APIService, BrokerParameters, ServiceProvider)
+from lmtrex.common.lmconstants import (
+    APIService, BATCH_CONTENT_TYPES, BrokerParameters, CONCURRENCY, ServiceProvider)
 from lmtrex.common.s2n_type import S2nEndpoint, S2nKey, S2nOutput
 from lmtrex.tools.provider.gbif import GbifAPI
 from lmtrex.tools.provider.itis import ItisAPI
 
 app = Flask(__name__)
+# True while querying the items of a batch request
+_IN_BATCH = contextvars.ContextVar('s2n_in_batch', default=False)
 
 # .............................................................................
 class _S2nService:
@@ -54,7 +60,162 @@ class _S2nService:
             provnames.remove(ServiceProvider.Specify[S2nKey.PARAM])
             provnames.insert(0, ServiceProvider.Specify[S2nKey.PARAM])
         return provnames
+
+    # ...............................................
+    @classmethod
+    def _get_provider_timeout(cls, api_class, timeouts=None):
+        """Return seconds to wait for a provider, from timeouts or CONCURRENCY defaults.
+
+        Args:
+            api_class: provider API class, subclass of lmtrex.tools.provider.api.APIQuery
+            timeouts: optional dictionary of provider code to seconds, overrides 
+                CONCURRENCY.PROVIDER_TIMEOUTS
+        """
+        provcode = api_class.PROVIDER[S2nKey.PARAM]
+        for tdict in (timeouts, CONCURRENCY.PROVIDER_TIMEOUTS):
+            try:
+                return tdict[provcode]
+            except:
+                pass
+        return CONCURRENCY.PROVIDER_TIMEOUT
+
+    # ...............................................
+    @classmethod
+    def _query_providers(cls, queries, timeouts=None):
+        """Query service providers concurrently, returning responses in query order.
+
+        Args:
+            queries: ordered list of (provider API class, function, args) tuples, one for 
+                each requested provider.  Each function returns a S2nOutput.response 
+                dictionary.
+            timeouts: optional dictionary of provider code to seconds to wait for that 
+                provider before returning a timeout error for it.  Providers missing from 
+                timeouts use CONCURRENCY.PROVIDER_TIMEOUTS or CONCURRENCY.PROVIDER_TIMEOUT.
+
+        Return:
+            list of provider response dictionaries, in the same order as queries
+
+        Note:
+            A provider that does not answer in time gets a failure response with status 
+            HTTPStatus.GATEWAY_TIMEOUT; responses from other providers are unaffected.
+        Note: 
+            One provider is queried in its own thread, with its deadline, instead of 
+            in the shared thread pool.  If CONCURRENCY.FAN_OUT is False, queries run 
+            one after another in the request thread without a deadline.
+        Note:
+            Items of a batch request query providers in their own thread pool, of 
+            CONCURRENCY.BATCH_PROVIDER_WORKERS threads, leaving the shared pool to 
+            interactive requests.
+        """
+        calls = [(func, args) for (_, func, args) in queries]
+        prov_timeouts = [
+            cls._get_provider_timeout(api_class, timeouts) for (api_class, _, _) in queries]
+        if not CONCURRENCY.FAN_OUT:
+            results = lmutil.run_with_deadlines(calls, prov_timeouts)
+        elif len(calls) == 1:
+            func, args = calls[0]
+            results = [lmutil.run_with_deadline(
+                func, args, prov_timeouts[0], name='s2n_provider')]
+        else:
+            if _IN_BATCH.get():
+                executor = lmutil.get_executor(
+                    's2n_batch_provider', CONCURRENCY.BATCH_PROVIDER_WORKERS)
+            else:
+                executor = lmutil.get_executor('s2n_provider', CONCURRENCY.MAX_WORKERS)
+            results = lmutil.run_with_deadlines(calls, prov_timeouts, executor=executor)
+
+        responses = []
+        for (api_class, _, _), timeout, (response, err) in zip(queries, prov_timeouts, results):
+            if err is None:
+                responses.append(response)
+            elif isinstance(err, concurrent.futures.TimeoutError):
+                msg = api_class._get_error_message(
+                    msg='No response within {} seconds'.format(timeout))
+                output = api_class.get_api_failure(
+                    cls.SERVICE_TYPE['endpoint'], HTTPStatus.GATEWAY_TIMEOUT, 
+                    errinfo={'error': [msg]})
+                responses.append(output.response)
+            else:
+                output = api_class.get_api_failure(
+                    cls.SERVICE_TYPE['endpoint'], HTTPStatus.INTERNAL_SERVER_ERROR, 
+                    errinfo={'error': [api_class._get_error_message(err=err)]})
+                responses.append(output.response)
+        return responses
     
+    # ...............................................
+    @classmethod
+    def _check_batch(cls, items, param_name, stream_format):
+        """Raise BadRequest unless items is a list of strings no longer than
+        CONCURRENCY.BATCH_MAX_SIZE, and stream_format is in BATCH_CONTENT_TYPES."""
+        if (not isinstance(items, list) or not items 
+                or not all(isinstance(item, str) for item in items)):
+            raise BadRequest('Parameter {} must be a non-empty list of strings'.format(
+                param_name))
+        if len(items) > CONCURRENCY.BATCH_MAX_SIZE:
+            raise BadRequest('Parameter {} contains {} values, maximum is {}'.format(
+                param_name, len(items), CONCURRENCY.BATCH_MAX_SIZE))
+        if stream_format not in BATCH_CONTENT_TYPES:
+            raise BadRequest('Value {} for parameter format not in valid options {}'.format(
+                stream_format, list(BATCH_CONTENT_TYPES.keys())))
+
+    # ...............................................
+    @classmethod
+    def _query_batch(cls, func, items, failure_query_term):
+        """Return a generator of responses for func(item) for each item, in order.
+
+        Args:
+            func: function returning a S2nOutput.response dictionary for one item
+            items: list of values to query
+            failure_query_term: format string for the query_term of a failure 
+                response, filled with the item
+
+        Note:
+            Up to CONCURRENCY.BATCH_WORKERS items are queried at once.
+        """
+        executor = lmutil.get_executor('s2n_batch', CONCURRENCY.BATCH_WORKERS)
+        results = lmutil.run_bounded(
+            ((cls._query_batch_item, (func, item)) for item in items), executor, 
+            CONCURRENCY.BATCH_WORKERS)
+        for item, (response, err) in zip(items, results):
+            if err is not None:
+                response = cls.get_failure(
+                    query_term=failure_query_term.format(item), 
+                    errors={'error': ['{}: {}'.format(type(err).__name__, err)]}).response
+            yield response
+
+    # ...............................................
+    @classmethod
+    def _query_batch_item(cls, func, item):
+        """Return func(item), querying providers in the batch thread pool."""
+        token = _IN_BATCH.set(True)
+        try:
+            return func(item)
+        finally:
+            _IN_BATCH.reset(token)
+
+    # ...............................................
+    @classmethod
+    def _stream_responses(cls, responses, stream_format):
+        """Return a streamed Response containing each S2nOutput.response dictionary.
+
+        Args:
+            responses: iterable of response dictionaries
+            stream_format: 'ndjson' for one JSON document per line, or 'json' for a 
+                JSON array sent in chunks
+        """
+        def generate():
+            if stream_format == 'ndjson':
+                for response in responses:
+                    yield json.dumps(response) + '\n'
+            else:
+                yield '['
+                sep = ''
+                for response in responses:
+                    yield sep + json.dumps(response)
+                    sep = ','
+                yield ']'
+        return Response(generate(), mimetype=BATCH_CONTENT_TYPES[stream_format])
+
     # ...............................................
     @classmethod
     def get_providers(cls, filter_params=None):
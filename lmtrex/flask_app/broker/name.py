@@ -1,3 +1,4 @@
+import copy
 from http import HTTPStatus
 from werkzeug.exceptions import (BadRequest, InternalServerError)
 
@@ -10,7 +11,7 @@ from lmtrex.tools.provider.gbif import GbifAPI
 from lmtrex.tools.provider.ipni import IpniAPI
 from lmtrex.tools.provider.itis import ItisAPI
 from lmtrex.tools.provider.worms import WormsAPI
-from lmtrex.tools.s2n.utils import get_traceback
+from lmtrex.tools.s2n.utils import add_errinfo, get_traceback
 
 # .............................................................................
 class NameSvc(_S2nService):
@@ -36,28 +37,26 @@ class NameSvc(_S2nService):
                 keyfld = S2nSchema.get_gbif_taxonkey_fld()
                 cntfld = S2nSchema.get_gbif_occcount_fld()
                 urlfld = S2nSchema.get_gbif_occurl_fld()
-                for namerec in output.records:
+                # Query all counts together, then add more info to each record
+                taxon_keys = {}
+                for i, namerec in enumerate(output.records):
                     try:
-                        taxon_key = namerec[keyfld]
+                        taxon_keys[i] = namerec[keyfld]
                     except Exception as e:
                         print('No usageKey for counting {} records'.format(namestr))
+                counts = GbifAPI.count_occurrences_for_taxa(list(taxon_keys.values()))
+                for i, taxon_key in taxon_keys.items():
+                    namerec = output.records[i]
+                    count_output = counts[taxon_key]
+                    try:
+                        count_query = count_output.provider[S2nKey.PROVIDER_QUERY_URL][0]
+                        namerec[cntfld] = count_output.count
+                    except Exception as e:
+                        traceback = get_traceback()
+                        output.append_error('error', traceback)
                     else:
-                        # Add more info to each record
-                        try:
-                            count_output = GbifAPI.count_occurrences_for_taxon(taxon_key)
-                        except Exception as e:
-                            traceback = get_traceback()
-                            print(traceback)
-                        else:
-                            try:
-                                count_query = count_output.provider[S2nKey.PROVIDER_QUERY_URL][0]
-                                namerec[cntfld] = count_output.count
-                            except Exception as e:
-                                traceback = get_traceback()
-                                output.append_value(S2nKey.ERRORS, {'error': traceback})
-                            else:
-                                namerec[urlfld] = count_query
-                                prov_query_list.append(count_query)
+                        namerec[urlfld] = count_query
+                        prov_query_list.append(count_query)
                 # add count queries to list
                 output.set_value(S2nKey.PROVIDER_QUERY_URL, prov_query_list)
                 output.format_records(cls.ORDERED_FIELDNAMES)
@@ -111,34 +110,36 @@ class NameSvc(_S2nService):
     # ...............................................
     @classmethod
     def _get_records(
-            cls, namestr, req_providers, is_accepted, gbif_count, kingdom):
+            cls, namestr, req_providers, is_accepted, gbif_count, kingdom, timeouts=None):
         allrecs = []
         # for response metadata
         query_term = ''
         if namestr is not None:
             query_term = 'namestr={}&provider={}&is_accepted={}&gbif_count={}&kingdom={}'.format(
                 namestr, ','.join(req_providers), is_accepted, gbif_count, kingdom)
-            
-        for pr in req_providers:
+
+        # Query providers concurrently, in the order of response records
+        queries = []
+        for pr in cls._order_providers(req_providers):
             # Address single record
             if namestr is not None:
                 # GBIF
                 if pr == ServiceProvider.GBIF[S2nKey.PARAM]:
-                    goutput = cls._get_gbif_records(namestr, is_accepted, gbif_count)
-                    allrecs.append(goutput)
+                    queries.append(
+                        (GbifAPI, cls._get_gbif_records, (namestr, is_accepted, gbif_count)))
                 # IPNI
                 elif pr == ServiceProvider.IPNI[S2nKey.PARAM]:
-                    isoutput = cls._get_ipni_records(namestr, is_accepted)
-                    allrecs.append(isoutput)
+                    queries.append((IpniAPI, cls._get_ipni_records, (namestr, is_accepted)))
                 #  ITIS
                 elif pr == ServiceProvider.ITISSolr[S2nKey.PARAM]:
-                    isoutput = cls._get_itis_records(namestr, is_accepted, kingdom)
-                    allrecs.append(isoutput)
+                    queries.append(
+                        (ItisAPI, cls._get_itis_records, (namestr, is_accepted, kingdom)))
                 #  WoRMS
                 elif pr == ServiceProvider.WoRMS[S2nKey.PARAM]:
-                    woutput = cls._get_worms_records(namestr, is_accepted)
-                    allrecs.append(woutput)
+                    queries.append((WormsAPI, cls._get_worms_records, (namestr, is_accepted)))
             # TODO: enable filter parameters
+        if queries:
+            allrecs = cls._query_providers(queries, timeouts=timeouts)
             
         # Assemble
         prov_meta = cls._get_s2n_provider_response_elt(query_term=query_term)
@@ -208,6 +209,108 @@ class NameSvc(_S2nService):
                 raise InternalServerError(error_description)
 
         return output.response
+
+    # ...............................................
+    @classmethod
+    def _parse_names_with_gbif(cls, names):
+        """Return a dictionary of each name to its canonical name from the GBIF parser.
+        
+        Note:
+            Names that fail to parse map to themselves, as in parse_name_with_gbif.
+        """
+        canonical_names = {}
+        for rec in GbifAPI.parse_names(names=names):
+            try:
+                namestr = rec['canonicalName']
+                if namestr.startswith('? '):
+                    namestr = rec['scientificName']
+                canonical_names[rec['scientificName']] = namestr
+            except Exception:
+                pass
+        return {n: canonical_names.get(n, n) for n in names}
+
+    # ...............................................
+    @classmethod
+    def get_name_records_batch(
+            cls, names, provider=None, is_accepted=True, gbif_parse=True, gbif_count=True, 
+            kingdom=None, stream_format='ndjson'):
+        """Get taxon records for many scientific name strings from each requested and 
+        available name service.
+        
+        Args:
+            names: list of scientific names
+            provider: comma-delimited list of requested provider codes
+            is_accepted: flag to indicate whether to limit to 'valid' or  'accepted' taxa 
+            gbif_parse: flag to indicate whether to first parse all names into canonical 
+                names with one request to the GBIF parser
+            gbif_count: flag to indicate whether to count GBIF occurrences of each taxon
+            kingdom: not yet implemented
+            stream_format: 'ndjson' to return one JSON document per line, or 'json'
+                to return a JSON array
+
+        Return:
+            a flask.Response streaming one S2nOutput.response per name, in the same 
+            order as names, as each becomes available.
+            
+        Note:
+            Names with the same canonical name are queried once, up to 
+            CONCURRENCY.BATCH_WORKERS canonical names at a time.
+        """
+        cls._check_batch(names, 'names', stream_format)
+        # JSON null, like a missing value, parses names
+        if gbif_parse is None:
+            gbif_parse = True
+        try:
+            good_params, errinfo = cls._standardize_params(
+                provider=provider, is_accepted=is_accepted, gbif_count=gbif_count, 
+                kingdom=kingdom)
+            do_parse, valid_options = cls._fix_type_new('gbif_parse', gbif_parse)
+        except Exception as e:
+            raise BadRequest('Invalid parameters: {}'.format(e))
+        if valid_options is not None:
+            errinfo = add_errinfo(
+                errinfo, 'error', 
+                'Value {} for parameter gbif_parse is not in valid options {}'.format(
+                    gbif_parse, valid_options))
+        # Bad parameters
+        if 'error' in errinfo:
+            raise BadRequest('; '.join(errinfo['error']))
+        
+        if do_parse is True:
+            try:
+                canonical_names = cls._parse_names_with_gbif(names)
+            except Exception as e:
+                error_description = get_traceback()
+                raise InternalServerError(error_description)
+        else:
+            canonical_names = {n: n for n in names}
+        # Unique canonical names, in order of first use
+        unique_names = list(dict.fromkeys(canonical_names[n] for n in names))
+
+        def get_one(namestr):
+            output = cls._get_records(
+                namestr, good_params['provider'], good_params['is_accepted'], 
+                good_params['gbif_count'], good_params['kingdom'])
+            for err in errinfo.get('warning', []):
+                output.append_error('warning', err)
+            return output.response
+
+        def get_responses():
+            unique_responses = cls._query_batch(get_one, unique_names, 'namestr={}')
+            done = {}
+            for namestr in names:
+                canonical = canonical_names[namestr]
+                # Unique names are queried in order of first use, so at most one more
+                # response is needed for each input name
+                if canonical not in done:
+                    done[canonical] = next(unique_responses)
+                response = copy.deepcopy(done[canonical])
+                if canonical != namestr:
+                    response[S2nKey.ERRORS].setdefault('info', []).append(
+                        'Queried {} as parsed name {}'.format(namestr, canonical))
+                yield response
+
+        return cls._stream_responses(get_responses(), stream_format)
             
 
 # .............................................................................
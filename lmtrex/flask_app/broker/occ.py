@@ -10,7 +10,7 @@ from lmtrex.tools.provider.mopho import MorphoSourceAPI
 from lmtrex.tools.provider.specify import SpecifyPortalAPI
 from lmtrex.tools.provider.specify_resolver import SpecifyResolverAPI
 
-from lmtrex.tools.s2n.utils import get_traceback
+from lmtrex.tools.s2n.utils import add_errinfo, get_traceback
 
 from lmtrex.flask_app.broker.base import _S2nService
 
@@ -34,11 +34,14 @@ class OccurrenceSvc(_S2nService):
 
     # ...............................................
     @classmethod
-    def _get_specify_records(cls, occid, count_only):
-        # Resolve for record URL
-        spark = SpecifyResolverAPI()
-
-        api_url = spark.resolve_guid_to_url(occid)
+    def _get_specify_records(cls, occid, count_only, guid_urls=None):
+        """Get a Specify record, using a URL from guid_urls if it has been resolved."""
+        if guid_urls is not None:
+            api_url = guid_urls.get(occid)
+        else:
+            # Resolve for record URL
+            spark = SpecifyResolverAPI()
+            api_url = spark.resolve_guid_to_url(occid)
                 
         try:
             output = SpecifyPortalAPI.get_specify_record(occid, api_url, count_only)
@@ -106,8 +109,8 @@ class OccurrenceSvc(_S2nService):
 
     # ...............................................
     @classmethod
-    def _get_records(cls, occid, req_providers, count_only, gbif_dataset_key=None):
-        allrecs = []
+    def _get_records(
+            cls, occid, req_providers, count_only, gbif_dataset_key=None, guid_urls=None):
         # for response metadata
         query_term = None
         provstr = ','.join(req_providers)
@@ -119,30 +122,33 @@ class OccurrenceSvc(_S2nService):
             except:
                 pass
 
-        for pr in req_providers:
+        # Query providers concurrently, in the order of response records
+        queries = []
+        for pr in cls._order_providers(req_providers):
             # Address single record
             if occid is not None:
                 # GBIF
                 if pr == ServiceProvider.GBIF[S2nKey.PARAM]:
-                    gbif_output = cls._get_gbif_records(occid, gbif_dataset_key, count_only)
-                    allrecs.append(gbif_output)
+                    queries.append(
+                        (GbifAPI, cls._get_gbif_records, (occid, gbif_dataset_key, count_only)))
                 # iDigBio
                 elif pr == ServiceProvider.iDigBio[S2nKey.PARAM]:
-                    idb_output = cls._get_idb_records(occid, count_only)
-                    allrecs.append(idb_output)
+                    queries.append((IdigbioAPI, cls._get_idb_records, (occid, count_only)))
                 # MorphoSource
                 elif pr == ServiceProvider.MorphoSource[S2nKey.PARAM]:
-                    mopho_output = cls._get_mopho_records(occid, count_only)
-                    allrecs.append(mopho_output)
+                    queries.append(
+                        (MorphoSourceAPI, cls._get_mopho_records, (occid, count_only)))
                 # Specify
                 elif pr == ServiceProvider.Specify[S2nKey.PARAM]:
-                    sp_output = cls._get_specify_records(occid, count_only)
-                    allrecs.append(sp_output)
+                    queries.append(
+                        (SpecifyPortalAPI, cls._get_specify_records, 
+                         (occid, count_only, guid_urls)))
             # Filter by parameters
             elif gbif_dataset_key:
                 if pr == ServiceProvider.GBIF[S2nKey.PARAM]:
-                    gbif_output = cls._get_gbif_records(occid, gbif_dataset_key, count_only)
-                    allrecs.append(gbif_output)
+                    queries.append(
+                        (GbifAPI, cls._get_gbif_records, (occid, gbif_dataset_key, count_only)))
+        allrecs = cls._query_providers(queries)
 
         prov_meta = cls._get_s2n_provider_response_elt(query_term=query_term)
         # Assemble
@@ -208,6 +214,63 @@ class OccurrenceSvc(_S2nService):
 
         return output.response
 
+    # ...............................................
+    @classmethod
+    def get_occurrence_records_batch(
+            cls, occids, provider=None, count_only=False, stream_format='ndjson'):
+        """Get occurrence records for many dwc:occurrenceIDs from each available 
+        occurrence record service.
+        
+        Args:
+            occids: list of occurrenceIDs
+            provider: comma-delimited string of providers to query, None for all
+            count_only: flag to indicate whether to return only a count, or 
+                a count and records
+            stream_format: 'ndjson' to return one JSON document per line, or 'json'
+                to return a JSON array
+
+        Return:
+            a flask.Response streaming one S2nOutput.response per occid, in the 
+            same order as occids, as each becomes available.
+            
+        Note:
+            Up to CONCURRENCY.BATCH_WORKERS occids are queried at once.
+        Note:
+            Specify record URLs for all occids are resolved together first; if that 
+            fails, each occid is resolved separately, and each response gets a warning.
+        """
+        cls._check_batch(occids, 'occids', stream_format)
+        try:
+            good_params, errinfo = cls._standardize_params(
+                provider=provider, count_only=count_only)
+        except Exception as e:
+            error_description = get_traceback()
+            raise InternalServerError(error_description)
+        # Bad parameters
+        if 'error' in errinfo:
+            raise BadRequest('; '.join(errinfo['error']))
+
+        guid_urls = None
+        if ServiceProvider.Specify[S2nKey.PARAM] in good_params['provider']:
+            try:
+                guid_urls = SpecifyResolverAPI.resolve_guids_to_urls(occids)
+            except Exception as e:
+                errinfo = add_errinfo(
+                    errinfo, 'warning', 
+                    'Failed to resolve Specify GUIDs together ({}), resolved each'.format(e))
+
+        def get_one(occid):
+            output = cls._get_records(
+                occid, good_params['provider'], good_params['count_only'], 
+                guid_urls=guid_urls)
+            # Add message on invalid parameters to output
+            for err in errinfo.get('warning', []):
+                output.append_error('warning', err)
+            return output.response
+        
+        responses = cls._query_batch(get_one, occids, 'occid={}')
+        return cls._stream_responses(responses, stream_format)
+
 # .............................................................................
 if __name__ == '__main__':
     from lmtrex.common.lmconstants import TST_VALUES
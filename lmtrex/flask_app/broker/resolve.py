@@ -1,15 +1,12 @@
 from http import HTTPStatus
 from werkzeug.exceptions import (BadRequest, InternalServerError)
 
-from lmtrex.common.lmconstants import (APIService)
+from lmtrex.common.lmconstants import (APIService, SPECIFY)
 from lmtrex.common.s2n_type import (S2nKey, S2nOutput, S2nSchema, print_s2n_output)
 from lmtrex.flask_app.broker.base import _S2nService
 from lmtrex.tools.provider.specify_resolver import SpecifyResolverAPI
 from lmtrex.tools.s2n.utils import get_traceback
 
-collection = 'spcoco'
-solr_location = 'notyeti-192.lifemapper.org'
-
 # .............................................................................
 class ResolveSvc(_S2nService):
     """Query the Specify Resolver with a UUID for a resolvable GUID and URL"""
@@ -49,6 +46,22 @@ class ResolveSvc(_S2nService):
                 errinfo={'error': [traceback]})
         return output.response
 
+    # ...............................................
+    @classmethod
+    def resolve_specify_guids(cls, occids):
+        """Return a dictionary of each occid to the URL of its Specify record.
+        
+        Note:
+            URLs that do not give direct record access are None, as in get_url_from_meta.
+        """
+        urls = SpecifyResolverAPI.resolve_guids_to_urls(
+            occids, collection=SPECIFY.RESOLVER_COLLECTION, 
+            solr_location=SPECIFY.RESOLVER_SOLR_LOCATION)
+        for occid, url in urls.items():
+            if url is not None and not url.startswith('http'):
+                urls[occid] = None
+        return urls
+
     # ...............................................
     @classmethod
     def count_resolvable_specify_recs(cls):
@@ -124,6 +137,25 @@ class ResolveSvc(_S2nService):
                 raise InternalServerError(error_description)
         return output.response
 
+    # ...............................................
+    @classmethod
+    def get_guid_resolution_batch(cls, occids):
+        """Get the Specify record URL for each of many identifiers.
+        
+        Args:
+            occids: list of occurrenceIDs
+
+        Return:
+            A dictionary of each occid to the direct URL of its Specify record, or None 
+            if it is not resolvable.
+        """
+        cls._check_batch(occids, 'occids', 'json')
+        try:
+            return cls.resolve_specify_guids(occids)
+        except Exception as e:
+            error_description = get_traceback()
+            raise InternalServerError(error_description)
+
 
 # .............................................................................
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 from flask import Flask, jsonify, request, render_template, url_for
 import json
 import os
+from werkzeug.exceptions import BadRequest
 
 from lmtrex.common.lmconstants import (
     TEMPLATE_DIR, STATIC_DIR, SCHEMA_DIR, SCHEMA_FNAME)
@@ -154,6 +155,31 @@ def name_get(namestr):
         gbif_count=gbif_count)
     return response
 
+# .....................................................................................
+@app.route('/api/v1/name/batch', methods=['POST'])
+def name_batch():
+    """Get taxonomic name records for many scientific names from available providers.
+
+    The request body is a JSON object with keys:
+        names (list): Scientific names to search for among taxonomic providers.
+        provider (str): Optional comma-delimited providers to query.
+        is_accepted, gbif_parse, gbif_count (bool): Optional flags, as for a single name.
+        format (str): Optional 'ndjson' (default) or 'json'.
+
+    Returns:
+        A stream of dictionaries of metadata, one for each name in the request, as 
+        newline-delimited JSON or a JSON array.
+    """
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        raise BadRequest('Request body must be a JSON object')
+    response = NameSvc.get_name_records_batch(
+        body.get('names'), provider=body.get('provider'), 
+        is_accepted=body.get('is_accepted', True), gbif_parse=body.get('gbif_parse', True), 
+        gbif_count=body.get('gbif_count', True), kingdom=body.get('kingdom'), 
+        stream_format=body.get('format', 'ndjson'))
+    return response
+
 # .....................................................................................
 @app.route("/api/v1/occ/")
 def occ_endpoint():
@@ -186,6 +212,30 @@ def occ_get(identifier):
         occid=identifier, provider=provider, gbif_dataset_key=gbif_dataset_key, count_only=count_only)
     return response
 
+# .....................................................................................
+@app.route('/api/v1/occ/batch', methods=['POST'])
+def occ_batch():
+    """Get occurrence records for many occurrence identifiers from available providers.
+
+    The request body is a JSON object with keys:
+        occids (list): Occurrence identifiers to search for among occurrence providers.
+        provider (str): Optional comma-delimited providers to query.
+        count_only (bool): Optional flag to return only counts.
+        format (str): Optional 'ndjson' (default) or 'json'.
+
+    Returns:
+        A stream of dictionaries of metadata, one for each identifier in the request, as 
+        newline-delimited JSON or a JSON array.
+    """
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        raise BadRequest('Request body must be a JSON object')
+    response = OccurrenceSvc.get_occurrence_records_batch(
+        body.get('occids'), provider=body.get('provider'), 
+        count_only=body.get('count_only', False), 
+        stream_format=body.get('format', 'ndjson'))
+    return response
+
 # .....................................................................................
 @app.route("/api/v1/resolve/")
 def resolve_endpoint():
@@ -210,6 +260,23 @@ def resolve_get(identifier):
     response = ResolveSvc.get_guid_resolution(occid=identifier)
     return response
 
+# .....................................................................................
+@app.route('/api/v1/resolve/batch', methods=['POST'])
+def resolve_batch():
+    """Get direct URLs for many Specify GUIDs from the Specify Resolver.
+
+    The request body is a JSON object with keys:
+        occids (list): Occurrence identifiers registered in the Specify Cache.
+
+    Returns:
+        dict: A dictionary of each identifier to the URL of its record, or null.
+    """
+    body = request.get_json(force=True, silent=True)
+    if not isinstance(body, dict):
+        raise BadRequest('Request body must be a JSON object')
+    response = ResolveSvc.get_guid_resolution_batch(body.get('occids'))
+    return response
+
 # .....................................................................................
 @app.route("/api/v1/stats/")
 def stats_get():
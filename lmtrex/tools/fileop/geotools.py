@@ -1,11 +1,18 @@
+import concurrent.futures
 import glob
+import math
 import os
 from osgeo import ogr, osr
 import rtree
+import time
+
+from lmtrex.tools.s2n.utils import run_bounded
 
 EXTRA_VALS_KEY = 'rest'
 # Rough log of processing progress
 LOGINTERVAL = 1000000
+# Seconds between progress reports of long geometry operations
+PROGRESS_INTERVAL = 60
 LOG_FORMAT = ' '.join(["%(asctime)s",
                        "%(funcName)s",
                        "line",
@@ -18,6 +25,8 @@ LOGFILE_BACKUP_COUNT = 5
 
 REQUIRED_FIELDS = []
 CENTROID_FIELD = 'CENTROID'
+# Grid used by each intersect_write_shapefile worker process
+_WORKER_GRID = None
 
 # .............................
 def delete_shapefile(shp_filename):
@@ -96,111 +105,390 @@ def _create_empty_dataset(out_shp_filename, feature_attributes, ogr_type,
     return dataset, lyr
 
 # .............................................................................
-def get_clustered_spatial_index(shp_filename):
+class WkbIndex(rtree.index.Index):
+    """rtree index whose item objects are WKB bytes, stored without pickling."""
+    def dumps(self, obj):
+        return obj
+
+    def loads(self, string):
+        return string
+
+# .............................................................................
+def _get_index_filenames(shp_filename):
+    """Return the basename of an rtree index for a shapefile, and its files."""
     pth, basename = os.path.split(shp_filename)
     idxname, _ = os.path.splitext(basename)
-    idx_filename = os.path.join(pth, idxname)
+    # Named for the WKB objects, so indexes of pickled WKT are not reused
+    idx_filename = os.path.join(pth, '{}_wkb'.format(idxname))
+    return idx_filename, (idx_filename + '.dat', idx_filename + '.idx')
+
+# .............................................................................
+def _is_index_current(index_fnames, shp_filename):
+    """Return True if all index files are newer than the shapefile geometries."""
+    base, _ = os.path.splitext(shp_filename)
+    try:
+        idx_mtime = min(os.path.getmtime(fn) for fn in index_fnames)
+        shp_mtime = max(
+            os.path.getmtime(fn) for fn in (shp_filename, base + '.shx') 
+            if os.path.exists(fn))
+    except (OSError, ValueError):
+        return False
+    return idx_mtime >= shp_mtime
+
+# .............................................................................
+def _get_cell_records(lyr):
+    """Yield (fid, (xmin, xmax, ymin, ymax), WKB) for each feature in a layer."""
+    for feat in lyr:
+        geom = feat.GetGeometryRef()
+        # OGR returns xmin, xmax, ymin, ymax
+        yield feat.GetFID(), geom.GetEnvelope(), geom.ExportToWkb()
 
-    if not(os.path.exists(idx_filename+'.dat')):
+# .............................................................................
+def get_clustered_spatial_index(shp_filename):
+    """Return an rtree index of the features of a shapefile, with WKB of each.
+    
+    Note:
+        The index is saved next to the shapefile, bulk-loaded from all features 
+        at once, and rebuilt if the shapefile was modified after it.
+    """
+    idx_filename, index_fnames = _get_index_filenames(shp_filename)
+    if not _is_index_current(index_fnames, shp_filename):
+        for fn in index_fnames:
+            if os.path.exists(fn):
+                os.remove(fn)
         # Create spatial index
-        prop = rtree.index.Property()
-        prop.set_filename(idx_filename)
-        
         driver = ogr.GetDriverByName("ESRI Shapefile")
         datasrc = driver.Open(shp_filename, 0)
         lyr = datasrc.GetLayer()
-        spindex = rtree.index.Index(idx_filename, interleaved=False, properties=prop)
-        for fid in range(0, lyr.GetFeatureCount()):
-            feat = lyr.GetFeature(fid)
-            geom = feat.geometry()
-            wkt = geom.ExportToWkt()
-            # OGR returns xmin, xmax, ymin, ymax
-            xmin, xmax, ymin, ymax = geom.GetEnvelope()
-            # Rtree takes xmin, xmax, ymin, ymax IFF interleaved = False
-            spindex.insert(fid, (xmin, xmax, ymin, ymax), obj=wkt)
+        # Rtree takes xmin, xmax, ymin, ymax IFF interleaved = False
+        spindex = WkbIndex(
+            idx_filename, _get_cell_records(lyr), interleaved=False)
         # Write spatial index
         spindex.close()
-    else:
-        spindex = rtree.index.Index(idx_filename, interleaved=False)
-    return spindex
+        datasrc = None
+    return WkbIndex(idx_filename, interleaved=False)
 
 # .............................................................................
-def _refine_intersect(gc_wkt, poly, new_layer, feat_vals):
-    newfeat_count = 0
+class RegularGrid:
+    """Grid of equal rectangular cells in rows and columns from an origin.  Cell
+    geometries are computed on demand, instead of read from a spatial index.
+    """
+    # Largest coordinate difference treated as equal when detecting a grid
+    TOLERANCE = 1e-6
+    
+    # ...............................................
+    def __init__(self, origin, cell_size, ncols, nrows):
+        """Constructor
+        
+        Args:
+            origin: (x, y) of the lower left corner of the grid
+            cell_size: width of cells, or (width, height)
+            ncols: number of columns
+            nrows: number of rows
+        """
+        self.xmin, self.ymin = origin
+        try:
+            self.dx, self.dy = cell_size
+        except TypeError:
+            self.dx = self.dy = cell_size
+        self.ncols = ncols
+        self.nrows = nrows
+
+    # ...............................................
+    @classmethod
+    def from_extent(cls, extent, cell_size, origin=None):
+        """Return a grid covering an extent (xmin, xmax, ymin, ymax), in the order 
+        returned by OGR, with cells starting at origin (default xmin, ymin)."""
+        xmin, xmax, ymin, ymax = extent
+        if origin is None:
+            origin = (xmin, ymin)
+        grid = cls(origin, cell_size, 0, 0)
+        grid.ncols = math.ceil((xmax - grid.xmin) / grid.dx - cls.TOLERANCE)
+        grid.nrows = math.ceil((ymax - grid.ymin) / grid.dy - cls.TOLERANCE)
+        return grid
+
+    # ...............................................
+    @classmethod
+    def from_shapefile(cls, grid_shp_filename, cell_size, origin=None):
+        """Return a grid with the extent of a shapefile, without reading features."""
+        driver = ogr.GetDriverByName("ESRI Shapefile")
+        datasrc = driver.Open(grid_shp_filename, 0)
+        extent = datasrc.GetLayer().GetExtent()
+        datasrc = None
+        return cls.from_extent(extent, cell_size, origin=origin)
+
+    # ...............................................
+    @classmethod
+    def detect(cls, grid_shp_filename):
+        """Return the grid of a shapefile of equal, aligned, axis-parallel 
+        rectangles filling its extent, or None if it is not such a grid."""
+        driver = ogr.GetDriverByName("ESRI Shapefile")
+        datasrc = driver.Open(grid_shp_filename, 0)
+        lyr = datasrc.GetLayer()
+        grid = cell_area = None
+        cells = set()
+        for feat in lyr:
+            geom = feat.GetGeometryRef()
+            if geom is None or geom.GetGeometryName() != 'POLYGON':
+                return None
+            xmin, xmax, ymin, ymax = geom.GetEnvelope()
+            if grid is None:
+                grid = cls.from_extent(
+                    lyr.GetExtent(), (xmax - xmin, ymax - ymin))
+                cell_area = grid.dx * grid.dy
+            # A polygon with the area of its envelope is that rectangle
+            if abs(geom.GetArea() - cell_area) > cls.TOLERANCE * cell_area:
+                return None
+            col = (xmin - grid.xmin) / grid.dx
+            row = (ymin - grid.ymin) / grid.dy
+            if (abs(xmax - xmin - grid.dx) > cls.TOLERANCE or 
+                    abs(ymax - ymin - grid.dy) > cls.TOLERANCE or
+                    abs(col - round(col)) > cls.TOLERANCE or
+                    abs(row - round(row)) > cls.TOLERANCE):
+                return None
+            cells.add((round(col), round(row)))
+        if grid is None or len(cells) != lyr.GetFeatureCount() or \
+                len(cells) != grid.ncols * grid.nrows:
+            return None
+        return grid
+        
+    # ...............................................
+    def get_cell(self, col, row):
+        """Return the OGR polygon of a cell."""
+        x0 = self.xmin + col * self.dx
+        y0 = self.ymin + row * self.dy
+        x1 = x0 + self.dx
+        y1 = y0 + self.dy
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in ((x0, y0), (x0, y1), (x1, y1), (x1, y0), (x0, y0)):
+            ring.AddPoint_2D(x, y)
+        poly = ogr.Geometry(ogr.wkbPolygon)
+        poly.AddGeometryDirectly(ring)
+        return poly
+
+    # ...............................................
+    def get_cell_range(self, xmin, xmax, ymin, ymax):
+        """Return (first column, last column, first row, last row) of the cells 
+        touching an envelope, with first greater than last if there are none."""
+        col_min = max(0, math.floor((xmin - self.xmin) / self.dx))
+        col_max = min(self.ncols - 1, math.floor((xmax - self.xmin) / self.dx))
+        row_min = max(0, math.floor((ymin - self.ymin) / self.dy))
+        row_max = min(self.nrows - 1, math.floor((ymax - self.ymin) / self.dy))
+        return col_min, col_max, row_min, row_max
+
+    # ...............................................
+    def get_cells(self, xmin, xmax, ymin, ymax):
+        """Yield the OGR polygon of each cell touching an envelope, by row then 
+        column."""
+        col_min, col_max, row_min, row_max = self.get_cell_range(
+            xmin, xmax, ymin, ymax)
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                yield self.get_cell(col, row)
+
+# .............................................................................
+def _get_grid_cells(grid_index, envelope):
+    """Return geometries of the gridcells touching an envelope (xmin, xmax, ymin, 
+    ymax), from a RegularGrid or an rtree index of cell WKB."""
+    if isinstance(grid_index, RegularGrid):
+        return list(grid_index.get_cells(*envelope))
+    return [ogr.CreateGeometryFromWkb(item.object) 
+            for item in grid_index.intersection(envelope, objects=True)]
+
+# .............................................................................
+def _create_geometry(geom):
+    """Return an OGR geometry from WKB bytes or a WKT string."""
+    if isinstance(geom, (bytes, bytearray)):
+        return ogr.CreateGeometryFromWkb(bytes(geom))
+    return ogr.CreateGeometryFromWkt(geom)
+
+# .............................................................................
+def _refine_intersect(gridcell, poly):
+    """Return the simple polygons of the intersection of a polygon and gridcell, 
+    and the number of other intersecting geometries discarded."""
+    itx_polys = []
+    discarded = 0
     # select only the intersections
-    gridcell = ogr.CreateGeometryFromWkt(gc_wkt)
     if poly.Intersects(gridcell):
         intersection = poly.Intersection(gridcell)
         itxname = intersection.GetGeometryName()
         
         # Split polygon/gridcell intersection into 1 or more simple polygons
-        itx_polys = []
         if itxname == 'POLYGON':
             itx_polys.append(intersection)
         elif itxname in ('MULTIPOLYGON', 'GEOMETRYCOLLECTION'):
             for i in range(intersection.GetGeometryCount()):
                 subgeom = intersection.GetGeometryRef(i)
-                subname = subgeom.GetGeometryName()
-                if subname == 'POLYGON':
-                    itx_polys.append(subgeom)
+                if subgeom.GetGeometryName() == 'POLYGON':
+                    # Copy, subgeom belongs to the intersection
+                    itx_polys.append(subgeom.Clone())
                 else:
-                    print('{} intersection subgeom, simple {}, count {}'.format(
-                        subname, subgeom.IsSimple(), subgeom.GetGeometryCount()))
+                    discarded += 1
         else:
-            print('{} intersection geom, simple {}, count {}'.format(
-                itxname, intersection.IsSimple(), intersection.GetGeometryCount()))
-
-        # Make a feature from each simple polygon
-        for ipoly in itx_polys:
-            try:
-                newfeat = ogr.Feature(new_layer.GetLayerDefn())
-                # Makes a copy of the ipoly for the new feature
-                newfeat.SetGeometry(ipoly)
-                # put values into fieldnames
-                for fldname, fldval in feat_vals.items():
-                    if fldname != 'geometries' and fldval is not None:
-                        newfeat.SetField(fldname, fldval)
-            except Exception as e:
-                print('      Failed to fill feature, e = {}'.format(e))
-            else:
-                # Create new feature, setting FID, in this layer
-                new_layer.CreateFeature(newfeat)
-                newfeat.Destroy()
-                newfeat_count += 1
-    return newfeat_count
+            discarded += 1
+    return itx_polys, discarded
 
 # .............................................................................
-def intersect_write_shapefile(new_dataset, new_layer, feats, grid_index):
-    feat_count = 0
-    # for each feature
-    print ('Loop through {} poly features for intersection'.format(len(feats)))
-    for fid, feat_vals in feats.items():
-        curr_count = 0
-        # create new feature for every simple geometry
-        simple_wkts = feat_vals['geometries']
-        print ('  Loop through {} simple features in poly'.format(
-            len(simple_wkts)))
-        for wkt in simple_wkts:
-            # create a new feature
-            simple_geom = ogr.CreateGeometryFromWkt(wkt)
-            gname = simple_geom.GetGeometryName()
-            if gname != 'POLYGON':
-                print ('    Discard invalid {} subgeometry'.format(gname))
-            else:
-                # xmin, xmax, ymin, ymax
-                xmin, xmax, ymin, ymax = simple_geom.GetEnvelope()
-                hits = list(grid_index.intersection((xmin, xmax, ymin, ymax), 
-                                                    objects=True))
-                print ('    Loop through {} roughly intersected gridcells'.format(len(hits)))
-                for item in hits:
-                    gc_wkt = item.object
-                    newfeat_count = _refine_intersect(
-                        gc_wkt, simple_geom, new_layer, feat_vals)
-                    curr_count += newfeat_count
-#                     print ('  Created {} new features for simplified poly'.format(
-#                         newfeat_count))
-        print ('  Created {} new features for primary poly'.format(curr_count))
-        feat_count += curr_count
+def _intersect_feature(grid_index, geometries):
+    """Intersect the simple polygons of one feature with a grid.
+    
+    Args:
+        grid_index: RegularGrid or rtree index of gridcell WKB
+        geometries: list of WKB or WKT simple polygons of the feature
+        
+    Return:
+        list of WKB of the resulting simple polygons, in a deterministic order, 
+        and the number of non-polygon geometries discarded
+    """
+    itx_wkbs = []
+    discarded = 0
+    for geom in geometries:
+        simple_geom = _create_geometry(geom)
+        if simple_geom.GetGeometryName() != 'POLYGON':
+            discarded += 1
+            continue
+        # xmin, xmax, ymin, ymax
+        for gridcell in _get_grid_cells(grid_index, simple_geom.GetEnvelope()):
+            itx_polys, itx_discarded = _refine_intersect(gridcell, simple_geom)
+            itx_wkbs.extend(ipoly.ExportToWkb() for ipoly in itx_polys)
+            discarded += itx_discarded
+    return itx_wkbs, discarded
+
+# .............................................................................
+def _init_intersect_worker(grid_source):
+    """Open the grid in a worker process, from a RegularGrid or the basename of 
+    an existing rtree index."""
+    global _WORKER_GRID
+    if isinstance(grid_source, RegularGrid):
+        _WORKER_GRID = grid_source
+    else:
+        _WORKER_GRID = WkbIndex(grid_source, interleaved=False)
+
+# .............................................................................
+def _intersect_feature_in_worker(vals, geometries):
+    itx_wkbs, discarded = _intersect_feature(_WORKER_GRID, geometries)
+    return vals, itx_wkbs, discarded
+
+# .............................................................................
+def _intersect_serially(grid_index, tasks):
+    """Yield results like run_bounded for intersections in this process."""
+    for vals, geometries in tasks:
+        try:
+            itx_wkbs, discarded = _intersect_feature(grid_index, geometries)
+        except Exception as e:
+            yield None, e
+        else:
+            yield (vals, itx_wkbs, discarded), None
+
+# .............................................................................
+def _get_attribute_tuple(feat_vals):
+    """Return (fieldname, value) tuples of the non-empty attributes of a feature."""
+    return tuple(
+        (fldname, fldval) for fldname, fldval in feat_vals.items() 
+        if fldname != 'geometries' and fldval is not None)
+
+# .............................................................................
+def _get_intersect_tasks(feats):
+    """Yield (attribute tuple, geometries) for each feature, in input order."""
+    for feat_vals in feats:
+        yield _get_attribute_tuple(feat_vals), feat_vals['geometries']
+
+# .............................................................................
+def _write_feature(new_layer, wkb, vals):
+    """Create a feature in a layer from WKB and (fieldname, value) tuples."""
+    try:
+        newfeat = ogr.Feature(new_layer.GetLayerDefn())
+        # New geom can be assigned directly to new feature
+        newfeat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+        # put values into fieldnames
+        for fldname, fldval in vals:
+            newfeat.SetField(fldname, fldval)
+    except Exception as e:
+        print('      Failed to fill feature, e = {}'.format(e))
+        return False
+    # Create new feature, setting FID, in this layer
+    new_layer.CreateFeature(newfeat)
+    newfeat.Destroy()
+    return True
+
+# .............................................................................
+def _print_intersect_progress(done, total, feat_count, discarded, start):
+    if total is not None:
+        done = '{} of {}'.format(done, total)
+    print('  Intersected {} features, created {} new features, discarded {} '
+          'non-polygon geometries, {:.0f} sec'.format(
+              done, feat_count, discarded, time.time() - start))
+
+# .............................................................................
+def intersect_write_shapefile(new_dataset, new_layer, feats, grid_index, 
+                              processes=1, grid_shp_filename=None, total=None):
+    """Intersect features with a grid and write the simple polygons to a layer.
+    
+    Args:
+        new_dataset: an OGR dataset object for the new shapefile
+        new_layer: an OGR layer object for new features
+        feats: iterable of feature values, such as from _iter_complex_shapefile, 
+            with a list of WKB simple polygons in 'geometries'
+        grid_index: RegularGrid or rtree index of gridcell WKB
+        processes: number of processes intersecting features
+        grid_shp_filename: grid shapefile of the rtree index, whose index file is 
+            opened by each process when processes > 1 and grid_index is not a 
+            RegularGrid
+        total: optional number of features, for progress reports
+            
+    Raises:
+        Exception: if a feature fails to intersect, so that no incomplete 
+            shapefile is left without an error
+            
+    Note:
+        Features are read as they are intersected, so only those in progress 
+        are held in memory.
+        Worker processes intersect features and return WKB and attribute tuples; 
+        this process writes all features, in input order, so output FIDs and 
+        content do not depend on the number of processes.
+    """
+    feat_count = done = discarded = 0
+    print ('Loop through {} poly features for intersection'.format(
+        total if total is not None else 'all'))
+    start = last_report = time.time()
+    tasks = _get_intersect_tasks(feats)
+    executor = None
+    if processes > 1:
+        if isinstance(grid_index, RegularGrid):
+            grid_source = grid_index
+        elif grid_shp_filename is not None:
+            # Workers open the index built for grid_index, without rebuilding it
+            grid_source, _ = _get_index_filenames(grid_shp_filename)
+        else:
+            raise Exception('Parallel intersection requires a RegularGrid or grid_shp_filename')
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_intersect_worker, 
+            initargs=(grid_source,))
+        results = run_bounded(
+            ((_intersect_feature_in_worker, task) for task in tasks), executor, 
+            processes * 4)
+    else:
+        results = _intersect_serially(grid_index, tasks)
+        
+    try:
+        for result, err in results:
+            done += 1
+            if err is not None:
+                raise Exception('Failed to intersect feature {}: {}'.format(
+                    done, err)) from err
+            vals, itx_wkbs, itx_discarded = result
+            discarded += itx_discarded
+            for wkb in itx_wkbs:
+                if _write_feature(new_layer, wkb, vals):
+                    feat_count += 1
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                _print_intersect_progress(done, total, feat_count, discarded, start)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    _print_intersect_progress(done, total, feat_count, discarded, start)
     print ('Created {} new features from intersection'.format(feat_count))
     # Close and flush to disk
     new_dataset.Destroy()
@@ -212,33 +500,21 @@ def write_shapefile(new_dataset, new_layer, feature_sets, calc_nongeo_fields):
     Args:
         new_dataset: an OGR dataset object for the new shapefile
         new_layer: an OGR layer object with feature
+        feature_sets: list of iterables of feature values, such as from 
+            _iter_complex_shapefile, each with a list of WKB simple polygons in 
+            'geometries'.  Each is read as it is written.
         newfield_mapping = 
     """
     feat_count = 0
-    new_layer_def = new_layer.GetLayerDefn()
     # for each set of features
     for feats in feature_sets:
         # for each feature
-        for oldfid, feat_vals in feats.items():
+        for feat_vals in feats:
+            # put old dataset values into old fieldnames
+            vals = _get_attribute_tuple(feat_vals)
             # create new feature for every simple geometry
-            simple_geoms = feat_vals['geometries']
-            for wkt in simple_geoms:
-                try:
-                    # create a new feature
-                    newfeat = ogr.Feature(new_layer_def)
-                    poly = ogr.CreateGeometryFromWkt(wkt)
-                    # New geom can be assigned directly to new feature
-                    newfeat.SetGeometryDirectly(poly)
-                    # put old dataset values into old fieldnames
-                    for fldname, fldval in feat_vals.items():
-                        if fldname != 'geometries' and fldval is not None:
-                            newfeat.SetField(fldname, fldval)
-                except Exception as e:
-                    print('Failed to fill feature, e = {}'.format(e))
-                else:
-                    # Create new feature, setting FID, in this layer
-                    new_layer.CreateFeature(newfeat)
-                    newfeat.Destroy()
+            for wkb in feat_vals['geometries']:
+                if _write_feature(new_layer, wkb, vals):
                     feat_count += 1
         print('Wrote {} records from feature set'.format(feat_count))
         feat_count = 0
@@ -248,7 +524,8 @@ def write_shapefile(new_dataset, new_layer, feature_sets, calc_nongeo_fields):
 
 
 # .............................................................................
-def _read_complex_shapefile(in_shp_filename):
+def _open_shapefile(in_shp_filename):
+    """Return the OGR dataset and first layer of a shapefile."""
     ogr.RegisterAll()
     drv = ogr.GetDriverByName('ESRI Shapefile')
     try:
@@ -262,10 +539,11 @@ def _read_complex_shapefile(in_shp_filename):
     except Exception:
         print('Unable to get layer from {}'.format(in_shp_filename))
         raise 
+    return dataset, lyr
 
-    (min_x, max_x, min_y, max_y) = lyr.GetExtent()
-    bbox = (min_x, min_y, max_x, max_y)
-    lyr_def = lyr.GetLayerDefn()
+# .............................................................................
+def _get_feature_attributes(lyr_def):
+    """Return (fieldname, OGR type) of each field to be copied from a layer."""
     fld_count = lyr_def.GetFieldCount()
 
     # Read Fields (indexes start at 0)
@@ -279,14 +557,41 @@ def _read_complex_shapefile(in_shp_filename):
             if fldname == 'MRGID':
                 fldtype = ogr.OFTInteger
             feat_attrs.append((fldname, fldtype))
+    return feat_attrs
+
+# .............................................................................
+def _read_complex_shapefile_def(in_shp_filename):
+    """Return the fields, bbox and feature count of a shapefile, without reading 
+    features."""
+    dataset, lyr = _open_shapefile(in_shp_filename)
+    try:
+        (min_x, max_x, min_y, max_y) = lyr.GetExtent()
+        bbox = (min_x, min_y, max_x, max_y)
+        feat_attrs = _get_feature_attributes(lyr.GetLayerDefn())
+        feat_count = lyr.GetFeatureCount()
+    finally:
+        lyr = None
+        dataset = None
+    return feat_attrs, bbox, feat_count
+
+# .............................................................................
+def _iter_complex_shapefile(in_shp_filename):
+    """Yield the values of each feature in a shapefile, one at a time, in FID order.
+    
+    Note:
+        Values are a dictionary of field values, the centroid WKT of the original 
+        feature in CENTROID_FIELD, and a list of WKB of its simple polygons in 
+        'geometries'.  The shapefile is opened when the first feature is requested.
+    """
+    dataset, lyr = _open_shapefile(in_shp_filename)
+    feat_attrs = _get_feature_attributes(lyr.GetLayerDefn())
     
     # Read Features
-    feats = {}
     try:
-        old_feat_count = lyr.GetFeatureCount()
+        old_feat_count = 0
         new_feat_count = 0
-        for fid in range(0, lyr.GetFeatureCount()):
-            feat = lyr.GetFeature(fid)
+        for feat in lyr:
+            fid = feat.GetFID()
             feat_vals = {}
             for (fldname, _) in feat_attrs:
                 try:
@@ -303,15 +608,15 @@ def _read_complex_shapefile(in_shp_filename):
             centroid = geom.Centroid()
             feat_vals[CENTROID_FIELD] = centroid.ExportToWkt() 
             # Split multipolygon into 1 record - 1 simple polygon
-            feat_wkts = []
+            feat_wkbs = []
             if geom_name == 'POLYGON':
-                feat_wkts.append(geom.ExportToWkt())
+                feat_wkbs.append(geom.ExportToWkb())
             elif geom_name in ('MULTIPOLYGON', 'GEOMETRYCOLLECTION'):
                 for i in range(geom.GetGeometryCount()):
                     subgeom = geom.GetGeometryRef(i)
                     subname = subgeom.GetGeometryName()
                     if subname == 'POLYGON':
-                        feat_wkts.append(subgeom.ExportToWkt())
+                        feat_wkbs.append(subgeom.ExportToWkb())
                     else:
                         print('{} subgeom, simple {}, count {}'.format(
                             subname, subgeom.IsSimple(), subgeom.GetGeometryCount()))
@@ -319,11 +624,12 @@ def _read_complex_shapefile(in_shp_filename):
                 print('{} primary geom, simple {}, count {}'.format(
                     geom_name, geom.IsSimple(), geom.GetGeometryCount()))
             # Add one or more geometries to feature
-            if len(feat_wkts) == 0:
-                feat_wkts.append(geom.ExportToWkt())
-            feat_vals['geometries'] = feat_wkts
-            new_feat_count += len(feat_wkts)
-            feats[fid] = feat_vals
+            if len(feat_wkbs) == 0:
+                feat_wkbs.append(geom.ExportToWkb())
+            feat_vals['geometries'] = feat_wkbs
+            old_feat_count += 1
+            new_feat_count += len(feat_wkbs)
+            yield feat_vals
         print('Read {} features into {} simple features'.format(
             old_feat_count, new_feat_count))
 
@@ -334,8 +640,6 @@ def _read_complex_shapefile(in_shp_filename):
     finally:
         lyr = None
         dataset = None
-        
-    return feats, feat_attrs, bbox
 
 # .............................................................................
 def simplify_merge_polygon_shapefiles(in_shp_filenames, calc_fields, out_shp_filename):
@@ -353,9 +657,10 @@ def simplify_merge_polygon_shapefiles(in_shp_filenames, calc_fields, out_shp_fil
     feat_attrs_lst = []
     bboxes = []
     for shp_fname in in_shp_filenames:
-        # Calculate B_CENTROID and save values of original polygon/feature
-        feats, feat_attrs, bbox = _read_complex_shapefile(shp_fname)
-        features_lst.append(feats)
+        feat_attrs, bbox, _ = _read_complex_shapefile_def(shp_fname)
+        # Calculate B_CENTROID and save values of original polygon/feature, 
+        # reading each shapefile as it is written
+        features_lst.append(_iter_complex_shapefile(shp_fname))
         feat_attrs_lst.append(feat_attrs)
         bboxes.append(bbox)
 
@@ -393,7 +698,8 @@ def simplify_merge_polygon_shapefiles(in_shp_filenames, calc_fields, out_shp_fil
 
 # .............................................................................
 def intersect_polygon_with_grid(primary_shp_filename, grid_shp_filename, 
-                                calc_fields, out_shp_filename):
+                                calc_fields, out_shp_filename, cell_size=None, 
+                                grid_origin=None, processes=1):
     ''' Intersect a primary shapefile with a grid (or other simple polygon) 
     shapefile, simplifying multipolygons in the primary shapefile into simple 
     polygons. Intersect the simple polygons with gridcells in the second 
@@ -403,17 +709,39 @@ def intersect_polygon_with_grid(primary_shp_filename, grid_shp_filename,
         in_shp_filenames: list of one or more input shapefiles 
         grid_shp_filename: dictionary of new fields, fieldtypes
         out_shp_filename: output filename
+        cell_size: optional width, or (width, height), of the cells of a regular
+            grid covering the extent of grid_shp_filename
+        grid_origin: optional (x, y) of the lower left corner of the regular 
+            grid, default the lower left of the grid shapefile extent
+        processes: number of processes intersecting polygons with gridcells
+            
+    Note:
+        A regular grid, given by cell_size or detected in the grid shapefile, 
+        computes candidate gridcells from each polygon envelope.  Other grids 
+        are queried through an rtree spatial index.
     '''
     epsg_code = 4326
-    # Open input shapefile, read layer def
-    feats, feat_attrs, bbox = _read_complex_shapefile(primary_shp_filename)
+    # Open input shapefile, read layer def; features are read as they are 
+    # intersected
+    feat_attrs, bbox, feat_count = _read_complex_shapefile_def(primary_shp_filename)
+    feats = _iter_complex_shapefile(primary_shp_filename)
     
     # Add new attributes including B_CENTROID
     for calc_fldname, calc_fldtype in calc_fields.items():
         feat_attrs.append((calc_fldname, calc_fldtype))
          
-    # Get spatial index for grid with WKT for each cell
-    grid_index = get_clustered_spatial_index(grid_shp_filename)
+    # Compute cells of a regular grid, or get spatial index for grid with WKB 
+    # for each cell
+    if cell_size is not None:
+        grid_index = RegularGrid.from_shapefile(
+            grid_shp_filename, cell_size, origin=grid_origin)
+    else:
+        grid_index = RegularGrid.detect(grid_shp_filename)
+    if grid_index is None:
+        grid_index = get_clustered_spatial_index(grid_shp_filename)
+    else:
+        print('Intersect with regular grid of {} x {} cells of {} x {}'.format(
+            grid_index.ncols, grid_index.nrows, grid_index.dx, grid_index.dy))
  
     # ......................... Create structure .........................
     out_dataset, out_layer = _create_empty_dataset(
@@ -421,7 +749,9 @@ def intersect_polygon_with_grid(primary_shp_filename, grid_shp_filename,
         overwrite=True)
        
     # ......................... Intersect polygons .........................
-    intersect_write_shapefile(out_dataset, out_layer, feats, grid_index)
+    intersect_write_shapefile(
+        out_dataset, out_layer, feats, grid_index, processes=processes, 
+        grid_shp_filename=grid_shp_filename, total=feat_count)
         
 
 # ...............................................
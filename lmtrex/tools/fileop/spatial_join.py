@@ -0,0 +1,344 @@
+"""Module to annotate occurrence points with attributes of the polygons containing them"""
+import numpy as np
+import time
+
+from osgeo import ogr
+
+from lmtrex.common.lmconstants import ENCODING
+from lmtrex.tools.fileop.csvtools import get_csv_reader, get_csv_writer
+from lmtrex.tools.fileop.geotools import RegularGrid
+
+# Records read, annotated and written at once
+BATCH_SIZE = 100000
+# Largest number of point/edge pairs tested at once in a polygon
+MAX_TEST_SIZE = 2**22
+# Seconds between progress reports
+PROGRESS_INTERVAL = 60
+
+# .............................................................................
+class PreparedPolygon:
+    """Polygon whose ring edges are held in arrays to test many points at once."""
+    # ...............................................
+    def __init__(self, geom, value_idx):
+        """Constructor
+
+        Args:
+            geom: OGR polygon
+            value_idx: index of the attribute values of the polygon's feature
+        """
+        self.value_idx = value_idx
+        # xmin, xmax, ymin, ymax
+        self.envelope = geom.GetEnvelope()
+        self.area = geom.GetArea()
+        x1, y1, x2, y2 = [], [], [], []
+        for i in range(geom.GetGeometryCount()):
+            pts = np.array(geom.GetGeometryRef(i).GetPoints(), dtype=np.float64)
+            if len(pts) < 3:
+                continue
+            pts = pts[:, :2]
+            if not np.array_equal(pts[0], pts[-1]):
+                pts = np.vstack([pts, pts[:1]])
+            x1.append(pts[:-1, 0])
+            y1.append(pts[:-1, 1])
+            x2.append(pts[1:, 0])
+            y2.append(pts[1:, 1])
+        if x1:
+            x1, y1 = np.concatenate(x1), np.concatenate(y1)
+            x2, y2 = np.concatenate(x2), np.concatenate(y2)
+            # Horizontal edges are never crossed, keep only the others
+            keep = y1 != y2
+            self._x1, self._y1, self._y2 = x1[keep], y1[keep], y2[keep]
+            self._slope = (x2[keep] - x1[keep]) / (y2[keep] - y1[keep])
+        else:
+            self._x1 = self._y1 = self._y2 = self._slope = np.empty(0)
+
+    # ...............................................
+    def covers(self, xmin, xmax, ymin, ymax, tolerance=RegularGrid.TOLERANCE):
+        """Return True if the polygon is the rectangle xmin, xmax, ymin, ymax."""
+        cell_area = (xmax - xmin) * (ymax - ymin)
+        return (
+            all(abs(a - b) <= tolerance
+                for a, b in zip(self.envelope, (xmin, xmax, ymin, ymax))) and
+            abs(self.area - cell_area) <= tolerance * cell_area)
+
+    # ...............................................
+    def contains(self, x, y):
+        """Return a boolean array, True for each point inside the polygon.
+
+        Note:
+            Uses the even-odd rule, counting crossings of a ray from each point
+            to the east; points on an edge may fall on either side.
+        """
+        xmin, xmax, ymin, ymax = self.envelope
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        candidates = np.nonzero(inside)[0]
+        nedges = len(self._x1)
+        step = max(1, MAX_TEST_SIZE // max(1, nedges))
+        for start in range(0, len(candidates), step):
+            idx = candidates[start:start + step]
+            px = x[idx, np.newaxis]
+            py = y[idx, np.newaxis]
+            spans = (self._y1 > py) != (self._y2 > py)
+            crossings = spans & (px < self._x1 + (py - self._y1) * self._slope)
+            inside[idx] = np.count_nonzero(crossings, axis=1) % 2 == 1
+        return inside
+
+# .............................................................................
+def _get_last_bucket(hi, origin, size, first, last):
+    """Return the last bucket, from first to last, along one axis of a grid 
+    holding points below the coordinate hi, computed like PolygonBuckets.find."""
+    offset = hi - origin
+    if offset % size == 0:
+        last = min(last, int(offset // size) - 1)
+    return max(first, last)
+
+# .............................................................................
+class PolygonBuckets:
+    """Polygons of a shapefile, grouped by the cells of a regular grid they touch,
+    to find the polygon containing each of many points.
+
+    Note:
+        Polygons of a shapefile already intersected with a grid, such as from
+        intersect_polygon_with_grid, fall in one bucket each when bucket_size
+        matches the grid.  A polygon that is a whole bucket is assigned to its
+        points without testing them.
+    """
+    # ...............................................
+    def __init__(self, poly_shp_filename, fieldnames=None, bucket_size=2.5,
+                 extent=(-180, 180, -90, 90)):
+        """Constructor
+
+        Args:
+            poly_shp_filename: shapefile of polygons or multipolygons
+            fieldnames: fields of the shapefile to return, all if None
+            bucket_size: width, or (width, height), of buckets
+            extent: (xmin, xmax, ymin, ymax) of the bucket grid; points outside
+                are in no polygon
+        """
+        self.grid = RegularGrid.from_extent(extent, bucket_size)
+        # bucket key: list of PreparedPolygon, in feature order
+        self._buckets = {}
+        # bucket key: index of values of the polygon that is the whole bucket
+        self._full = {}
+        self.values = []
+
+        driver = ogr.GetDriverByName("ESRI Shapefile")
+        datasrc = driver.Open(poly_shp_filename, 0)
+        lyr = datasrc.GetLayer()
+        if fieldnames is None:
+            lyr_def = lyr.GetLayerDefn()
+            fieldnames = [lyr_def.GetFieldDefn(i).GetNameRef()
+                          for i in range(lyr_def.GetFieldCount())]
+        self.fieldnames = list(fieldnames)
+
+        poly_count = 0
+        for feat in lyr:
+            geom = feat.GetGeometryRef()
+            if geom is None:
+                continue
+            value_idx = len(self.values)
+            self.values.append(
+                [feat.GetFieldAsString(fldname) for fldname in self.fieldnames])
+            gname = geom.GetGeometryName()
+            if gname == 'POLYGON':
+                polys = [geom]
+            elif gname in ('MULTIPOLYGON', 'GEOMETRYCOLLECTION'):
+                polys = [geom.GetGeometryRef(i) for i in range(geom.GetGeometryCount())
+                         if geom.GetGeometryRef(i).GetGeometryName() == 'POLYGON']
+            else:
+                polys = []
+            for poly in polys:
+                self._add(PreparedPolygon(poly, value_idx))
+                poly_count += 1
+        datasrc = None
+        print('Read {} polygons of {} features into {} buckets, {} whole buckets'.format(
+            poly_count, len(self.values), len(self._buckets), len(self._full)))
+
+    # ...............................................
+    def _add(self, prepared):
+        grid = self.grid
+        xmin, xmax, ymin, ymax = prepared.envelope
+        col_min, col_max, row_min, row_max = grid.get_cell_range(
+            xmin, xmax, ymin, ymax)
+        # Points on the east and north edges of a polygon are outside it, so skip
+        # buckets the polygon touches only along those edges
+        col_max = _get_last_bucket(xmax, grid.xmin, grid.dx, col_min, col_max)
+        row_max = _get_last_bucket(ymax, grid.ymin, grid.dy, row_min, row_max)
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                key = row * self.grid.ncols + col
+                x0 = self.grid.xmin + col * self.grid.dx
+                y0 = self.grid.ymin + row * self.grid.dy
+                if key not in self._full and prepared.covers(
+                        x0, x0 + self.grid.dx, y0, y0 + self.grid.dy):
+                    self._full[key] = prepared.value_idx
+                self._buckets.setdefault(key, []).append(prepared)
+
+    # ...............................................
+    def find(self, x, y):
+        """Return the index of the values of the polygon containing each point.
+
+        Args:
+            x: array of point longitudes
+            y: array of point latitudes, NaN for points without coordinates
+
+        Return:
+            integer array with an index into self.values, or -1 for points in no
+            polygon.  Points in more than one polygon get the first in the file.
+        """
+        grid = self.grid
+        found = np.full(len(x), -1, dtype=np.int64)
+        with np.errstate(invalid='ignore'):
+            in_grid = (
+                (x >= grid.xmin) & (x <= grid.xmin + grid.ncols * grid.dx) &
+                (y >= grid.ymin) & (y <= grid.ymin + grid.nrows * grid.dy))
+        idx = np.nonzero(in_grid)[0]
+        # Points on the east or north edge of the grid are in the last bucket
+        cols = np.minimum(
+            ((x[idx] - grid.xmin) // grid.dx).astype(np.int64), grid.ncols - 1)
+        rows = np.minimum(
+            ((y[idx] - grid.ymin) // grid.dy).astype(np.int64), grid.nrows - 1)
+        keys = rows * grid.ncols + cols
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        idx = idx[order]
+        ukeys, starts = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], len(keys))
+
+        for key, start, end in zip(ukeys.tolist(), starts.tolist(), ends.tolist()):
+            pts = idx[start:end]
+            try:
+                found[pts] = self._full[key]
+                continue
+            except KeyError:
+                pass
+            for prepared in self._buckets.get(key, []):
+                inside = prepared.contains(x[pts], y[pts])
+                found[pts[inside]] = prepared.value_idx
+                pts = pts[~inside]
+                if len(pts) == 0:
+                    break
+        return found
+
+# .............................................................................
+def _get_coordinates(rows, idx):
+    """Return an array of the float values in one column of rows, NaN if invalid."""
+    vals = [row[idx] if len(row) > idx else '' for row in rows]
+    try:
+        return np.array(vals, dtype=np.float64)
+    except ValueError:
+        coords = np.empty(len(vals), dtype=np.float64)
+        for i, val in enumerate(vals):
+            try:
+                coords[i] = float(val)
+            except ValueError:
+                coords[i] = np.nan
+        return coords
+
+# .............................................................................
+def _iter_row_batches(rdr, batch_size):
+    batch = []
+    for row in rdr:
+        if row:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# .............................................................................
+def annotate_occurrence_csv(
+        in_csv_filename, out_csv_filename, poly_shp_filename, fieldnames=None,
+        delimiter=',', latitude_field='decimalLatitude',
+        longitude_field='decimalLongitude', bucket_size=2.5,
+        batch_size=BATCH_SIZE):
+    """Add attributes of the polygon containing each occurrence point to a CSV file.
+
+    Args:
+        in_csv_filename: occurrence file with a header, and latitude and
+            longitude in decimal degrees
+        out_csv_filename: output file, with the input fields followed by
+            fieldnames; empty values for records in no polygon
+        poly_shp_filename: shapefile of polygons, such as the gridded boundaries
+            from intersect_polygon_with_grid
+        fieldnames: fields of the shapefile to add, all if None
+        delimiter: field separator of input and output files
+        latitude_field: fieldname of latitude values
+        longitude_field: fieldname of longitude values
+        bucket_size: width of buckets grouping polygons, such as the cell size of
+            the grid the polygons were intersected with
+        batch_size: number of records read, annotated and written at once
+
+    Return:
+        number of records, and number of records in a polygon
+
+    Note:
+        Records are streamed in batches, so memory is bounded by the polygons and
+        one batch.
+    """
+    buckets = PolygonBuckets(
+        poly_shp_filename, fieldnames=fieldnames, bucket_size=bucket_size)
+    empty_vals = [''] * len(buckets.fieldnames)
+    rec_count = found_count = 0
+    start = last_report = time.time()
+
+    rdr, inf = get_csv_reader(in_csv_filename, delimiter, ENCODING)
+    try:
+        wtr, outf = get_csv_writer(out_csv_filename, delimiter, ENCODING)
+        try:
+            header = next(rdr)
+            try:
+                lat_idx = header.index(latitude_field)
+                lon_idx = header.index(longitude_field)
+            except ValueError:
+                raise Exception('Missing {} or {} field in {}'.format(
+                    latitude_field, longitude_field, in_csv_filename))
+            wtr.writerow(header + buckets.fieldnames)
+
+            for batch in _iter_row_batches(rdr, batch_size):
+                found = buckets.find(
+                    _get_coordinates(batch, lon_idx),
+                    _get_coordinates(batch, lat_idx))
+                for row, value_idx in zip(batch, found.tolist()):
+                    if value_idx < 0:
+                        wtr.writerow(row + empty_vals)
+                    else:
+                        wtr.writerow(row + buckets.values[value_idx])
+                        found_count += 1
+                rec_count += len(batch)
+                now = time.time()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    print('Annotated {} records, {} in polygons, {:.0f} sec'.format(
+                        rec_count, found_count, now - start))
+        finally:
+            outf.close()
+    finally:
+        inf.close()
+    print('Annotated {} records, {} in polygons, {:.0f} sec'.format(
+        rec_count, found_count, time.time() - start))
+    return rec_count, found_count
+
+
+# .............................................................................
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=('Add attributes of containing polygons to occurrence records.'))
+    parser.add_argument('in_csv_filename', type=str, help='Occurrence CSV file')
+    parser.add_argument('out_csv_filename', type=str, help='Annotated output file')
+    parser.add_argument(
+        'poly_shp_filename', type=str,
+        help='Polygon shapefile, such as eez_gridded_boundaries_2.5.shp')
+    parser.add_argument(
+        '--delimiter', type=str, default=',', help='Field separator')
+    parser.add_argument(
+        '--bucket_size', type=float, default=2.5,
+        help='Cell size of the grid the polygons were intersected with')
+    args = parser.parse_args()
+
+    annotate_occurrence_csv(
+        args.in_csv_filename, args.out_csv_filename, args.poly_shp_filename,
+        delimiter=args.delimiter, bucket_size=args.bucket_size)
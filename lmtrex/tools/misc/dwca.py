@@ -1,20 +1,41 @@
+import concurrent.futures
+import csv
+import gzip
+import hashlib
+import io
+import json
+import mmap
+import operator
 import os
+import re
 import requests
+import shutil
+import tempfile
+import time
 import xml.etree.ElementTree as ET
 import zipfile
 
 from lmtrex.common.lmconstants import (
     SPECIFY_ARK_PREFIX, DWCA, ENCODING, TEST_SPECIFY7_SERVER, TST_VALUES,
-    SPECIFY7_RECORD_ENDPOINT, SPECIFY7_SERVER_KEY, SPCOCO_FIELDS)
+    SPECIFY7_RECORD_ENDPOINT, SPECIFY7_SERVER_KEY, SPCOCO_FIELDS, SOLR_EXPORT,
+    GUID_FILTER)
 from lmtrex.tools.fileop.logtools import (LMLog, log_info, log_warn, log_error)
-from lmtrex.tools.fileop.csvtools import (get_csv_dict_reader, get_csv_dict_writer)
-from lmtrex.tools.fileop.ready_file import ready_filename, delete_file
-from lmtrex.tools.provider.api import APIQuery
+from lmtrex.tools.fileop.csvtools import get_csv_reader, get_csv_writer
+from lmtrex.tools.fileop.ready_file import delete_file
+from lmtrex.tools.provider.api import APIQuery, get_session
 import lmtrex.tools.misc.solr as SpSolr
+from lmtrex.tools.s2n.guid_filter import add_guids_to_filter
 from lmtrex.tools.s2n.utils import is_valid_uuid
 
 
 INCR_KEY = 0
+# Extension of a dataset manifest saved before its changes are posted
+MANIFEST_PENDING_EXT = '.pending'
+# Extensions of a DWCA file being downloaded, and of its download metadata
+DOWNLOAD_PART_EXT = '.part'
+DOWNLOAD_META_EXT = '.download.json'
+# Extension of an empty file marking when a DWCA file was indexed
+INDEXED_EXT = '.indexed'
 
 """
 Pull dataset/record guids from specify RSS
@@ -89,6 +110,158 @@ def assemble_download_filename(url, baseoutpath):
         outfilename = os.path.join(baseoutpath, name, '{}.zip'.format(name))
     return outfilename
         
+# ......................................................
+def _read_download_meta(meta_fname):
+    try:
+        with open(meta_fname, 'r', encoding=ENCODING) as in_file:
+            return json.load(in_file)
+    except (OSError, ValueError):
+        return {}
+
+# ......................................................
+def _write_download_meta(meta_fname, meta):
+    tmpname = meta_fname + '.tmp'
+    with open(tmpname, 'w', encoding=ENCODING) as out_file:
+        json.dump(meta, out_file)
+    os.replace(tmpname, meta_fname)
+
+# ......................................................
+def _download_to_part(url, part_fname, meta, meta_fname, headers, logger):
+    """Make one request for a DWCA, appending to or replacing the partial file.
+    
+    Returns:
+        expected size of the complete file, or None if unknown, and False if the 
+        server reports the file is not modified
+    """
+    session = get_session(url)
+    with session.get(
+            url, headers=headers, stream=True, 
+            timeout=DWCA.DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 304:
+            return None, False
+        if response.status_code == 416:
+            # Partial file is complete or invalid, download it all again
+            os.remove(part_fname)
+            meta.pop('partial', None)
+        response.raise_for_status()
+        expected_size = None
+        if response.status_code == 206:
+            mode = 'ab'
+            # Content-Range: bytes start-end/total
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if total.isdigit():
+                expected_size = int(total)
+            log_info('Resuming download of {} at byte {}'.format(
+                url, os.path.getsize(part_fname)), logger=logger)
+        else:
+            mode = 'wb'
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit():
+                expected_size = int(length)
+        # Save validators of the partial file before writing, to resume it
+        meta['partial'] = {
+            'etag': response.headers.get('ETag'), 
+            'last_modified': response.headers.get('Last-Modified'),
+            'size': expected_size}
+        _write_download_meta(meta_fname, meta)
+        with open(part_fname, mode) as out_file:
+            for chunk in response.iter_content(chunk_size=DWCA.DOWNLOAD_CHUNK_BYTES):
+                out_file.write(chunk)
+    return expected_size, True
+
+# ......................................................
+def download_dwca_if_changed(url, baseoutpath, overwrite=False, logger=None):
+    """Download a DarwinCore Archive file from a URL if it changed since the 
+    last download, resuming an interrupted download.
+    
+    Args:
+        url: location of DWCA data file
+        baseoutpath: destination directory for DWCA file
+        overwrite: True to download the whole file even if it is unchanged
+        logger: optional logger for saving output messages to file.
+    
+    Returns:
+        full filename of the DWCA file, and True if it was downloaded
+        
+    Raises:
+        Exception: if the download failed after DWCA.DOWNLOAD_RETRIES attempts,
+            or the file is incomplete or not a zipfile
+        
+    Note:
+        The response is written in chunks to a partial file, which replaces the 
+        DWCA file once its size is verified.  A sidecar JSON file saves the 
+        ETag, Last-Modified, size and SHA-256 checksum of the DWCA file, used 
+        to request it only if modified, and validators of a partial file, used 
+        to request only the missing bytes if the remote file is unchanged.
+    """
+    outfilename = assemble_download_filename(url, baseoutpath)
+    part_fname = outfilename + DOWNLOAD_PART_EXT
+    meta_fname = outfilename + DOWNLOAD_META_EXT
+    os.makedirs(os.path.dirname(outfilename), exist_ok=True)
+    meta = {}
+    if overwrite:
+        for fname in (part_fname, meta_fname):
+            if os.path.exists(fname):
+                os.remove(fname)
+    else:
+        meta = _read_download_meta(meta_fname)
+    
+    for attempt in range(DWCA.DOWNLOAD_RETRIES + 1):
+        headers = {}
+        partial = meta.get('partial') or {}
+        validator = partial.get('etag') or partial.get('last_modified')
+        if os.path.exists(part_fname) and validator:
+            # Bytes after the partial file, if the remote file is unchanged
+            headers['Range'] = 'bytes={}-'.format(os.path.getsize(part_fname))
+            headers['If-Range'] = validator
+        elif os.path.exists(outfilename) and meta.get('size') is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            expected_size, is_modified = _download_to_part(
+                url, part_fname, meta, meta_fname, headers, logger)
+        except requests.RequestException as e:
+            if attempt == DWCA.DOWNLOAD_RETRIES:
+                log_error('Failed on URL {} ({})'.format(url, e), logger=logger)
+                raise
+            log_warn('Retrying URL {} after error ({})'.format(url, e), logger=logger)
+            continue
+        if not is_modified:
+            log_info('DWCA {} is not modified'.format(url), logger=logger)
+            return outfilename, False
+        break
+        
+    size = os.path.getsize(part_fname)
+    if expected_size is not None and size != expected_size:
+        raise Exception('Downloaded {} of {} bytes from {}'.format(
+            size, expected_size, url))
+    if not zipfile.is_zipfile(part_fname):
+        os.remove(part_fname)
+        meta.pop('partial', None)
+        _write_download_meta(meta_fname, meta)
+        raise Exception('Download from {} is not a zipfile'.format(url))
+    
+    partial = meta.pop('partial')
+    meta.update({
+        'url': url, 'etag': partial['etag'], 
+        'last_modified': partial['last_modified'], 'size': size, 
+        'sha256': _get_file_checksum(part_fname)})
+    os.replace(part_fname, outfilename)
+    _write_download_meta(meta_fname, meta)
+    log_info('Downloaded {} bytes from {} to {}'.format(size, url, outfilename), 
+             logger=logger)
+    return outfilename, True
+
+# ......................................................
+def _get_file_checksum(fname):
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(DWCA.DOWNLOAD_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 # ......................................................
 def download_dwca(url, baseoutpath, overwrite=False, logger=None):
     """Download a DarwinCore Archive file from a URL.
@@ -100,28 +273,146 @@ def download_dwca(url, baseoutpath, overwrite=False, logger=None):
         logger: optional logger for saving output messages to file.
     
     Results:
-        Saves the DWCA file under a subdirectory of the output path.
+        Saves the DWCA file under a subdirectory of the output path, if it is 
+        missing or was modified since the last download.
+        
+    Returns:
+        full filename of the DWCA file
     """
-    outfilename = assemble_download_filename(url, baseoutpath)
-    success = ready_filename(outfilename, overwrite=overwrite)
-    if success:
-        ret_code = None
-        try:
-            response = requests.get(url)
-        except Exception as e:
-            try:
-                ret_code = response.status_code
-                reason = response.reason
-            except AttributeError:
-                reason = 'Unknown Error'
-            log_error('Failed on URL {}, code = {}, reason = {} ({})'.format(
-                url, ret_code, reason, str(e)), logger)
-    
-        output = response.content
-        with open(outfilename, 'wb') as outf:
-            outf.write(output)
+    outfilename, _ = download_dwca_if_changed(
+        url, baseoutpath, overwrite=overwrite, logger=logger)
     return outfilename
 
+# .............................................................................
+class SolrRecordTransformer:
+    """Rewrite rows of one DWCA core occurrence file as SPCOCO_FIELDS rows.
+    
+    Note:
+        Built once per archive from the core fileinfo and dataset GUID, so that 
+        column indices, URL prefixes and output field order are found once 
+        rather than for every row.  Rows are lists of values, as read by 
+        csv.reader, in the order of fileinfo fieldnames.
+    """
+    # Same result as lmtrex.tools.s2n.utils.is_valid_uuid, without UUID parsing
+    GUID_PATTERN = re.compile(
+        '[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}')
+    # Characters escaped by csv.writer with QUOTE_NONE and escapechar backslash
+    ESCAPED_CHARS = re.compile(r'[,"\\\r\n]')
+    
+    # ......................................................
+    def __init__(self, fileinfo, ds_uuid):
+        """
+        Args:
+            fileinfo: dictionary of core file information from read_core_fileinfo,
+                plus the Specify server URL
+            ds_uuid: dataset GUID from read_dataset_uuid
+            
+        Raises:
+            Exception: if the core file has no id, datasetName or basisOfRecord
+        """
+        # Last column wins for repeated fieldnames
+        col_idxs = {fld: i for i, fld in enumerate(fileinfo[DWCA.FLDS_KEY])}
+        self.id_fieldname = fileinfo[DWCA.UUID_KEY]
+        missing = [
+            fld for fld in (self.id_fieldname, 'datasetName', 'basisOfRecord')
+            if fld not in col_idxs]
+        if missing:
+            raise Exception('Core file {} is missing fields {}'.format(
+                fileinfo[DWCA.LOCATION_KEY], missing))
+        self._id_idx = col_idxs[self.id_fieldname]
+        self._who_idx = col_idxs['datasetName']
+        self._what_idx = col_idxs['basisOfRecord']
+        # Date parts after a missing part are ignored
+        self._date_idxs = []
+        for fld in ('year', 'month', 'day'):
+            if fld not in col_idxs:
+                break
+            self._date_idxs.append(col_idxs[fld])
+        self._min_len = max(
+            [self._id_idx, self._who_idx, self._what_idx] + self._date_idxs) + 1
+        
+        self.ds_uuid = ds_uuid
+        self._ark_prefix = SPECIFY_ARK_PREFIX
+        self._url_prefix = '{}/{}/{}/'.format(
+            fileinfo[SPECIFY7_SERVER_KEY], SPECIFY7_RECORD_ENDPOINT, ds_uuid)
+        # transform computes values in this order, plus '' for other fields
+        value_flds = ['id', 'dataset_guid', 'who', 'what', 'when', 'where', 'url']
+        self._get_output = operator.itemgetter(*[
+            value_flds.index(fld) if fld in value_flds else len(value_flds)
+            for fld in SPCOCO_FIELDS])
+        # Lines without escaped characters are joined directly, others written 
+        # by csv.writer to a buffer
+        self._can_join = ds_uuid is not None and self.ESCAPED_CHARS.search(
+            ds_uuid + self._ark_prefix + self._url_prefix) is None
+        self._line_buf = io.StringIO(newline='')
+        self._line_wtr = csv.writer(
+            self._line_buf, delimiter=',', escapechar='\\', 
+            quoting=csv.QUOTE_NONE)
+
+    # ......................................................
+    def is_guid(self, idstr):
+        return idstr is not None and self.GUID_PATTERN.fullmatch(idstr) is not None
+    
+    # ......................................................
+    def get_id(self, row):
+        """Return the record id from a row, raising IndexError if it is missing."""
+        return row[self._id_idx]
+    
+    # ......................................................
+    def _get_date(self, row):
+        """Join year, month and day with '-', up to the first non-integer part."""
+        parts = []
+        for idx in self._date_idxs:
+            val = row[idx]
+            if not val:
+                break
+            if not val.isdecimal():
+                try:
+                    int(val)
+                except ValueError:
+                    break
+            parts.append(val)
+        return '-'.join(parts)
+    
+    # ......................................................
+    def _get_values(self, row):
+        occ_uuid = row[self._id_idx]
+        if len(row) < self._min_len:
+            row = row + [''] * (self._min_len - len(row))
+        return (
+            occ_uuid, self.ds_uuid, row[self._who_idx], row[self._what_idx],
+            self._get_date(row), self._ark_prefix + occ_uuid, 
+            self._url_prefix + occ_uuid, '')
+    
+    # ......................................................
+    def transform(self, row):
+        """Return the values of SPCOCO_FIELDS for a row of core occurrence values.
+        
+        Raises:
+            IndexError: if the row has no id value
+        """
+        return self._get_output(self._get_values(row))
+    
+    # ......................................................
+    def to_line(self, row):
+        """Return the values of SPCOCO_FIELDS for a row as a line of CSV text, 
+        identical to the output of csv.writer with QUOTE_NONE and escapechar 
+        backslash.
+        
+        Raises:
+            IndexError: if the row has no id value
+        """
+        vals = self._get_values(row)
+        # Only id, who and what vary by row, the date contains no escaped chars
+        if (self._can_join and 
+                self.ESCAPED_CHARS.search(vals[0] + vals[2] + vals[3]) is None):
+            return ','.join(self._get_output(vals)) + '\r\n'
+        self._line_buf.seek(0)
+        self._line_buf.truncate()
+        self._line_wtr.writerow(self._get_output(vals))
+        return self._line_buf.getvalue()
+
+
 # .............................................................................
 class DwCArchive:
     """Class to download and read a Darwin Core Archive"""
@@ -141,6 +432,7 @@ class DwCArchive:
         """
         if os.path.exists(zipfile_or_directory):
             self.logger = logger
+            self.zipfile = None
             # DWCA is zipped
             if (os.path.isfile(zipfile_or_directory) and 
                 zipfile_or_directory.endswith('.zip')):
@@ -161,105 +453,182 @@ class DwCArchive:
 
     
     # ......................................................
-    def _get_date(self, dwc_rec):
-        coll_date = ''        
-        try:
-            yr = dwc_rec['year']
-            int(yr)
-        except:
-            pass
+    def _is_guid(self, idstr):
+        return is_valid_uuid(idstr)
+
+    # ......................................................
+    def _find_zip_member(self, zfile, fname):
+        """Return the name of the zipfile member with basename fname, or None."""
+        for zname in zfile.namelist():
+            if zname == fname or zname.endswith('/' + fname):
+                return zname
+        return None
+
+    # ......................................................
+    def _open_zip_member(self, fname, binary=False):
+        """Open a member of the zipfile for reading without extracting it.
+        
+        Args:
+            fname: basename of the member, such as meta.xml
+            binary: True to return the raw byte stream, False for text
+            
+        Returns:
+            readable file-like object.  Closing it releases the zipfile.
+        """
+        if self.zipfile is None:
+            raise Exception('DWCA {} is not a zipfile'.format(self.dwca_path))
+        # ZipFile reference counts open members, so the archive is closed when 
+        # the member stream is closed
+        with zipfile.ZipFile(self.zipfile, mode='r', allowZip64=True) as zfile:
+            zname = self._find_zip_member(zfile, fname)
+            if zname is None:
+                raise Exception('File {} is not in zipfile {}'.format(
+                    fname, self.zipfile))
+            member = zfile.open(zname, mode='r')
+        if binary:
+            return member
+        return io.TextIOWrapper(member, encoding=ENCODING, newline='')
+
+    # ......................................................
+    def _parse_xml(self, fname, from_zip):
+        if from_zip:
+            with self._open_zip_member(fname, binary=True) as inf:
+                tree = ET.parse(inf)
         else:
-            coll_date = yr             
-            try:
-                mo = dwc_rec['month']
-                int(mo)
-            except:
-                pass
-            else:
-                coll_date = '{}-{}'.format(coll_date, mo)
-                try:
-                    dy = dwc_rec['day']
-                    int(dy)
-                except:
-                    pass
-                else:
-                    coll_date = '{}-{}'.format(coll_date, dy)
-        return coll_date
-    
+            tree = ET.parse(os.path.join(self.dwca_path, fname))
+        return tree.getroot()
+
+    # ......................................................
+    def _get_reader(self, inf, fileinfo):
+        return csv.reader(
+            inf, delimiter=fileinfo[DWCA.DELIMITER_KEY], escapechar='\\', 
+            quoting=csv.QUOTE_NONE)
 
     # ......................................................
-    def rewrite_recs_for_solr(self, fileinfo, ds_uuid, overwrite=True):
+    def _get_core_reader(self, fileinfo, from_zip):
+        """Return a csv reader and open file for the core occurrence file, read 
+        from disk or streamed from the zipfile."""
+        if not from_zip:
+            core_fname = os.path.join(self.dwca_path, fileinfo[DWCA.LOCATION_KEY])
+            return get_csv_reader(
+                core_fname, fileinfo[DWCA.DELIMITER_KEY], ENCODING)
+        inf = self._open_zip_member(fileinfo[DWCA.LOCATION_KEY])
+        rdr = self._get_reader(inf, fileinfo)
+        log_info('Streaming {} from zipfile {}'.format(
+            fileinfo[DWCA.LOCATION_KEY], self.zipfile), logger=self.logger)
+        return rdr, inf
+
+    # ......................................................
+    def _write_solr_recs(
+            self, rdr, outf, transformer, in_fname, old_hashes=None, 
+            new_hashes=None):
+        """Write a Solr record for each row of core occurrence values.
+        
+        Args:
+            rdr: csv.reader for the core occurrence file
+            outf: open file for Solr records
+            transformer: SolrRecordTransformer for the archive
+            in_fname: name of the core occurrence file, for messages
+            old_hashes: optional dictionary of id to hash of the Solr record 
+                from a previous run. Records with the same hash are not written.
+            new_hashes: dictionary filled with id to hash of each Solr record, 
+                required with old_hashes.  A record that fails to transform keeps 
+                its old hash, so it is neither rewritten nor deleted.
+        
+        Returns:
+            number of records read, and number of records with a non-GUID id
         """
+        count = 0
+        bad_guid_count = 0
+        try:
+            for row in rdr:
+                # Skip blank lines
+                if not row:
+                    continue
+                occ_uuid = None
+                try:
+                    count += 1
+                    occ_uuid = transformer.get_id(row)
+                    if count == 1 and occ_uuid == transformer.id_fieldname:
+                        continue
+                    if not transformer.is_guid(occ_uuid):
+                        bad_guid_count += 1
+                        if bad_guid_count < 10:
+                            log_warn(
+                                'Line {} contains {}, non-GUID in id field'
+                                .format(count, occ_uuid), logger=self.logger)
+                        elif bad_guid_count == 10:
+                            log_warn('...', logger=self.logger)
+                    line = transformer.to_line(row)
+                    if new_hashes is not None:
+                        digest = get_record_hash(line)
+                        new_hashes[occ_uuid] = digest
+                        if old_hashes.get(occ_uuid) == digest:
+                            continue
+                    outf.write(line)
+                except Exception as e:
+                    log_error(
+                        'Rec {}: failed {}'.format(count, e), logger=self.logger)
+                    if new_hashes is not None:
+                        # A record missing from new_hashes would be deleted, so 
+                        # keep the indexed version of a record that failed
+                        if occ_uuid is None:
+                            raise
+                        if occ_uuid in old_hashes:
+                            new_hashes[occ_uuid] = old_hashes[occ_uuid]
+        except Exception as e:
+            log_warn(
+                'Failed to read/write file {}: {}'.format(in_fname, e), 
+                logger=self.logger)
+            # Unread records would be missing from new_hashes, and deleted
+            if new_hashes is not None:
+                raise
+        return count, bad_guid_count
+
+    # ......................................................
+    def _get_solr_filename(self, fileinfo):
+        core_fname = os.path.join(self.dwca_path, fileinfo[DWCA.LOCATION_KEY])
+        core_fname_noext, _ = os.path.splitext(core_fname)
+        return core_fname, core_fname_noext + '.solr.csv'
+
+    # ......................................................
+    def rewrite_recs_for_solr(
+            self, fileinfo, ds_uuid, overwrite=True, from_zip=False):
+        """Rewrite core occurrence records as a CSV file of SPCOCO_FIELDS for Solr.
+        
+        Args:
+            fileinfo: dictionary of core file information from read_core_fileinfo
+            ds_uuid: dataset GUID from read_dataset_uuid
+            overwrite: True to replace an existing output file
+            from_zip: True to stream the core file from the zipfile in one pass, 
+                without extracting it.  The output file is written to dwca_path.
+        
+        Returns:
+            output filename, content type, and True if the file was written
+            
         Note: 
             Produces data requiring http post to contain 
             headers={'Content-Type': 'text/csv'}
         """
         count = 0
+        bad_guid_count = 0
         is_new = False
         out_delimiter = ','
         content_type = 'text/csv'
-        core_fname = os.path.join(self.dwca_path, fileinfo[DWCA.LOCATION_KEY])
-        core_fname_noext, _ = os.path.splitext(core_fname)
-        solr_outfname = core_fname_noext + '.solr.csv'
-        specify_record_server = '{}/{}'.format(
-            fileinfo[SPECIFY7_SERVER_KEY], SPECIFY7_RECORD_ENDPOINT)
+        core_fname, solr_outfname = self._get_solr_filename(fileinfo)
         
         if os.path.exists(solr_outfname) and overwrite is True:
             _, _ = delete_file(solr_outfname)
         if not os.path.exists(solr_outfname):
-            in_delimiter = fileinfo[DWCA.DELIMITER_KEY]
-            rdr, inf = get_csv_dict_reader(
-                core_fname, in_delimiter, ENCODING, 
-                fieldnames=fileinfo['fieldnames'])
+            transformer = SolrRecordTransformer(fileinfo, ds_uuid)
+            rdr, inf = self._get_core_reader(fileinfo, from_zip)
             # Tabs ok?
-            wtr, outf = get_csv_dict_writer(
-                solr_outfname, out_delimiter, ENCODING, SPCOCO_FIELDS, fmode='w')
+            wtr, outf = get_csv_writer(
+                solr_outfname, out_delimiter, ENCODING, fmode='w')
             try:
-                wtr.writeheader()
-                bad_guid_count = 0
-                for dwc_rec in rdr:
-                    solr_rec = {}
-                    try:
-                        count += 1
-                        occ_uuid = dwc_rec[fileinfo[DWCA.UUID_KEY]]
-                        if count == 1 and occ_uuid == DWCA.UUID_KEY:
-                            pass
-                        else:
-                            if not self._is_guid(occ_uuid):
-                                bad_guid_count += 1
-                                if bad_guid_count < 10:
-                                    log_warn(
-                                        'Line {} contains {}, non-GUID in id field'
-                                        .format(count, occ_uuid), 
-                                        logger=self.logger)
-                                elif bad_guid_count == 10:
-                                    log_warn('...', logger=self.logger)
-                                
-                            coll_date = self._get_date(dwc_rec)
-                            who_val = dwc_rec['datasetName']
-                            for fld in SPCOCO_FIELDS:
-                                if fld == 'id':
-                                    solr_rec[fld] = occ_uuid
-                                elif fld == 'dataset_guid':
-                                    solr_rec[fld] = ds_uuid
-                                elif fld == 'who':
-                                    solr_rec[fld] = who_val
-                                elif fld == 'what':
-                                    solr_rec[fld] = dwc_rec['basisOfRecord']
-                                elif fld == 'when':
-                                    solr_rec[fld] = coll_date
-                                elif fld == 'where':
-                                    solr_rec[fld] =  '{}{}'.format(SPECIFY_ARK_PREFIX, occ_uuid)
-                                elif fld == 'url':
-                                    solr_rec[fld] = '{}/{}/{}'.format(
-                                        specify_record_server, ds_uuid, occ_uuid)                        
-                            wtr.writerow(solr_rec)
-                    except Exception as e:
-                        log_error('Rec {}: failed {}'.format(count, e))
-            except Exception as e:
-                log_warn(
-                    'Failed to read/write file {}: {}'.format(core_fname, e), 
-                    logger=self.logger)
+                wtr.writerow(SPCOCO_FIELDS)
+                count, bad_guid_count = self._write_solr_recs(
+                    rdr, outf, transformer, core_fname)
             finally:
                 inf.close()
                 outf.close()
@@ -268,14 +637,163 @@ class DwCArchive:
                     'Wrote {} recs, with {} non-guid-ids to file {}'.format(
                         count, bad_guid_count, solr_outfname), logger=self.logger)
         return solr_outfname, content_type, is_new
+
+    # ......................................................
+    def rewrite_changed_recs_for_solr(
+            self, fileinfo, ds_uuid, manifest_path, from_zip=False):
+        """Rewrite only records added or changed since the last indexed version 
+        of the dataset, and find records deleted since then.
+        
+        Args:
+            fileinfo: dictionary of core file information from read_core_fileinfo
+            ds_uuid: dataset GUID from read_dataset_uuid
+            manifest_path: directory of dataset manifests, files of record ids
+                and hashes of their Solr records
+            from_zip: True to stream the core file from the zipfile
+        
+        Returns:
+            filename of added and changed Solr records, number of those 
+            records, list of deleted record ids, and the manifest filename.
+            
+        Note:
+            The new manifest is saved as pending.  Call commit_manifest with the 
+            manifest filename once the changes are posted to Solr, so that 
+            changes are sent again if posting fails.
+        """
+        manifest_fname = get_manifest_filename(manifest_path, ds_uuid)
+        old_hashes = read_manifest(manifest_fname)
+        new_hashes = {}
+        transformer = SolrRecordTransformer(fileinfo, ds_uuid)
+        core_fname, solr_fname = self._get_solr_filename(fileinfo)
+        solr_basename, _ = os.path.splitext(solr_fname)
+        solr_outfname = solr_basename + '.changed.csv'
+        
+        rdr, inf = self._get_core_reader(fileinfo, from_zip)
+        wtr, outf = get_csv_writer(solr_outfname, ',', ENCODING, fmode='w')
+        try:
+            wtr.writerow(SPCOCO_FIELDS)
+            count, bad_guid_count = self._write_solr_recs(
+                rdr, outf, transformer, core_fname, old_hashes=old_hashes, 
+                new_hashes=new_hashes)
+        finally:
+            inf.close()
+            outf.close()
+        changed_count = sum(
+            1 for occid, digest in new_hashes.items() 
+            if old_hashes.get(occid) != digest)
+        deleted_ids = [occid for occid in old_hashes if occid not in new_hashes]
+        write_manifest(manifest_fname + MANIFEST_PENDING_EXT, new_hashes)
+        log_info(
+            'Wrote {} new or changed of {} recs, with {} non-guid-ids, to file {}; '
+            '{} recs deleted'.format(
+                changed_count, count, bad_guid_count, solr_outfname, 
+                len(deleted_ids)), logger=self.logger)
+        return solr_outfname, changed_count, deleted_ids, manifest_fname
+
+    # ......................................................
+    def rewrite_recs_for_solr_parallel(
+            self, fileinfo, ds_uuid, overwrite=True, max_workers=None):
+        """Rewrite a large core occurrence file for Solr in parallel processes.
+        
+        Args:
+            fileinfo: dictionary of core file information from read_core_fileinfo
+            ds_uuid: dataset GUID from read_dataset_uuid
+            overwrite: True to replace an existing output file
+            max_workers: number of processes, None for one per CPU
+        
+        Returns:
+            output filename, content type, and True if the file was written
+            
+        Note: 
+            The core file is split into byte ranges of about 
+            DWCA.REWRITE_CHUNK_BYTES, each starting at a record boundary, 
+            rewritten in separate processes, then concatenated in order.  
+            Ranges need random access, so if the DWCA is zipped, only the core 
+            file is extracted first.  Produces the same file as 
+            rewrite_recs_for_solr.
+        """
+        count = 0
+        bad_guid_count = 0
+        is_new = False
+        content_type = 'text/csv'
+        core_fname, solr_outfname = self._get_solr_filename(fileinfo)
+        
+        if os.path.exists(solr_outfname) and overwrite is True:
+            _, _ = delete_file(solr_outfname)
+        if os.path.exists(solr_outfname):
+            return solr_outfname, content_type, is_new
+        
+        # Fail before starting processes if required fields are missing
+        SolrRecordTransformer(fileinfo, ds_uuid)
+        if not os.path.exists(core_fname):
+            core_fname = self._extract_zip_member(fileinfo[DWCA.LOCATION_KEY])
+        offsets = find_record_offsets(
+            core_fname, DWCA.REWRITE_CHUNK_BYTES, 
+            line_delimiter=fileinfo[DWCA.LINE_DELIMITER_KEY])
+        part_fnames = [
+            '{}.part{:05d}'.format(solr_outfname, i) 
+            for i in range(len(offsets) - 1)]
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=max_workers) as pool:
+                futures = [
+                    pool.submit(
+                        _rewrite_range_for_solr, self.dwca_path, core_fname, 
+                        fileinfo, ds_uuid, offsets[i], offsets[i+1], part_fnames[i])
+                    for i in range(len(part_fnames))]
+                # Fail on the first range that failed
+                for fut in futures:
+                    rng_count, rng_bad_guid_count = fut.result()
+                    count += rng_count
+                    bad_guid_count += rng_bad_guid_count
+            
+            wtr, outf = get_csv_writer(solr_outfname, ',', ENCODING, fmode='w')
+            try:
+                wtr.writerow(SPCOCO_FIELDS)
+                for part_fname in part_fnames:
+                    with open(part_fname, 'r', encoding=ENCODING, newline='') as inf:
+                        shutil.copyfileobj(inf, outf)
+            finally:
+                outf.close()
+        finally:
+            for part_fname in part_fnames:
+                if os.path.exists(part_fname):
+                    os.remove(part_fname)
+        is_new = True
+        log_info(
+            'Wrote {} recs, with {} non-guid-ids, from {} ranges to file {}'.format(
+                count, bad_guid_count, len(part_fnames), solr_outfname), 
+            logger=self.logger)
+        return solr_outfname, content_type, is_new
         
     # ......................................................
-    def extract_from_zip(self, extract_path=None):
+    def _extract_zip_member(self, fname):
+        """Extract one member of the zipfile to dwca_path, found as in 
+        _open_zip_member, and return the extracted filename."""
+        if self.zipfile is None:
+            raise Exception('DWCA {} is not a zipfile'.format(self.dwca_path))
+        with zipfile.ZipFile(self.zipfile, mode='r', allowZip64=True) as zfile:
+            zname = self._find_zip_member(zfile, fname)
+            if zname is None:
+                raise Exception('File {} is not in zipfile {}'.format(
+                    fname, self.zipfile))
+            return zfile.extract(zname, path=self.dwca_path)
+
+    # ......................................................
+    def extract_from_zip(self, extract_path=None, members=None):
+        """Extract data and metadata files from the zipfile.
+        
+        Args:
+            extract_path: destination directory, defaults to the zipfile directory
+            members: optional list of member names to extract, defaults to all
+        """
         zfile = zipfile.ZipFile(self.zipfile, mode='r', allowZip64=True)
         if extract_path is None:
             extract_path, _ = os.path.split(self.zipfile)
         # unzip zip file stream
         for zinfo in zfile.infolist():
+            if members is not None and zinfo.filename not in members:
+                continue
             _, ext = os.path.splitext(zinfo.filename)
             # Check file extension and only unzip valid files
             if ext in ['.xml', '.csv', '.txt']:
@@ -286,7 +804,12 @@ class DwCArchive:
 
     
     # ......................................................
-    def read_dataset_uuid(self):
+    def read_dataset_uuid(self, from_zip=False):
+        """Reads eml.xml file for the dataset GUID
+        
+        Args:
+            from_zip: True to read eml.xml directly from the zipfile
+        """
         idstr = None
         if os.path.split(self.ds_meta_fname)[1] != DWCA.DATASET_META_FNAME:
             log_error(
@@ -294,8 +817,7 @@ class DwCArchive:
                     DWCA.DATASET_META_FNAME, self.ds_meta_fname), 
                 logger=self.logger)
             return ''
-        tree = ET.parse(self.ds_meta_fname)
-        root = tree.getroot()
+        root = self._parse_xml(DWCA.DATASET_META_FNAME, from_zip)
         elt = root.find('dataset')
         id_elts = elt.findall('alternateIdentifier')
         for ie in id_elts:
@@ -317,9 +839,12 @@ class DwCArchive:
         return ch
         
     # ......................................................
-    def read_core_fileinfo(self):
+    def read_core_fileinfo(self, from_zip=False):
         """Reads meta.xml file for information about the core occurrence file
         
+        Args:
+            from_zip: True to read meta.xml directly from the zipfile
+        
         Returns:
             Dictionary of core occurrence file information, with keys matching the 
             names/tags in the meta.xml file:
@@ -336,8 +861,7 @@ class DwCArchive:
             return ''
         fileinfo = {}
         field_idxs = {}
-        tree = ET.parse(self.meta_fname)
-        root = tree.getroot()
+        root = self._parse_xml(DWCA.META_FNAME, from_zip)
         core_elt = root.find('{}core'.format(DWCA.NS))
         if core_elt.attrib['rowType'] == DWCA.CORE_TYPE:
             # CSV file name
@@ -395,7 +919,6 @@ class DwCArchive:
 
 # ...............................................
 def get_logger_for_processing(logpath, logname=None):
-    import time
     if logname is None:
         nm, _ = os.path.splitext(os.path.basename(__file__))
         logname = '{}.{}'.format(nm, int(time.time()))
@@ -403,13 +926,310 @@ def get_logger_for_processing(logpath, logname=None):
     logger = LMLog(logname, logfname)
     return logger
 
+# ...............................................
+def get_record_hash(line):
+    """Return a short hash of a Solr record, to detect changed records."""
+    return hashlib.blake2b(line.encode(ENCODING), digest_size=8).hexdigest()
+
+# ...............................................
+def get_manifest_filename(manifest_path, ds_uuid):
+    return os.path.join(manifest_path, '{}.manifest.gz'.format(ds_uuid))
+
+# ...............................................
+def read_manifest(manifest_fname):
+    """Read a dataset manifest written by write_manifest.
+    
+    Returns:
+        dictionary of record id to hash, empty if there is no manifest
+    """
+    hashes = {}
+    try:
+        with gzip.open(
+                manifest_fname, 'rt', encoding=ENCODING, newline='\n') as inf:
+            for line in inf:
+                occid, _, digest = line.rstrip('\n').rpartition('\t')
+                hashes[occid] = digest
+    except FileNotFoundError:
+        pass
+    return hashes
+
+# ...............................................
+def write_manifest(manifest_fname, hashes):
+    """Write a dataset manifest of record ids and hashes, one tab-delimited 
+    pair per line, compressed, replacing any existing file at once."""
+    outpath = os.path.dirname(manifest_fname)
+    os.makedirs(outpath, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=outpath)
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.open(raw, 'wt', encoding=ENCODING, newline='\n') as outf:
+                for occid, digest in hashes.items():
+                    outf.write('{}\t{}\n'.format(occid, digest))
+        os.replace(tmpname, manifest_fname)
+    except Exception:
+        os.remove(tmpname)
+        raise
+
+# ...............................................
+def commit_manifest(manifest_fname):
+    """Replace a dataset manifest with the pending one, after its changes are 
+    posted."""
+    pending_fname = manifest_fname + MANIFEST_PENDING_EXT
+    if os.path.exists(pending_fname):
+        os.replace(pending_fname, manifest_fname)
+
+# ...............................................
+def _is_escaped(mmap_obj, pos, escape_char=b'\\'):
+    """Return True if the byte at pos follows an odd number of escape characters."""
+    count = 0
+    while pos > count and mmap_obj[pos-count-1:pos-count] == escape_char:
+        count += 1
+    return count % 2 == 1
+
+# ...............................................
+def find_record_offsets(fname, chunk_size, line_delimiter='\n'):
+    """Split a delimited text file into byte ranges starting at record boundaries.
+    
+    Args:
+        fname: full path of the file
+        chunk_size: approximate number of bytes in each range
+        line_delimiter: record terminator, linesTerminatedBy in meta.xml
+        
+    Returns:
+        ascending list of byte offsets, starting with 0 and ending with the file 
+        size.  Each pair of consecutive offsets is one range.
+        
+    Note:
+        A boundary is the position after a line delimiter that is not escaped 
+        with a backslash.  Quotes are ignored, as they are by the reader, which 
+        uses QUOTE_NONE.  The delimiter must be ASCII, whose bytes never occur 
+        within multibyte UTF-8 characters.
+    """
+    size = os.path.getsize(fname)
+    offsets = [0]
+    if size <= chunk_size:
+        offsets.append(size)
+        return offsets
+    if not line_delimiter:
+        line_delimiter = '\n'
+    term = line_delimiter.encode(ENCODING)
+    
+    with open(fname, 'rb') as inf:
+        mm = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = 0
+            while pos + chunk_size < size:
+                pos = max(pos, offsets[-1] + chunk_size)
+                # Find the next terminator that is not escaped
+                while True:
+                    idx = mm.find(term, pos)
+                    if idx < 0:
+                        pos = size
+                        break
+                    pos = idx + len(term)
+                    if not _is_escaped(mm, idx):
+                        break
+                if pos >= size:
+                    break
+                offsets.append(pos)
+        finally:
+            mm.close()
+    offsets.append(size)
+    return offsets
+
+# ...............................................
+def _rewrite_range_for_solr(
+        dwca_path, core_fname, fileinfo, ds_uuid, start, end, part_fname):
+    """Rewrite records in one byte range of the core file for Solr, without a 
+    header, in a worker process.
+    
+    Returns:
+        number of records read, and number of records with a non-GUID id
+    """
+    dwca = DwCArchive(dwca_path)
+    transformer = SolrRecordTransformer(fileinfo, ds_uuid)
+    with open(core_fname, 'rb') as inf:
+        inf.seek(start)
+        data = inf.read(end - start)
+    rdr = dwca._get_reader(io.StringIO(data.decode(ENCODING), newline=''), fileinfo)
+    with open(part_fname, 'w', encoding=ENCODING, newline='') as outf:
+        return dwca._write_solr_recs(
+            rdr, outf, transformer, '{} bytes {}-{}'.format(core_fname, start, end))
+
+# ...............................................
+def _rewrite_dataset_for_solr(
+        zipfname, specify_url, manifest_path=None, overwrite=False):
+    """Read a zipped DWCA and rewrite its records for Solr, in a worker process.
+    
+    Args:
+        zipfname: full path to the zipped DWCA
+        specify_url: URL of the Specify server hosting the records
+        manifest_path: directory of dataset manifests to rewrite only records 
+            changed since the last run, None to rewrite all records
+        overwrite: True to replace an existing file of all records
+    
+    Returns:
+        dictionary of dwca_guid (dataset GUID from eml.xml), solr_filename, 
+        content_type, is_new (True if there are records to post), deleted_ids, 
+        and manifest_filename (None if rewriting all records)
+    """
+    dwca = DwCArchive(zipfname)
+    # Read DWCA and dataset metadata directly from the zipfile
+    core_fileinfo = dwca.read_core_fileinfo(from_zip=True)
+    core_fileinfo[SPECIFY7_SERVER_KEY] = specify_url
+    dwca_guid = dwca.read_dataset_uuid(from_zip=True)
+    rewritten = {
+        'dwca_guid': dwca_guid, 'content_type': 'text/csv', 'deleted_ids': [], 
+        'manifest_filename': None}
+    # Read record metadata, dwca_guid takes precedence
+    if manifest_path is None:
+        solr_fname, content_type, is_new = dwca.rewrite_recs_for_solr(
+            core_fileinfo, dwca_guid, overwrite=overwrite, from_zip=True)
+        rewritten.update(
+            {'solr_filename': solr_fname, 'content_type': content_type, 
+             'is_new': is_new})
+    else:
+        solr_fname, changed_count, deleted_ids, manifest_fname = \
+            dwca.rewrite_changed_recs_for_solr(
+                core_fileinfo, dwca_guid, manifest_path, from_zip=True)
+        rewritten.update(
+            {'solr_filename': solr_fname, 'deleted_ids': deleted_ids,
+             'is_new': changed_count > 0 or len(deleted_ids) > 0,
+             'manifest_filename': manifest_fname})
+    return rewritten
+
+# ...............................................
+def _post_dataset_to_solr(rewritten, collection, solr_location):
+    """Post a rewritten dataset to Solr, in batches to a remote Solr, and delete 
+    records removed from the dataset.
+    
+    Returns:
+        number of records posted, None if posted locally
+    """
+    posted = None
+    if solr_location is None:
+        SpSolr.post(
+            rewritten['solr_filename'], collection, solr_location=solr_location, 
+            headers={'Content-Type': rewritten['content_type']})
+    else:
+        posted, errors = SpSolr.post_in_batches(
+            rewritten['solr_filename'], collection, solr_location)
+        if errors:
+            raise Exception('Posted {} records from {}, failed {}'.format(
+                posted, rewritten['solr_filename'], '; '.join(errors)))
+    if rewritten['deleted_ids']:
+        # The local post command uses the default Solr host
+        _, errors = SpSolr.delete_ids(
+            rewritten['deleted_ids'], collection, solr_location or 'localhost')
+        if errors:
+            raise Exception('Failed to delete records {}'.format('; '.join(errors)))
+    if rewritten['manifest_filename'] is not None:
+        commit_manifest(rewritten['manifest_filename'])
+    return posted
+
+# ...............................................
+def _is_indexed(zipfname):
+    """Return True if the DWCA file was indexed after it was last saved."""
+    try:
+        return (os.path.getmtime(zipfname + INDEXED_EXT) >= 
+                os.path.getmtime(zipfname))
+    except OSError:
+        return False
+
+# ...............................................
+def _set_indexed(zipfname):
+    with open(zipfname + INDEXED_EXT, 'w'):
+        pass
+
+# ...............................................
+def _read_solr_ids(solr_fname):
+    """Yield the id of each record in a CSV file rewritten for Solr."""
+    with open(solr_fname, 'r', encoding=ENCODING, newline='') as in_file:
+        rdr = csv.reader(
+            in_file, delimiter=',', escapechar='\\', quoting=csv.QUOTE_NONE)
+        header = next(rdr, [])
+        try:
+            idx = header.index(SOLR_EXPORT.UNIQUE_KEY)
+        except ValueError:
+            raise Exception('No {} field in {}'.format(
+                SOLR_EXPORT.UNIQUE_KEY, solr_fname))
+        for row in rdr:
+            if len(row) > idx:
+                yield row[idx]
+
+# ...............................................
+def _update_guid_filter(
+        guid_filter_fname, solr_fnames, collection, solr_location, logger):
+    """Add the GUIDs in posted Solr files to the broker's GUID filter, once they 
+    are committed, so the filter is up to date with the index."""
+    if not solr_fnames:
+        return
+    try:
+        SpSolr.commit(collection, solr_location)
+    except Exception as e:
+        # The filter is then older than the index, and not used until rebuilt
+        log_warn('Failed to commit {}: {}'.format(collection, e), logger=logger)
+    guids = (guid for fname in solr_fnames for guid in _read_solr_ids(fname))
+    try:
+        gfilter = add_guids_to_filter(guids, fname=guid_filter_fname)
+    except Exception as e:
+        log_error('Failed to update GUID filter {}: {}'.format(
+            guid_filter_fname, e), logger=logger)
+        return
+    if gfilter is None:
+        log_warn('No GUID filter {} to update'.format(guid_filter_fname), 
+                 logger=logger)
+    elif gfilter.is_full():
+        log_warn('GUID filter {} holds {} GUIDs, over its capacity {}, rebuild it'.format(
+            guid_filter_fname, len(gfilter), gfilter.capacity), logger=logger)
+    else:
+        log_info('Updated GUID filter {}'.format(guid_filter_fname), logger=logger)
+
+# ...............................................
+def _count_solr_docs(collection, solr_location, logger):
+    try:
+        return SpSolr.count_docs(collection, solr_location=solr_location)
+    except Exception as e:
+        log_warn('Failed to count docs in {}: {}'.format(collection, e), logger=logger)
+        return None
+
 # ...............................................
 def index_specify7_dataset(
-        zname, dwca_url, outpath, solr_location, collection, testguids=[]):
+        zname, dwca_url, outpath, solr_location, collection, testguids=[],
+        manifest_path=None, guid_filter_fname=GUID_FILTER.FILENAME):
+    """Download, rewrite, and post to Solr one or more Specify DWCA datasets.
+    
+    Args:
+        zname: existing zipped DWCA to process instead of downloading datasets
+        dwca_url: RSS feed URL with download links for DWCA datasets
+        outpath: destination directory for downloads, output and log files
+        solr_location: IP or FQDN for solr index, None to post locally
+        collection: name of the Solr index
+        manifest_path: directory of dataset manifests, to post only records 
+            added or changed, and delete records removed, since the last run.  
+            None to post all records.
+        guid_filter_fname: existing GUID filter of the broker, to add the GUIDs 
+            of posted records to, so that the broker finds them.  None to leave 
+            filters unchanged, only when posting to an index the broker does 
+            not resolve from.
+        
+    Returns:
+        dictionary of dataset GUID to dataset metadata, including 'status', 
+        one of 'posted', 'unchanged' or 'failed', and 'error' for failures.
+        
+    Note:
+        Datasets move through a pipeline as soon as they are ready: up to 
+        DWCA.DOWNLOAD_WORKERS downloads at once, rewriting for Solr in a pool of 
+        DWCA.REWRITE_WORKERS processes, and up to DWCA.POST_WORKERS posts at 
+        once.  A failure in any stage stops only that dataset.
+        
+        Datasets from the RSS feed are downloaded only if modified, and are 
+        not processed again if unmodified since they were last indexed.
+    """
     logger = get_logger_for_processing(outpath)
 
     # IPT url does not host Specify occurrence server
-    isIPT = (dwca_url.find('http://ipt') == 0)
+    isIPT = (dwca_url is not None and dwca_url.find('http://ipt') == 0)
     specify_url = 'unknown_url'
     if dwca_url is not None and not isIPT:
         # Assumes the base RSS/DWCA url is the Specify server
@@ -418,75 +1238,206 @@ def index_specify7_dataset(
     # Existing Zipfile
     if zname is not None:
         datasets = {'unknown_guid': {'filename': zname}}
-    # Download Zipfiles and save info on each
     else:        
         datasets = get_dwca_urls(dwca_url, isIPT=isIPT)
-        for guid, meta in datasets.items():
-            try:
-                url = meta['url']
-            except:
-                log_warn(
-                    'Failed to get URL for IPT dataset {}'.format(guid), 
-                    logger=logger)
-            else:
-                zipfname = download_dwca(url, outpath, overwrite=False)
-                meta['filename'] = zipfname
-                datasets[guid] = meta
-    fixme = []
-    # Process Zipfiles
-    for tmp_guid, meta in datasets.items():
-        try:
-            zipfname = meta['filename']
-        except:
-            log_warn(
-                'Failed to download data for IPT dataset {}'.format(guid),
-                logger=logger)
+    total = len(datasets)
+    finished = 0
+    # future: (dataset key, stage)
+    stages = {}
+    
+    # ...............................................
+    def _finish(ds_key, status, err=None):
+        nonlocal finished
+        finished += 1
+        datasets[ds_key]['status'] = status
+        if err is None:
+            log_info('Dataset {} {} ({} of {} done)'.format(
+                ds_key, status, finished, total), logger=logger)
         else:
-            dwca = DwCArchive(zipfname, logger=logger)
-            
-            extract_path, _ = os.path.split(zipfname)
-            meta_fname = os.path.join(extract_path, DWCA.META_FNAME)
-            ds_meta_fname = os.path.join(extract_path, DWCA.DATASET_META_FNAME)
-            # Extract if needed
-            if not os.path.exists(meta_fname):
-                dwca.extract_from_zip(zipfname, extract_path=extract_path)
-          
-        # Read DWCA and dataset metadata
-        core_fileinfo = dwca.read_core_fileinfo(meta_fname)
-        core_fileinfo[SPECIFY7_SERVER_KEY] = specify_url
-        dwca_guid = dwca.read_dataset_uuid(ds_meta_fname)
-        # Save new guid for update of datasets dict 
-        # if zname argument is provided, we have dataset without guid from download site
-        if is_valid_uuid(tmp_guid) and dwca_guid != tmp_guid:
+            datasets[ds_key]['error'] = str(err)
+            log_error('Dataset {} failed: {} ({} of {} done)'.format(
+                ds_key, err, finished, total), logger=logger)
+    
+    start_count = _count_solr_docs(collection, solr_location, logger)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=DWCA.DOWNLOAD_WORKERS) as download_pool, \
+        concurrent.futures.ProcessPoolExecutor(
+            max_workers=DWCA.REWRITE_WORKERS) as rewrite_pool, \
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=DWCA.POST_WORKERS) as post_pool:
+        # Download Zipfiles, or rewrite an existing one
+        for ds_key, meta in datasets.items():
+            if 'filename' in meta:
+                fut = rewrite_pool.submit(
+                    _rewrite_dataset_for_solr, meta['filename'], specify_url, 
+                    manifest_path=manifest_path)
+                stages[fut] = (ds_key, 'rewrite')
+            elif 'url' in meta:
+                fut = download_pool.submit(
+                    download_dwca_if_changed, meta['url'], outpath, 
+                    overwrite=False, logger=logger)
+                stages[fut] = (ds_key, 'download')
+            else:
+                _finish(ds_key, 'failed', 'no download URL')
+        
+        # Pass each dataset to the next stage as soon as it is ready
+        while stages:
+            done, _ = concurrent.futures.wait(
+                stages, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                ds_key, stage = stages.pop(fut)
+                meta = datasets[ds_key]
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    _finish(ds_key, 'failed', '{} error: {}'.format(stage, e))
+                    continue
+                
+                if stage == 'download':
+                    zipfname, is_changed = result
+                    meta['filename'] = zipfname
+                    if not is_changed and _is_indexed(zipfname):
+                        _finish(ds_key, 'unchanged')
+                        continue
+                    fut = rewrite_pool.submit(
+                        _rewrite_dataset_for_solr, zipfname, specify_url, 
+                        manifest_path=manifest_path, overwrite=True)
+                    stages[fut] = (ds_key, 'rewrite')
+                    
+                elif stage == 'rewrite':
+                    meta['dwca_guid'] = result['dwca_guid']
+                    meta['solr_filename'] = result['solr_filename']
+                    if not result['is_new']:
+                        if result['manifest_filename'] is not None:
+                            commit_manifest(result['manifest_filename'])
+                            _set_indexed(meta['filename'])
+                        _finish(ds_key, 'unchanged')
+                        continue
+                    log_info(
+                        'Dataset {} rewritten to {}, {} records to delete'.format(
+                            ds_key, result['solr_filename'], 
+                            len(result['deleted_ids'])), logger=logger)
+                    fut = post_pool.submit(
+                        _post_dataset_to_solr, result, collection, solr_location)
+                    stages[fut] = (ds_key, 'post')
+                    
+                else:
+                    _set_indexed(meta['filename'])
+                    _finish(ds_key, 'posted')
+
+    if guid_filter_fname is not None:
+        _update_guid_filter(
+            guid_filter_fname, 
+            [meta['solr_filename'] for meta in datasets.values() 
+             if meta['status'] == 'posted'], 
+            collection, solr_location or 'localhost', logger)
+
+    # Report old/new solr index count
+    end_count = _count_solr_docs(collection, solr_location, logger)
+    log_info(
+        'Posted {} of {} datasets to {}, {} --> {} docs'.format(
+            sum(1 for meta in datasets.values() if meta['status'] == 'posted'), 
+            total, collection, start_count, end_count), logger=logger)
+
+    # Save new guid for update of datasets dict, dwca_guid takes precedence
+    for tmp_guid in list(datasets.keys()):
+        dwca_guid = datasets[tmp_guid].get('dwca_guid')
+        if is_valid_uuid(tmp_guid) and dwca_guid and dwca_guid != tmp_guid:
             log_info(
                 'DWCA meta.xml guid {} conflicts with reported guid {}'.format(
                     dwca_guid, tmp_guid), logger=logger)
-            # new/obsolete guid pair
-            fixme.append((dwca_guid, tmp_guid))
-                   
-        # Read record metadata, dwca_guid takes precedence
-        solr_fname, content_type, is_new = dwca.rewrite_recs_for_solr(
-            core_fileinfo, dwca_guid, extract_path, overwrite=False)         
- 
-        # Post
-        if is_new:
-            start_count = SpSolr.count_docs(collection, solr_location=solr_location)
-            retcode, output = SpSolr.post(
-                collection, solr_fname, solr_location=solr_location, 
-                headers={'Content-Type': content_type})
-     
-            # Report old/new solr index count
-            end_count = SpSolr.count_docs(collection, solr_location=solr_location)
-            log_info(
-                'Posted, code {}, to {}, {} --> {} docs'.format(
-                    retcode, collection, start_count, end_count), logger=logger)
+            datasets[dwca_guid] = datasets.pop(tmp_guid)
+    return datasets
 
-    # May use dataset guid somewhere
-    for new_obsolete_pair in fixme:
-        # Remove invalid key
-        meta = datasets.pop(new_obsolete_pair[1])
-        # Add value back with updated key
-        datasets[new_obsolete_pair[0]] = meta
+# ...............................................
+def benchmark_solr_transform(nrows=200000):
+    """Compare rows/sec of SolrRecordTransformer on csv.reader rows with the 
+    previous per-field rewrite of DictReader records, on generated rows.
+    
+    Returns:
+        dictionary of method name to rows per second
+    """
+    fieldnames = [
+        'occurrenceID', 'catalogNumber', 'datasetName', 'basisOfRecord', 
+        'year', 'month', 'day', 'scientificName']
+    fileinfo = {
+        DWCA.LOCATION_KEY: 'occurrence.txt', DWCA.DELIMITER_KEY: '\t', 
+        DWCA.UUID_KEY: 'occurrenceID', DWCA.FLDS_KEY: fieldnames, 
+        SPECIFY7_SERVER_KEY: TEST_SPECIFY7_SERVER}
+    ds_uuid = '8f2a6d4e-3c21-4b5e-9a7f-1d2c3b4a5e6f'
+    lines = []
+    for i in range(nrows):
+        # Every 10th record is missing month and day
+        month, day = ('', '') if i % 10 == 0 else (str(i % 12 + 1), str(i % 28 + 1))
+        lines.append('\t'.join([
+            '{:08x}-0000-4000-8000-{:012x}'.format(i, i), str(i), 'KU Fish', 
+            'PreservedSpecimen', str(1900 + i % 120), month, day, 'Notropis']))
+    text = '\n'.join(lines) + '\n'
+    dwca = DwCArchive(os.path.dirname(os.path.abspath(__file__)))
+    
+    # ...............................................
+    def _previous(inf, outf):
+        rdr = csv.DictReader(
+            inf, fieldnames=fieldnames, quoting=csv.QUOTE_NONE, 
+            escapechar='\\', delimiter='\t')
+        wtr = csv.DictWriter(
+            outf, fieldnames=SPCOCO_FIELDS, delimiter=',', escapechar='\\', 
+            quoting=csv.QUOTE_NONE)
+        specify_record_server = '{}/{}'.format(
+            fileinfo[SPECIFY7_SERVER_KEY], SPECIFY7_RECORD_ENDPOINT)
+        for dwc_rec in rdr:
+            occ_uuid = dwc_rec['occurrenceID']
+            is_valid_uuid(occ_uuid)
+            coll_date = ''
+            try:
+                int(dwc_rec['year'])
+                coll_date = dwc_rec['year']
+                int(dwc_rec['month'])
+                coll_date = '{}-{}'.format(coll_date, dwc_rec['month'])
+                int(dwc_rec['day'])
+                coll_date = '{}-{}'.format(coll_date, dwc_rec['day'])
+            except:
+                pass
+            solr_rec = {}
+            for fld in SPCOCO_FIELDS:
+                if fld == 'id':
+                    solr_rec[fld] = occ_uuid
+                elif fld == 'dataset_guid':
+                    solr_rec[fld] = ds_uuid
+                elif fld == 'who':
+                    solr_rec[fld] = dwc_rec['datasetName']
+                elif fld == 'what':
+                    solr_rec[fld] = dwc_rec['basisOfRecord']
+                elif fld == 'when':
+                    solr_rec[fld] = coll_date
+                elif fld == 'where':
+                    solr_rec[fld] = '{}{}'.format(SPECIFY_ARK_PREFIX, occ_uuid)
+                elif fld == 'url':
+                    solr_rec[fld] = '{}/{}/{}'.format(
+                        specify_record_server, ds_uuid, occ_uuid)
+            wtr.writerow(solr_rec)
+    
+    # ...............................................
+    def _compiled(inf, outf):
+        dwca._write_solr_recs(
+            dwca._get_reader(inf, fileinfo), outf, 
+            SolrRecordTransformer(fileinfo, ds_uuid), 'benchmark')
+    
+    rates = {}
+    outputs = {}
+    for name, func in (('previous', _previous), ('compiled', _compiled)):
+        outf = io.StringIO(newline='')
+        start = time.perf_counter()
+        func(io.StringIO(text, newline=''), outf)
+        elapsed = time.perf_counter() - start
+        rates[name] = nrows / elapsed
+        outputs[name] = outf.getvalue()
+        print('{}: {} rows in {:.2f} sec, {:,.0f} rows/sec'.format(
+            name, nrows, elapsed, rates[name]))
+    print('Same output: {}, speedup {:.2f}x'.format(
+        outputs['previous'] == outputs['compiled'], 
+        rates['compiled'] / rates['previous']))
+    return rates
 
 # .............................................................................
 if __name__ == '__main__':
@@ -507,7 +1458,16 @@ if __name__ == '__main__':
     parser.add_argument(
         '--outpath', type=str, default='/tmp',
         help='Optional path for DWCA extraction')
+    parser.add_argument(
+        '--guid_filter', type=str, default=GUID_FILTER.FILENAME,
+        help='Broker GUID filter to add posted GUIDs to')
+    parser.add_argument(
+        '--benchmark', type=int, default=0,
+        help='Compare Solr rewrite speed on this many generated rows and exit')
     args = parser.parse_args()
+    if args.benchmark:
+        benchmark_solr_transform(args.benchmark)
+        exit(0)
     
     zname = args.dwca_file
     dwca_url = args.rss
@@ -524,4 +1484,5 @@ if __name__ == '__main__':
     
     # index_specify7_dataset(
     #     zname, dwca_url, outpath, TST_VALUES.SPECIFY_SOLR_LOCATION, 
-    #     TST_VALUES.SPECIFY_SOLR_COLLECTION, testguids=occguids)
+    #     TST_VALUES.SPECIFY_SOLR_COLLECTION, testguids=occguids,
+    #     guid_filter_fname=args.guid_filter)
@@ -1,9 +1,15 @@
+import concurrent.futures
+import datetime
+import json
 import requests
 import subprocess
+import time
 
-from lmtrex.common.lmconstants import SPECIFY, TST_VALUES
+from lmtrex.common.lmconstants import (
+    HTTP_POOL, SOLR_EXPORT, SOLR_UPDATE, SPECIFY, TST_VALUES)
 from lmtrex.common.s2n_type import S2nKey, S2nOutput
-from lmtrex.tools.provider.api import APIQuery
+from lmtrex.tools.provider.api import APIQuery, get_request_timeout, get_session
+from lmtrex.tools.s2n.utils import run_bounded
 
 SOLR_POST_COMMAND = '/opt/solr/bin/post'
 SOLR_COMMAND = '/opt/solr/bin/solr'
@@ -18,10 +24,110 @@ def _get_record_format(collection):
     return 'Solr schema {} TBD'.format(collection)
 
 # ......................................................
-def count_docs(collection, solr_location):
-    output = query(collection, solr_location, query_term='*')
-    output.pop(S2nKey.RECORDS)
-    return output
+def _get_filter_queries(filters):
+    if not filters:
+        return []
+    return ['{}:{}'.format(key, val) for key, val in filters.items()]
+
+# ......................................................
+def count_docs(collection, solr_location, query_term='*:*', filters=None):
+    """Count documents in a Solr collection without returning any of them.
+    
+    Args:
+        collection: name of the Solr collection
+        solr_location: IP or FQDN for solr index
+        query_term: Solr q parameter
+        filters: optional dictionary of field to value, each sent as a filter 
+            query
+
+    Return: 
+        number of documents matching the query
+        
+    Raises:
+        requests.HTTPError: on a failed Solr request
+    """
+    solr_endpt = 'http://{}:8983/solr/{}/select'.format(solr_location, collection)
+    params = {
+        'q': query_term, 'fq': _get_filter_queries(filters), 'rows': 0, 
+        'wt': 'json'}
+    response = get_session(solr_endpt).get(
+        solr_endpt, params=params, timeout=SOLR_EXPORT.TIMEOUT)
+    response.raise_for_status()
+    return response.json()['response']['numFound']
+
+# ......................................................
+def get_index_modified(collection, solr_location, timeout=SOLR_EXPORT.TIMEOUT):
+    """Return when the index of a Solr core last changed.
+    
+    Args:
+        collection: name of the Solr core
+        solr_location: IP or FQDN for solr index
+        timeout: seconds to wait for Solr
+
+    Return: 
+        time of the last commit that changed the index, in seconds since the 
+        epoch, or None for an empty index
+        
+    Raises:
+        requests.HTTPError: on a failed Solr request
+    """
+    solr_endpt = 'http://{}:8983/solr/admin/cores'.format(solr_location)
+    params = {'action': 'STATUS', 'core': collection, 'wt': 'json'}
+    response = get_session(solr_endpt).get(solr_endpt, params=params, timeout=timeout)
+    response.raise_for_status()
+    # ISO 8601 UTC time, such as 2021-06-03T18:25:43.511Z
+    modified = response.json()['status'][collection]['index'].get('lastModified')
+    if not modified:
+        return None
+    return datetime.datetime.fromisoformat(
+        modified.replace('Z', '+00:00')).timestamp()
+
+# ......................................................
+def export_docs(
+        collection, solr_location, fields=None, page_size=SOLR_EXPORT.PAGE_SIZE,
+        query_term='*:*', filters=None):
+    """Read every document matching a query, one page at a time, with a cursor.
+    
+    Args:
+        collection: name of the Solr collection
+        solr_location: IP or FQDN for solr index
+        fields: optional list of document fields to return, all if None
+        page_size: number of documents requested at once
+        query_term: Solr q parameter
+        filters: optional dictionary of field to value, each sent as a filter 
+            query
+
+    Yields: 
+        Solr documents, as dictionaries, sorted by uniqueKey
+        
+    Raises:
+        requests.HTTPError: on a failed Solr request
+        
+    Note:
+        Only one page is held in memory.  Documents added or changed during the 
+        export may or may not be returned.
+    """
+    solr_endpt = 'http://{}:8983/solr/{}/select'.format(solr_location, collection)
+    session = get_session(solr_endpt)
+    params = {
+        'q': query_term, 'fq': _get_filter_queries(filters), 'rows': page_size, 
+        'sort': '{} asc'.format(SOLR_EXPORT.UNIQUE_KEY), 'wt': 'json'}
+    if fields:
+        params['fl'] = ','.join(fields)
+    cursor = '*'
+    while True:
+        params['cursorMark'] = cursor
+        response = session.get(
+            solr_endpt, params=params, timeout=SOLR_EXPORT.TIMEOUT)
+        response.raise_for_status()
+        output = response.json()
+        for doc in output['response']['docs']:
+            yield doc
+        next_cursor = output['nextCursorMark']
+        # Solr returns the same cursor when there are no more documents
+        if next_cursor == cursor:
+            break
+        cursor = next_cursor
 
 # ...............................................
 def _post_remote(collection, fname, solr_location, headers={}):
@@ -91,11 +197,194 @@ def post(fname, collection, solr_location, headers=None):
     """
     retcode = 0
     if solr_location is not None:
-        retcode, output = _post_remote(fname, collection, solr_location, headers)
+        retcode, output = _post_remote(collection, fname, solr_location, headers)
     else:
         output = _post_local(fname, collection)
     return retcode, output
 
+# .............................................................................
+def _iter_csv_records(in_file):
+    """Yield each CSV record in a file, joining lines whose terminator is escaped.
+    
+    Note:
+        Files written with csv.QUOTE_NONE and escapechar backslash, like the 
+        Solr files written for DWCAs, escape newlines within values.
+    """
+    record = ''
+    for line in in_file:
+        record += line
+        content = line.rstrip('\r\n')
+        # An odd number of trailing backslashes escapes the line terminator
+        if (len(content) - len(content.rstrip('\\'))) % 2 == 1:
+            continue
+        yield record
+        record = ''
+    if record:
+        yield record
+
+# .............................................................................
+def _iter_batches(records, batch_size):
+    batch = []
+    for rec in records:
+        batch.append(rec)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# .............................................................................
+def _post_batch(url, params, headers, data):
+    """Post one batch to a Solr update handler, sending it again on failure.
+    
+    Raises:
+        requests.RequestException: on the last failed attempt
+        
+    Note:
+        The session does not retry, so each batch is sent at most 
+        SOLR_UPDATE.BATCH_RETRIES + 1 times.
+    """
+    session = get_session(url, retry_methods=())
+    for attempt in range(SOLR_UPDATE.BATCH_RETRIES + 1):
+        try:
+            response = session.post(
+                url, data=data, params=params, headers=headers, 
+                timeout=SOLR_UPDATE.TIMEOUT)
+            # Client errors, such as bad documents, will fail again
+            if response.status_code >= 500 or response.status_code == 429:
+                response.raise_for_status()
+        except requests.RequestException:
+            if attempt == SOLR_UPDATE.BATCH_RETRIES:
+                raise
+            time.sleep(SOLR_UPDATE.RETRY_WAIT * 2**attempt)
+        else:
+            response.raise_for_status()
+            return response.status_code
+
+# .............................................................................
+def post_csv_records(
+        header, records, collection, solr_location, 
+        batch_size=SOLR_UPDATE.BATCH_SIZE, 
+        commit_within=SOLR_UPDATE.COMMIT_WITHIN, 
+        max_in_flight=SOLR_UPDATE.MAX_IN_FLIGHT):
+    """Post CSV records to a Solr index in batches, several batches at once.
+    
+    Args:
+        header: CSV header line with Solr field names
+        records: iterable of CSV records, each a line of text with terminator
+        collection: name of the Solr collection to be posted to 
+        solr_location: IP or FQDN for solr index
+        batch_size: maximum number of records in one update request
+        commit_within: milliseconds within which Solr commits the documents
+        max_in_flight: maximum number of batches uploading at once
+        
+    Return: 
+        number of records posted, and a list of error messages for batches 
+        that failed
+        
+    Note:
+        Each batch is sent with the header, so Solr parses it as a complete CSV 
+        document.  Only max_in_flight batches are held in memory.
+    """
+    url = 'http://{}:8983/solr/{}/update'.format(solr_location, collection)
+    headers = {'Content-Type': 'text/csv'}
+    batches = (
+        (len(batch), (header + ''.join(batch)).encode(ENCODING))
+        for batch in _iter_batches(records, batch_size))
+    return _post_batches(url, commit_within, headers, batches, max_in_flight)
+
+# .............................................................................
+def _post_batches(url, commit_within, headers, batches, max_in_flight):
+    """Post batches to a Solr update handler, several at once.
+    
+    Args:
+        batches: iterable of (number of documents, request body) tuples
+    
+    Return: 
+        number of documents posted, and a list of error messages for batches 
+        that failed
+    """
+    params = {'commitWithin': commit_within}
+    # Number of documents in each batch, in the order batches are sent
+    sizes = []
+    # ...............................................
+    def _get_calls():
+        for size, data in batches:
+            sizes.append(size)
+            yield _post_batch, (url, params, headers, data)
+            
+    posted = 0
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_in_flight) as executor:
+        outcomes = run_bounded(_get_calls(), executor, max_in_flight)
+        for i, (_, err) in enumerate(outcomes):
+            if err is None:
+                posted += sizes[i]
+            else:
+                errors.append('Batch {} failed: {}'.format(i, err))
+    return posted, errors
+
+# .............................................................................
+def delete_ids(
+        ids, collection, solr_location, batch_size=SOLR_UPDATE.BATCH_SIZE, 
+        commit_within=SOLR_UPDATE.COMMIT_WITHIN, 
+        max_in_flight=SOLR_UPDATE.MAX_IN_FLIGHT):
+    """Delete documents from a Solr index by uniqueKey, in batches.
+    
+    Args:
+        ids: iterable of document ids to delete
+        collection: name of the Solr collection
+        solr_location: IP or FQDN for solr index
+        batch_size: maximum number of ids in one update request
+        commit_within: milliseconds within which Solr commits the deletes
+        max_in_flight: maximum number of batches sending at once
+        
+    Return: 
+        number of ids sent for deletion, and a list of error messages for 
+        batches that failed
+    """
+    url = 'http://{}:8983/solr/{}/update'.format(solr_location, collection)
+    headers = {'Content-Type': 'application/json'}
+    batches = (
+        (len(batch), json.dumps({'delete': batch}).encode(ENCODING))
+        for batch in _iter_batches(ids, batch_size))
+    return _post_batches(url, commit_within, headers, batches, max_in_flight)
+
+# .............................................................................
+def commit(collection, solr_location):
+    """Commit documents posted to a Solr index, without waiting for commitWithin.
+    
+    Raises:
+        requests.HTTPError: on a failed Solr request
+    """
+    url = 'http://{}:8983/solr/{}/update'.format(solr_location, collection)
+    # A commit is safe to send again
+    response = get_session(url, retry_methods=HTTP_POOL.QUERY_RETRY_METHODS).post(
+        url, params={'commit': 'true'}, timeout=SOLR_UPDATE.TIMEOUT)
+    response.raise_for_status()
+
+# .............................................................................
+def post_in_batches(fname, collection, solr_location, **kwargs):
+    """Post a CSV file to a Solr index in batches, reading it as it is sent.
+    
+    Args:
+        fname: Full path the CSV file containing data to be indexed in Solr,
+            with a header of Solr field names
+        collection: name of the Solr collection to be posted to 
+        solr_location: IP or FQDN for solr index
+        kwargs: batch_size, commit_within, max_in_flight for post_csv_records
+    
+    Return: 
+        number of records posted, and a list of error messages for batches 
+        that failed
+    """
+    with open(fname, 'r', encoding=ENCODING, newline='') as in_file:
+        records = _iter_csv_records(in_file)
+        header = next(records, '')
+        return post_csv_records(
+            header, records, collection, solr_location, **kwargs)
+
 # .............................................................................
 def query_guid(guid, collection, solr_location):
     """
@@ -112,6 +401,46 @@ def query_guid(guid, collection, solr_location):
     """
     return query(collection, solr_location, filters={'id': guid}, query_term=guid)
     
+# .............................................................................
+def query_guids(guids, collection, solr_location, fields=('id', 'url')):
+    """
+    Query a Specify resolver index for many occurrences at once.
+    
+    Args:
+        guids: list of unique identifiers for records of interest
+        collection: name of the Solr index
+        solr_location: IP or FQDN for solr index
+        fields: document fields to return
+
+    Return: 
+        a dictionary of guid to Solr document, for each guid found in the index
+        
+    Note:
+        Sends one POST request, with a terms filter on id, for each 
+        SPECIFY.RESOLVER_BATCH_SIZE guids.  GUIDs containing the terms separator 
+        (comma) cannot be matched and are skipped.
+    Raises:
+        requests.HTTPError: on a failed Solr request
+    """
+    docs = {}
+    solr_endpt = 'http://{}:8983/solr/{}/select'.format(solr_location, collection)
+    # Select requests are queries, safe to send again
+    session = get_session(solr_endpt, retry_methods=HTTP_POOL.QUERY_RETRY_METHODS)
+    unique_guids = [g for g in dict.fromkeys(guids) if ',' not in g]
+    for start in range(0, len(unique_guids), SPECIFY.RESOLVER_BATCH_SIZE):
+        chunk = unique_guids[start:start + SPECIFY.RESOLVER_BATCH_SIZE]
+        params = {
+            'q': '*:*', 
+            'fq': '{!terms f=id}' + ','.join(chunk),
+            'fl': ','.join(fields), 
+            'rows': len(chunk), 
+            'wt': 'json'}
+        response = session.post(solr_endpt, data=params, timeout=get_request_timeout())
+        response.raise_for_status()
+        for doc in response.json()['response']['docs']:
+            docs[doc['id']] = doc
+    return docs
+    
 # .............................................................................
 def query(collection, solr_location, filters={'*': '*'}, query_term='*'):
     """Query a solr index and return results in JSON format
@@ -162,8 +491,8 @@ def update(collection, solr_location):
 # .............................................................................
 if __name__ == '__main__':
     # test
-    doc = count_docs(SPECIFY.RESOLVER_COLLECTION, SPECIFY.RESOLVER_LOCATION)
-    print('Found {} records in {}'.format(doc, SPECIFY.RESOLVER_COLLECTION))
+    count = count_docs(SPECIFY.RESOLVER_COLLECTION, SPECIFY.RESOLVER_LOCATION)
+    print('Found {} records in {}'.format(count, SPECIFY.RESOLVER_COLLECTION))
     for guid in TST_VALUES.GUIDS_W_SPECIFY_ACCESS:
         doc = query_guid(
             guid, SPECIFY.RESOLVER_COLLECTION, SPECIFY.RESOLVER_LOCATION)
@@ -1,16 +1,162 @@
 """Module containing functions for API Queries"""
+import aiohttp
+import asyncio
 from http import HTTPStatus
+import json
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import typing
 import urllib
+import weakref
+from urllib3.util.retry import Retry
 
-from lmtrex.common.lmconstants import (URL_ESCAPES, ENCODING)
+from lmtrex.common.lmconstants import (HTTP_POOL, RESPONSE_CACHE, URL_ESCAPES, ENCODING)
 from lmtrex.common.s2n_type import S2nKey, S2nOutput
 from lmtrex.tools.fileop.logtools import (log_warn)
 from lmtrex.tools.misc.lm_xml import fromstring, deserialize
+from lmtrex.tools.s2n.cache import ResponseCache, SingleFlight
 from lmtrex.tools.s2n.utils import add_errinfo, combine_errinfo, get_traceback
 
 import lmtrex.tools.s2n.utils as lmutil
+
+# One requests.Session per scheme, host and retried methods, shared by all 
+# queries in this process
+_SESSIONS = {}
+_SESSION_LOCK = threading.Lock()
+# One aiohttp.ClientSession per event loop, shared by all asynchronous queries on it,
+# with the task that closes it when the loop shuts down
+_ASYNC_SESSIONS = weakref.WeakKeyDictionary()
+_RESPONSE_CACHE = None
+# Identical provider queries in progress in this process
+_SINGLE_FLIGHT = SingleFlight()
+
+# .............................................................................
+def get_session(url, retry_methods=None):
+    """Return the process-wide requests.Session for the scheme and host of a URL.
+    
+    Args:
+        url: full URL to be queried
+        retry_methods: HTTP methods retried on throttled and server error 
+            responses, default HTTP_POOL.RETRY_METHODS.  An empty sequence 
+            returns a session that never retries, for callers that retry 
+            themselves.
+        
+    Note:
+        Sessions keep connections alive between queries, and retry with backoff
+        using the limits in lmtrex.common.lmconstants HTTP_POOL.  Each host has 
+        one session for each set of retry_methods.
+    """
+    if retry_methods is None:
+        retry_methods = HTTP_POOL.RETRY_METHODS
+    retry_methods = frozenset(retry_methods)
+    parts = urllib.parse.urlsplit(url)
+    session_key = (parts.scheme, parts.netloc, retry_methods)
+    with _SESSION_LOCK:
+        try:
+            session = _SESSIONS[session_key]
+        except KeyError:
+            if retry_methods:
+                retry = Retry(
+                    total=HTTP_POOL.RETRY_TOTAL, 
+                    read=HTTP_POOL.RETRY_READ,
+                    backoff_factor=HTTP_POOL.RETRY_BACKOFF_FACTOR,
+                    status_forcelist=HTTP_POOL.RETRY_STATUS_CODES,
+                    allowed_methods=retry_methods,
+                    raise_on_status=False)
+            else:
+                retry = Retry(total=0, read=False, raise_on_status=False)
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL.POOL_CONNECTIONS, 
+                pool_maxsize=HTTP_POOL.POOL_MAXSIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSIONS[session_key] = session
+    return session
+
+# .............................................................................
+def get_request_timeout():
+    """Return the (connect, read) timeout in seconds for a request sent now.
+    
+    Note:
+        Inside a provider query run with a deadline, by 
+        lmtrex.tools.s2n.utils.run_with_deadlines or run_with_deadline, neither 
+        timeout is longer than the time left, so that a query abandoned at its 
+        deadline does not keep its thread waiting on the provider.  Otherwise the 
+        timeouts are HTTP_POOL.CONNECT_TIMEOUT and HTTP_POOL.READ_TIMEOUT.
+    """
+    remaining = lmutil.get_time_remaining()
+    if remaining is None:
+        return (HTTP_POOL.CONNECT_TIMEOUT, HTTP_POOL.READ_TIMEOUT)
+    # Time out at once, rather than waiting indefinitely, when no time is left
+    remaining = max(remaining, 0.001)
+    return (min(HTTP_POOL.CONNECT_TIMEOUT, remaining), remaining)
+
+# .............................................................................
+def get_async_session():
+    """Return the aiohttp.ClientSession for the running event loop, creating it if needed.
+    
+    Note:
+        Must be called from a coroutine.  The connector keeps at most 
+        HTTP_POOL.POOL_MAXSIZE connections open per host.  The session is closed 
+        when the loop shuts down, as asyncio.run does, by cancelling a task that 
+        waits for it; or by close_async_session.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        session, _ = _ASYNC_SESSIONS[loop]
+    except KeyError:
+        session = None
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=HTTP_POOL.POOL_MAXSIZE)
+        session = aiohttp.ClientSession(connector=connector)
+        closer = loop.create_task(_close_on_shutdown(session))
+        _ASYNC_SESSIONS[loop] = (session, closer)
+    return session
+
+# .............................................................................
+async def _close_on_shutdown(session):
+    """Wait until cancelled, when the event loop shuts down, then close the session."""
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await session.close()
+
+# .............................................................................
+async def close_async_session():
+    """Close the aiohttp.ClientSession for the running event loop, if one is open."""
+    session, closer = _ASYNC_SESSIONS.pop(
+        asyncio.get_running_loop(), (None, None))
+    if session is not None:
+        closer.cancel()
+        await session.close()
+
+# .............................................................................
+def get_response_cache():
+    """Return the process-wide cache of provider responses, creating it on first use.
+    
+    Note:
+        Hit and miss counts are available from get_response_cache().stats()
+    """
+    global _RESPONSE_CACHE
+    with _SESSION_LOCK:
+        if _RESPONSE_CACHE is None:
+            _RESPONSE_CACHE = ResponseCache(
+                RESPONSE_CACHE.DEFAULT_TTL, maxsize=RESPONSE_CACHE.MAXSIZE, 
+                disk_path=RESPONSE_CACHE.DISK_PATH)
+    return _RESPONSE_CACHE
+
+# .............................................................................
+def get_single_flight():
+    """Return the process-wide coalescer of identical in-flight provider queries.
+    
+    Note:
+        The number of queries that waited on another's request is available from
+        get_single_flight().stats()
+    """
+    return _SINGLE_FLIGHT
+
 # .............................................................................
 class APIQuery:
     """Class to query APIs and return results.
@@ -312,6 +458,159 @@ class APIQuery:
         return S2nOutput(
             0, service, provider=prov_meta, errors=errinfo)
 
+    # ...............................................
+    @classmethod
+    def _get_query_failure(cls, service, err):
+        """Return the output for a provider query that raised an exception.
+        
+        Args:
+            service: type of S^n services
+            err: exception or traceback of the failed query
+        """
+        errinfo = add_errinfo({}, 'error', cls._get_error_message(err=err))
+        return cls.get_api_failure(
+            service, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
+
+    # ...............................................
+    def _parse_get_response(self, status_code, reason, content, text, output_type):
+        """Set 'output' from the body of a GET response, return an error message or None.
+        
+        Note:
+            JSON output falls back to XML if the provider returns XML; an HTML page 
+            instead of JSON is reported as a provider error.
+        """
+        errmsg = None
+        self.status_code = status_code
+        self.reason = reason
+        if status_code == HTTPStatus.OK:
+            if output_type == 'json':
+                try:
+                    self.output = json.loads(content)
+                except Exception as e:
+                    if content.find(b'<html') != -1:
+                        self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+                        errmsg = self._get_error_message(
+                            msg='Provider error', 
+                            err='Invalid JSON response ({})'.format(content))
+                    else:
+                        try:
+                            self.output = deserialize(fromstring(content))
+                        except:
+                            self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+                            errmsg = self._get_error_message(
+                                msg='Provider error', err='Unrecognized output {}'.format(
+                                    content))
+            elif output_type == 'xml':
+                try:
+                    output = fromstring(text)
+                    self.output = output
+                except Exception as e:
+                    self.output = text
+            else:
+                self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+                errmsg = self._get_error_message(
+                    msg='Unrecognized output type {}'.format(output_type))
+        else:
+            errmsg = self._get_error_message(
+                msg='URL {}, code = {}, reason = {}'.format(
+                    self.base_url, self.status_code, self.reason))
+        return errmsg
+
+    # ...............................................
+    def _parse_post_response(self, status_code, reason, content, text, output_type):
+        """Set 'output' from the body of a POST response, return an error message or None."""
+        errmsg = None
+        self.status_code = status_code
+        self.reason = reason
+        if status_code < 400:
+            try:
+                if output_type == 'json':
+                    try:
+                        self.output = json.loads(content)
+                    except Exception as e:
+                        self.output = deserialize(fromstring(content))
+                elif output_type == 'xml':
+                    self.output = deserialize(fromstring(text))
+                else:
+                    errmsg = 'Unrecognized output type {}'.format(output_type)
+            except Exception as e:
+                errmsg = self._get_error_message(
+                    msg='Unrecognized output, URL {}, content={}'.format(
+                        self.base_url, content),
+                    err=e)
+        else:
+            errmsg = self._get_error_message(
+                msg='URL {}, code = {}, reason = {}'.format(
+                    self.base_url, self.status_code, self.reason))
+        return errmsg
+
+    # ...............................................
+    def _is_negative_output(self):
+        """Return True if the provider found nothing for this query.
+        
+        Note:
+            Override in subclasses whose providers report no match in a non-empty 
+            response.
+        """
+        return not self.output
+
+    # ...............................................
+    def _get_cache_key(self, method, url):
+        return (method, url, tuple(sorted(self.headers.items())))
+
+    # ...............................................
+    def _use_cache(self):
+        """Only responses of providers are cached; other queries, such as of Solr 
+        or RSS feeds, must see changes at once."""
+        return RESPONSE_CACHE.ENABLED and self.PROVIDER is not None
+
+    # ...............................................
+    def _read_cache(self, key):
+        """Set status_code, reason, output and error from a cached response.
+        
+        Return:
+            True if the response was found in the cache, False otherwise
+        """
+        if not self._use_cache():
+            return False
+        cached = get_response_cache().get(key)
+        if cached is None:
+            return False
+        self.status_code, self.reason, self.output, self.error = cached
+        return True
+
+    # ...............................................
+    def _write_cache(self, key):
+        """Cache a successful or empty response; errors are not cached."""
+        if not self._use_cache():
+            return
+        if self.error is None and not self._is_negative_output():
+            ttl = RESPONSE_CACHE.TTLS.get(
+                self.PROVIDER[S2nKey.PARAM], RESPONSE_CACHE.DEFAULT_TTL)
+        elif self.error is None or self.status_code in (
+                HTTPStatus.NO_CONTENT, HTTPStatus.NOT_FOUND):
+            ttl = RESPONSE_CACHE.NEGATIVE_TTL
+        else:
+            return
+        get_response_cache().set(
+            key, (self.status_code, self.reason, self.output, self.error), ttl=ttl)
+
+    # ...............................................
+    def _get_post_url(self):
+        all_params = self._other_filters.copy()
+        if self._q_filters:
+            all_params[self._q_key] = self._q_filters
+        query_as_string = urllib.parse.urlencode(all_params)
+        return self.base_url + '/?' + query_as_string
+
+    # ...............................................
+    def _get_state(self):
+        return (self.status_code, self.reason, self.output, self.error)
+
+    # ...............................................
+    def _set_state(self, state):
+        self.status_code, self.reason, self.output, self.error = state
+
     # ...............................................
     def query_by_get(self, output_type='json', verify=True):
         """
@@ -320,68 +619,67 @@ class APIQuery:
         
         Note:
             Sets a single error message, not a list, to error attribute
+        Note:
+            Concurrent identical queries in this process share one request
         """
         self.output = {}
         self.error = None
         self.status_code = None
         self.reason = None
+        cache_key = self._get_cache_key('GET', self.url)
+        if self._read_cache(cache_key):
+            return
+        self._set_state(get_single_flight().do(
+            (cache_key, output_type), 
+            lambda: self._get_response(cache_key, output_type, verify)))
+
+    # ...............................................
+    def _get_response(self, cache_key, output_type, verify):
+        """Send the GET request for query_by_get, return the resulting state"""
         errmsg = None
         try:
+            session = get_session(self.url)
             if verify:
-                response = requests.get(self.url, headers=self.headers)
+                response = session.get(
+                    self.url, headers=self.headers, timeout=get_request_timeout())
             else:
-                response = requests.get(self.url, headers=self.headers, verify=False)
+                response = session.get(
+                    self.url, headers=self.headers, verify=False, 
+                    timeout=get_request_timeout())
         except Exception as e:
             errmsg = self._get_error_message(err=e)
         else:
             # Save server status
             try:
-                self.status_code = response.status_code
-                self.reason = response.reason
+                status_code = response.status_code
+                reason = response.reason
             except Exception:
-                self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-                self.reason = 'Unknown API status_code/reason'
+                status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+                reason = 'Unknown API status_code/reason'
             # Parse response
-            if response.status_code == HTTPStatus.OK:
-                if output_type == 'json':
-                    try:
-                        self.output = response.json()
-                    except Exception as e:
-                        output = response.content
-                        if output.find(b'<html') != -1:
-                            self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-                            errmsg = self._get_error_message(
-                                msg='Provider error', 
-                                err='Invalid JSON response ({})'.format(output))
-                        else:
-                            try:
-                                self.output = deserialize(fromstring(output))
-                            except:
-                                self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-                                errmsg = self._get_error_message(
-                                    msg='Provider error', err='Unrecognized output {}'.format(
-                                        output))
-                elif output_type == 'xml':
-                    try:
-                        output = fromstring(response.text)
-                        self.output = output
-                    except Exception as e:
-                        self.output = response.text
-                else:
-                    self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-                    errmsg = self._get_error_message(
-                        msg='Unrecognized output type {}'.format(output_type))
-            else:
-                errmsg = self._get_error_message(
-                    msg='URL {}, code = {}, reason = {}'.format(
-                        self.base_url, self.status_code, self.reason))
+            errmsg = self._parse_get_response(
+                status_code, reason, response.content, response.text, output_type)
 
         if errmsg:
             self.error = errmsg
+        self._write_cache(cache_key)
+        return self._get_state()
 
     # ...........    ....................................
-    def query_by_post(self, output_type='json', file=None):
-        """Perform a POST request."""
+    def query_by_post(self, output_type='json', file=None, retry=False):
+        """Perform a POST request.
+        
+        Args:
+            output_type: 'json' or 'xml'
+            file: optional file to upload
+            retry: True to retry a parameter POST on throttled and server error 
+                responses, only if the request is a query that is safe to send 
+                again.  File uploads are never retried.
+        
+        Note:
+            Concurrent identical queries in this process share one request; file 
+            uploads are always sent.
+        """
         self.output = None
         self.error = None
         errmsg = None
@@ -389,68 +687,164 @@ class APIQuery:
         if file is not None:
             # TODO: send as bytes here?
             files = {'files': open(file, 'rb')}
+            response = None
             try:
-                response = requests.post(self.base_url, files=files)
+                response = get_session(self.base_url).post(
+                    self.base_url, files=files, timeout=get_request_timeout())
             except Exception as e:
-                try:
-                    ret_code = response.status_code
-                    reason = response.reason
-                except Exception:
-                    ret_code = HTTPStatus.INTERNAL_SERVER_ERROR
-                    reason = 'Unknown Error'
                 errmsg = self._get_error_message(
                     msg='file {}, code = {}, reason = {}'.format(
-                        file, ret_code, reason),
+                        file, HTTPStatus.INTERNAL_SERVER_ERROR, 'Unknown Error'),
                     err=e)
+            self._set_post_response(response, output_type, errmsg)
         # Post parameters
         else:
-            all_params = self._other_filters.copy()
-            if self._q_filters:
-                all_params[self._q_key] = self._q_filters
-            query_as_string = urllib.parse.urlencode(all_params)
-            url = self.base_url + '/?' + query_as_string
-            try:
-                response = requests.post(url, headers=self.headers)
-            except Exception as e:
-                try:
-                    ret_code = response.status_code
-                    reason = response.reason
-                except Exception:
-                    ret_code = HTTPStatus.INTERNAL_SERVER_ERROR
-                    reason = 'Unknown Error'
-                errmsg = self._get_error_message(
-                    msg='code = {}, reason = {}'.format(ret_code, reason), 
-                    err=e)
-        # Save server status
+            url = self._get_post_url()
+            cache_key = self._get_cache_key('POST', url)
+            if self._read_cache(cache_key):
+                return
+            self._set_state(get_single_flight().do(
+                (cache_key, output_type), 
+                lambda: self._post_response(url, cache_key, output_type, retry)))
+
+    # ...............................................
+    def _post_response(self, url, cache_key, output_type, retry):
+        """Send the parameter POST request for query_by_post, return the resulting state"""
+        errmsg = None
+        response = None
+        retry_methods = HTTP_POOL.QUERY_RETRY_METHODS if retry else None
         try:
-            self.status_code = response.status_code
-            self.reason = response.reason
-        except Exception:
+            response = get_session(url, retry_methods=retry_methods).post(
+                url, headers=self.headers, timeout=get_request_timeout())
+        except Exception as e:
+            errmsg = self._get_error_message(
+                msg='code = {}, reason = {}'.format(
+                    HTTPStatus.INTERNAL_SERVER_ERROR, 'Unknown Error'), 
+                err=e)
+        self._set_post_response(response, output_type, errmsg)
+        if response is not None:
+            self._write_cache(cache_key)
+        return self._get_state()
+
+    # ...............................................
+    def _set_post_response(self, response, output_type, errmsg):
+        if response is None:
             self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
             self.reason = 'Unknown API status_code/reason'
-        # Parse response
-        if response.ok:
-            try:
-                if output_type == 'json':
-                    try:
-                        self.output = response.json()
-                    except Exception as e:
-                        output = response.content
-                        self.output = deserialize(fromstring(output))
-                elif output_type == 'xml':
-                    output = response.text
-                    self.output = deserialize(fromstring(output))
-                else:
-                    errmsg = 'Unrecognized output type {}'.format(output_type)
-            except Exception as e:
-                errmsg = self._get_error_message(
-                    msg='Unrecognized output, URL {}, content={}'.format(
-                        self.base_url, response.content),
-                    err=e)
         else:
-            errmsg = self._get_error_message(
-                msg='URL {}, code = {}, reason = {}'.format(
-                    self.base_url, self.status_code, self.reason))
+            # Save server status and parse response
+            errmsg = self._parse_post_response(
+                response.status_code, response.reason, response.content, response.text, 
+                output_type)
             
         if errmsg is not None:
             self.error = errmsg
+
+    # ...............................................
+    async def _async_request(self, method, url, verify=True, retry_methods=None, 
+                             **kwargs):
+        """Send a request with the shared aiohttp session, retrying like get_session.
+        
+        Args:
+            retry_methods: HTTP methods retried, default HTTP_POOL.RETRY_METHODS
+        
+        Return:
+            tuple of (status code, reason, content as bytes, content as text)
+        """
+        if retry_methods is None:
+            retry_methods = HTTP_POOL.RETRY_METHODS
+        session = get_async_session()
+        ssl = None if verify else False
+        attempt = 0
+        while True:
+            connect_timeout, read_timeout = get_request_timeout()
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=connect_timeout, sock_read=read_timeout)
+            async with session.request(
+                    method, url, headers=self.headers, ssl=ssl, timeout=timeout, 
+                    **kwargs) as response:
+                content = await response.read()
+                status, reason = response.status, response.reason
+                encoding = response.charset or ENCODING
+            if (status not in HTTP_POOL.RETRY_STATUS_CODES 
+                    or method not in retry_methods
+                    or attempt >= HTTP_POOL.RETRY_TOTAL):
+                break
+            await asyncio.sleep(HTTP_POOL.RETRY_BACKOFF_FACTOR * (2 ** attempt))
+            attempt += 1
+        return status, reason, content, content.decode(encoding, errors='replace')
+
+    # ...............................................
+    async def query_by_get_async(self, output_type='json', verify=True):
+        """Asynchronous version of query_by_get, sets the same attributes."""
+        self.output = {}
+        self.error = None
+        self.status_code = None
+        self.reason = None
+        cache_key = self._get_cache_key('GET', self.url)
+        if self._read_cache(cache_key):
+            return
+        self._set_state(await get_single_flight().do_async(
+            (cache_key, output_type), 
+            lambda: self._get_response_async(cache_key, output_type, verify)))
+
+    # ...............................................
+    async def _get_response_async(self, cache_key, output_type, verify):
+        errmsg = None
+        try:
+            status_code, reason, content, text = await self._async_request(
+                'GET', self.url, verify=verify)
+        except Exception as e:
+            errmsg = self._get_error_message(err=e)
+        else:
+            errmsg = self._parse_get_response(status_code, reason, content, text, output_type)
+        if errmsg:
+            self.error = errmsg
+        self._write_cache(cache_key)
+        return self._get_state()
+
+    # ...............................................
+    async def query_by_post_async(self, output_type='json', file=None, retry=False):
+        """Asynchronous version of query_by_post, sets the same attributes."""
+        self.output = None
+        self.error = None
+        if file is not None:
+            await self._post_response_async(None, output_type, file=file)
+        else:
+            url = self._get_post_url()
+            cache_key = self._get_cache_key('POST', url)
+            if self._read_cache(cache_key):
+                return
+            self._set_state(await get_single_flight().do_async(
+                (cache_key, output_type), 
+                lambda: self._post_response_async(
+                    cache_key, output_type, url=url, retry=retry)))
+
+    # ...............................................
+    async def _post_response_async(
+            self, cache_key, output_type, url=None, file=None, retry=False):
+        errmsg = None
+        try:
+            if file is not None:
+                with open(file, 'rb') as in_file:
+                    data = aiohttp.FormData()
+                    data.add_field('files', in_file.read(), filename=file)
+                status_code, reason, content, text = await self._async_request(
+                    'POST', self.base_url, data=data)
+            else:
+                retry_methods = HTTP_POOL.QUERY_RETRY_METHODS if retry else None
+                status_code, reason, content, text = await self._async_request(
+                    'POST', url, retry_methods=retry_methods)
+        except Exception as e:
+            self.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
+            self.reason = 'Unknown API status_code/reason'
+            errmsg = self._get_error_message(
+                msg='code = {}, reason = {}'.format(self.status_code, 'Unknown Error'), 
+                err=e)
+        else:
+            errmsg = self._parse_post_response(status_code, reason, content, text, output_type)
+        if errmsg is not None:
+            self.error = errmsg
+        if cache_key is not None and self.status_code is not None:
+            self._write_cache(cache_key)
+        return self._get_state()
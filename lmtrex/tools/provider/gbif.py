@@ -1,18 +1,19 @@
 from collections import OrderedDict
 from http import HTTPStatus
 import os
-import requests
 import urllib
 
 from lmtrex.common.issue_definitions import ISSUE_DEFINITIONS
 from lmtrex.common.lmconstants import (
-    APIService, GBIF, ServiceProvider, URL_ESCAPES, ENCODING)
+    APIService, CONCURRENCY, GBIF, HTTP_POOL, ServiceProvider, URL_ESCAPES, ENCODING)
 from lmtrex.common.s2n_type import S2nEndpoint, S2nKey, S2nOutput, S2nSchema
 from lmtrex.tools.fileop.logtools import (log_info, log_error)
 
 
-from lmtrex.tools.provider.api import APIQuery
-from lmtrex.tools.s2n.utils  import get_traceback, add_errinfo
+from lmtrex.tools.provider.api import APIQuery, get_request_timeout, get_session
+from lmtrex.tools.s2n.cache import TTLCache
+from lmtrex.tools.s2n.utils  import (
+    get_executor, get_traceback, add_errinfo, run_with_deadlines)
 
 # .............................................................................
 class GbifAPI(APIQuery):
@@ -20,6 +21,8 @@ class GbifAPI(APIQuery):
     PROVIDER = ServiceProvider.GBIF
     OCCURRENCE_MAP = S2nSchema.get_gbif_occurrence_map()
     NAME_MAP = S2nSchema.get_gbif_name_map()
+    # Successful occurrence counts, keyed by taxon key
+    COUNT_CACHE = TTLCache(GBIF.COUNT_CACHE_TTL, maxsize=GBIF.COUNT_CACHE_SIZE)
     
     # ...............................................
     def __init__(self, service=GBIF.SPECIES_SERVICE, key=None,
@@ -120,27 +123,42 @@ class GbifAPI(APIQuery):
                 
         Todo: enable paging
         """
-        errinfo = {}
-        api = GbifAPI(
-            service=GBIF.OCCURRENCE_SERVICE, key=GBIF.SEARCH_COMMAND,
-            other_filters={'occurrenceID': occid}, logger=logger)
+        api = cls._get_occid_query(occid, logger=logger)
         try:
             api.query()
         except Exception as e:
-            tb = get_traceback()
-            errinfo['error'] = [cls._get_error_message(err=tb)]
-            std_output = cls.get_api_failure(
-                S2nEndpoint.Occurrence, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-        else:
-            if api.error:
-                errinfo['error'] =  [api.error]
-                
-            # Standardize output from provider response
-            std_output = cls._standardize_occurrence_output(
-                api.output, api.status_code, query_urls=[api.url], 
-                count_only=count_only, errinfo=errinfo)
-        
-        return std_output
+            return cls._get_query_failure(S2nEndpoint.Occurrence, get_traceback())
+        return cls._standardize_occid_response(api, count_only)
+
+    # ...............................................
+    @classmethod
+    async def get_occurrences_by_occid_async(cls, occid, count_only=False, logger=None):
+        """Asynchronous version of get_occurrences_by_occid, with the same arguments 
+        and return value."""
+        api = cls._get_occid_query(occid, logger=logger)
+        try:
+            await api.query_async()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Occurrence, get_traceback())
+        return cls._standardize_occid_response(api, count_only)
+
+    # ...............................................
+    @classmethod
+    def _get_occid_query(cls, occid, logger=None):
+        return GbifAPI(
+            service=GBIF.OCCURRENCE_SERVICE, key=GBIF.SEARCH_COMMAND,
+            other_filters={'occurrenceID': occid}, logger=logger)
+
+    # ...............................................
+    @classmethod
+    def _standardize_occid_response(cls, api, count_only):
+        """Standardize output from a queried occurrenceID search."""
+        errinfo = {}
+        if api.error:
+            errinfo['error'] =  [api.error]
+        return cls._standardize_occurrence_output(
+            api.output, api.status_code, query_urls=[api.url], 
+            count_only=count_only, errinfo=errinfo)
 
     # ...............................................
     @classmethod
@@ -403,35 +421,48 @@ class GbifAPI(APIQuery):
             https://gbif.github.io/gbif-api/apidocs/org/gbif/api/vocabulary/TaxonomicStatus.html
 
         """
-        status = None
-        errinfo = {}
-        if is_accepted:
-            status = 'accepted'
-        name_clean = namestr.strip()
-        other_filters = {'name': name_clean, 'verbose': 'true'}
+        api = cls._get_match_query(namestr, logger=logger)
+        try:
+            api.query()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Name, get_traceback())
+        return cls._standardize_match_response(api, is_accepted)
+
+    # ...............................................
+    @classmethod
+    async def match_name_async(cls, namestr, is_accepted=False, logger=None):
+        """Asynchronous version of match_name, with the same arguments and return value."""
+        api = cls._get_match_query(namestr, logger=logger)
+        try:
+            await api.query_async()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Name, get_traceback())
+        return cls._standardize_match_response(api, is_accepted)
+
+    # ...............................................
+    @classmethod
+    def _get_match_query(cls, namestr, logger=None):
+        other_filters = {'name': namestr.strip(), 'verbose': 'true'}
 #         if rank:
 #             other_filters['rank'] = rank
 #         if kingdom:
 #             other_filters['kingdom'] = kingdom
-        api = GbifAPI(
+        return GbifAPI(
             service=GBIF.SPECIES_SERVICE, key='match',
             other_filters=other_filters, logger=logger)
-        
-        try:
-            api.query()
-        except Exception as e:
-            tb = get_traceback()
-            errinfo['error'] =  [cls._get_error_message(err=tb)]
-            std_output = cls.get_api_failure(
-                S2nEndpoint.Name, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-        else:
-            if api.error:
-                errinfo['error'] =  [api.error]
-            # Standardize output from provider response
-            std_output = cls._standardize_match_output(
-                api.output, status, api.status_code, query_urls=[api.url], errinfo=errinfo)
-            
-        return std_output
+
+    # ...............................................
+    @classmethod
+    def _standardize_match_response(cls, api, is_accepted):
+        """Standardize output from a queried name match."""
+        status = None
+        errinfo = {}
+        if is_accepted:
+            status = 'accepted'
+        if api.error:
+            errinfo['error'] =  [api.error]
+        return cls._standardize_match_output(
+            api.output, status, api.status_code, query_urls=[api.url], errinfo=errinfo)
 
     # ...............................................
     @classmethod
@@ -445,9 +476,7 @@ class GbifAPI(APIQuery):
             A record as a dictionary containing the record count of occurrences
             with this accepted taxon, and a URL to retrieve these records.            
         """
-        simple_output = {}
         errinfo = {}
-        total = 0
         # Query GBIF
         api = GbifAPI(
             service=GBIF.OCCURRENCE_SERVICE, key=GBIF.SEARCH_COMMAND,
@@ -458,7 +487,30 @@ class GbifAPI(APIQuery):
         except Exception as e:
             msg = cls._get_error_message(err=e)
             errinfo = add_errinfo(errinfo, 'error', msg)
-        else:
+        return cls._standardize_count_output(api, errinfo)
+
+    # ...............................................
+    @classmethod
+    async def count_occurrences_for_taxon_async(cls, taxon_key, logger=None):
+        """Asynchronous version of count_occurrences_for_taxon, with the same arguments 
+        and return value."""
+        errinfo = {}
+        api = GbifAPI(
+            service=GBIF.OCCURRENCE_SERVICE, key=GBIF.SEARCH_COMMAND,
+            other_filters={'taxonKey': taxon_key}, logger=logger)
+        try:
+            await api.query_by_get_async()
+        except Exception as e:
+            msg = cls._get_error_message(err=e)
+            errinfo = add_errinfo(errinfo, 'error', msg)
+        return cls._standardize_count_output(api, errinfo)
+
+    # ...............................................
+    @classmethod
+    def _standardize_count_output(cls, api, errinfo):
+        """Return a S2nOutput with the count from a queried GbifAPI occurrence search."""
+        total = 0
+        if not errinfo:
             try:
                 total = api.output['count']
             except Exception as e:
@@ -468,20 +520,62 @@ class GbifAPI(APIQuery):
                 if total < 1:
                     msg = cls._get_error_message(msg='No match')
                     errinfo = add_errinfo(errinfo, 'info', msg)
-                    simple_output[S2nKey.OCCURRENCE_URL] = None
-                else:
-                    simple_output[S2nKey.OCCURRENCE_URL] = api.url
         prov_meta = cls._get_provider_response_elt(query_status=api.status_code, query_urls=[api.url])
         std_output = S2nOutput(
             total, S2nEndpoint.Occurrence, provider=prov_meta, errors=errinfo)
         return std_output
 
+    # ...............................................
+    @classmethod
+    def count_occurrences_for_taxa(cls, taxon_keys, logger=None):
+        """Return counts of occurrence records in GBIF for each of several taxa.
+        
+        Args:
+            taxon_keys: list of GBIF unique identifiers for taxon objects.
+            
+        Returns:
+            A dictionary of taxon_key to a S2nOutput object, as returned by 
+            count_occurrences_for_taxon.
+            
+        Note:
+            Counts are served from COUNT_CACHE when present; all others are queried 
+            at the same time, and successful counts are added to the cache.
+        """
+        counts = {}
+        missing = []
+        for taxon_key in set(taxon_keys):
+            std_output = cls.COUNT_CACHE.get(taxon_key)
+            if std_output is None:
+                missing.append(taxon_key)
+            else:
+                counts[taxon_key] = std_output
+
+        if missing:
+            executor = None
+            if CONCURRENCY.FAN_OUT and len(missing) > 1:
+                executor = get_executor('gbif_count', CONCURRENCY.MAX_WORKERS)
+            results = run_with_deadlines(
+                [(cls.count_occurrences_for_taxon, (taxon_key, logger)) for taxon_key in missing], 
+                [CONCURRENCY.PROVIDER_TIMEOUT for _ in missing], executor=executor)
+            for taxon_key, (std_output, err) in zip(missing, results):
+                if err is not None:
+                    errinfo = {'error': [cls._get_error_message(err=err)]}
+                    std_output = cls.get_api_failure(
+                        S2nEndpoint.Occurrence, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
+                elif 'error' not in std_output.errors:
+                    cls.COUNT_CACHE.set(taxon_key, std_output)
+                counts[taxon_key] = std_output
+        return counts
+
     # ......................................
     @classmethod
     def _post_json_to_parser(cls, url, data, logger=None):
         response = output = None
         try:
-            response = requests.post(url, json=data)
+            # Parsing is a query, safe to send again
+            response = get_session(
+                url, retry_methods=HTTP_POOL.QUERY_RETRY_METHODS).post(
+                    url, json=data, timeout=get_request_timeout())
         except Exception as e:
             if response is not None:
                 ret_code = response.status_code
@@ -582,21 +676,32 @@ class GbifAPI(APIQuery):
         Returns:
             A list of resolved records, each is a dictionary with keys of 
             GBIF fieldnames and values with field values. 
+            
+        Note:
+            Names are sent in chunks of GBIF.PARSER_BATCH_SIZE
         """
+        names = list(names)
         if filename and os.path.exists(filename):
             with open(filename, 'r', encoding=ENCODING) as in_file:
                 for line in in_file:
                     names.append(line.strip())
 
         url = '{}/{}'.format(GBIF.REST_URL, GBIF.PARSER_SERVICE)
-        try:
-            output = GbifAPI._post_json_to_parser(url, names, logger=logger)
-        except Exception as e:
-            log_error(
-                'Failed to get response from GBIF for data {}, {}'.format(
-                    filename, e), logger=logger)
-            raise e
+        output = []
+        for start in range(0, len(names), GBIF.PARSER_BATCH_SIZE):
+            try:
+                chunk_output = GbifAPI._post_json_to_parser(
+                    url, names[start:start + GBIF.PARSER_BATCH_SIZE], logger=logger)
+            except Exception as e:
+                log_error(
+                    'Failed to get response from GBIF for data {}, {}'.format(
+                        filename, e), logger=logger)
+                raise e
+            # Parser returns a list of records, anything else is a failure
+            if isinstance(chunk_output, list):
+                output.extend(chunk_output)
 
+        recs = []
         if output:
             recs = GbifAPI._trim_parsed_output(output, logger=logger)
             if filename is not None:
@@ -628,12 +733,26 @@ class GbifAPI(APIQuery):
             raise
         return pub_org_name
 
+    # ...............................................
+    def _is_negative_output(self):
+        """Return True for an unmatched name or an empty occurrence search."""
+        try:
+            return (self.output.get('matchType') == 'NONE' 
+                    or self.output.get(GBIF.COUNT_KEY) == 0)
+        except AttributeError:
+            return not self.output
+
     # ...............................................
     def query(self):
         """ Queries the API and sets 'output' attribute to a ElementTree object
         """
         APIQuery.query_by_get(self, output_type='json')
 
+    # ...............................................
+    async def query_async(self):
+        """Asynchronous version of query"""
+        await APIQuery.query_by_get_async(self, output_type='json')
+
 
 
 
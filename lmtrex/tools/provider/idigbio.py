@@ -56,11 +56,25 @@ class IdigbioAPI(APIQuery):
                     Idigbio.SEARCH_PREFIX))
         return qry
 
+    # ...............................................
+    def _is_negative_output(self):
+        """Return True for an empty record search."""
+        try:
+            return self.output.get(Idigbio.COUNT_KEY) == 0
+        except AttributeError:
+            return not self.output
+
     # ...............................................
     def query(self):
         """Queries the API and sets 'output' attribute to a JSON object
         """
-        APIQuery.query_by_post(self, output_type='json')
+        # Searches are safe to send again
+        APIQuery.query_by_post(self, output_type='json', retry=True)
+
+    # ...............................................
+    async def query_async(self):
+        """Asynchronous version of query"""
+        await APIQuery.query_by_post_async(self, output_type='json', retry=True)
 
     # ...............................................
     @classmethod
@@ -160,26 +174,41 @@ class IdigbioAPI(APIQuery):
         
         Todo: enable paging
         """
-        errinfo = {}
-        qf = {Idigbio.QKEY: 
-              '{"' + Idigbio.OCCURRENCEID_FIELD + '":"' + occid + '"}'}
-        api = IdigbioAPI(other_filters=qf, logger=logger)
-
+        api = cls._get_occid_query(occid, logger=logger)
         try:
             api.query()
         except Exception as e:
-            errinfo = add_errinfo(errinfo, 'error', cls._get_error_message(err=e)) 
-            std_out = cls.get_api_failure(
-                S2nEndpoint.Occurrence, HTTPStatus.INTERNAL_SERVER_ERROR,
-                errinfo=errinfo)
-        else:
-            errinfo = add_errinfo(errinfo, 'error', api.error)
-            std_out = cls._standardize_output(
-                api.output, Idigbio.COUNT_KEY, Idigbio.RECORDS_KEY, Idigbio.RECORD_FORMAT, 
-                S2nEndpoint.Occurrence, query_status=api.status_code, 
-                query_urls=[api.url], count_only=count_only, errinfo=errinfo)
-        
-        return std_out
+            return cls._get_query_failure(S2nEndpoint.Occurrence, e)
+        return cls._standardize_occid_response(api, count_only)
+
+    # ...............................................
+    @classmethod
+    async def get_occurrences_by_occid_async(cls, occid, count_only=False, logger=None):
+        """Asynchronous version of get_occurrences_by_occid, with the same arguments 
+        and return value."""
+        api = cls._get_occid_query(occid, logger=logger)
+        try:
+            await api.query_async()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Occurrence, e)
+        return cls._standardize_occid_response(api, count_only)
+
+    # ...............................................
+    @classmethod
+    def _get_occid_query(cls, occid, logger=None):
+        qf = {Idigbio.QKEY: 
+              '{"' + Idigbio.OCCURRENCEID_FIELD + '":"' + occid + '"}'}
+        return IdigbioAPI(other_filters=qf, logger=logger)
+
+    # ...............................................
+    @classmethod
+    def _standardize_occid_response(cls, api, count_only):
+        """Standardize output from a queried occurrenceID search."""
+        errinfo = add_errinfo({}, 'error', api.error)
+        return cls._standardize_output(
+            api.output, Idigbio.COUNT_KEY, Idigbio.RECORDS_KEY, Idigbio.RECORD_FORMAT, 
+            S2nEndpoint.Occurrence, query_status=api.status_code, 
+            query_urls=[api.url], count_only=count_only, errinfo=errinfo)
 
     # ...............................................
     @classmethod
@@ -1,3 +1,4 @@
+import asyncio
 from collections import OrderedDict
 from http import HTTPStatus
 import pykew.ipni as ipni
@@ -233,6 +234,19 @@ class IpniAPI(APIQuery):
             
         return std_output
 
+    # ...............................................
+    @classmethod
+    async def match_name_async(cls, namestr, is_accepted=False, logger=None):
+        """Asynchronous version of match_name, with the same arguments and return value.
+        
+        Note:
+            pykew queries IPNI synchronously, so the query runs in the event loop's 
+            default executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, cls.match_name, namestr, is_accepted, logger)
+
 
 
     # ...............................................
@@ -241,6 +255,11 @@ class IpniAPI(APIQuery):
         """
         APIQuery.query_by_get(self, output_type='json')
 
+    # ...............................................
+    async def query_async(self):
+        """Asynchronous version of query"""
+        await APIQuery.query_by_get_async(self, output_type='json')
+
 
 
 
@@ -300,38 +300,54 @@ class ItisAPI(APIQuery):
         Example URL: 
             http://services.itis.gov/?q=nameWOInd:Spinus\%20tristis&wt=json
         """
-        errinfo = {}
+        api = cls._get_match_query(sciname, kingdom=kingdom, logger=logger)
+        try:
+            api.query()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Name, get_traceback())
+        return cls._standardize_match_output(api, is_accepted)
+
+# ...............................................
+    @classmethod
+    async def match_name_async(cls, sciname, is_accepted=False, kingdom=None, logger=None):
+        """Asynchronous version of match_name, with the same arguments and return value."""
+        api = cls._get_match_query(sciname, kingdom=kingdom, logger=logger)
+        try:
+            await api.query_async()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Name, get_traceback())
+        return cls._standardize_match_output(api, is_accepted)
+
+# ...............................................
+    @classmethod
+    def _get_match_query(cls, sciname, kingdom=None, logger=None):
         q_filters = {ITIS.NAME_KEY: sciname}
         if kingdom is not None:
             q_filters['kingdom'] = kingdom
-        api = ItisAPI(ITIS.SOLR_URL, q_filters=q_filters, logger=logger)
+        return ItisAPI(ITIS.SOLR_URL, q_filters=q_filters, logger=logger)
 
+# ...............................................
+    @classmethod
+    def _standardize_match_output(cls, api, is_accepted):
+        errinfo = {}
         try:
-            api.query()
-        except Exception as e:
-            tb = get_traceback()
-            std_output = cls.get_api_failure(
-                S2nEndpoint.Name, HTTPStatus.INTERNAL_SERVER_ERROR,
-                errors=[{'error': cls._get_error_message(err=tb)}])
-        else:
-            try:
-                output = api.output['response']
-            except:
-                if api.error is not None:
-                    errinfo['error'] = [cls._get_error_message(err=api.error)]
-                    std_output = cls.get_api_failure(
-                        S2nEndpoint.Name, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-                else:
-                    errinfo['error'] = [cls._get_error_message(msg='Missing `response` element')]
-                    std_output = cls.get_api_failure(
-                        S2nEndpoint.Name, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
+            output = api.output['response']
+        except:
+            if api.error is not None:
+                errinfo['error'] = [cls._get_error_message(err=api.error)]
+                std_output = cls.get_api_failure(
+                    S2nEndpoint.Name, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
             else:
-                errinfo = add_errinfo(errinfo, 'error', api.error)
-                # Standardize output from provider response
-                std_output = cls._standardize_output(
-                    output, ITIS.COUNT_KEY, ITIS.RECORDS_KEY, S2nEndpoint.Name, 
-                    query_status=api.status_code, query_urls=[api.url], is_accepted=is_accepted, 
-                    errinfo=errinfo)
+                errinfo['error'] = [cls._get_error_message(msg='Missing `response` element')]
+                std_output = cls.get_api_failure(
+                    S2nEndpoint.Name, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
+        else:
+            errinfo = add_errinfo(errinfo, 'error', api.error)
+            # Standardize output from provider response
+            std_output = cls._standardize_output(
+                output, ITIS.COUNT_KEY, ITIS.RECORDS_KEY, S2nEndpoint.Name, 
+                query_status=api.status_code, query_urls=[api.url], is_accepted=is_accepted, 
+                errinfo=errinfo)
         return std_output
 
 # ...............................................
@@ -368,11 +384,24 @@ class ItisAPI(APIQuery):
         return std_output
 
 
+    # ...............................................
+    def _is_negative_output(self):
+        """Return True for an empty Solr search."""
+        try:
+            return self.output['response'][ITIS.COUNT_KEY] == 0
+        except (KeyError, TypeError):
+            return not self.output
+
     # ...............................................
     def query(self):
         """Queries the API and sets 'output' attribute to a JSON object"""
         APIQuery.query_by_get(self, output_type='json')
 
+    # ...............................................
+    async def query_async(self):
+        """Asynchronous version of query"""
+        await APIQuery.query_by_get_async(self, output_type='json')
+
 # # ...............................................
 #     @classmethod
 #     def get_vernacular_by_tsn(cls, tsn, logger=None):
@@ -160,22 +160,30 @@ class LifemapperAPI(APIQuery):
 
     # ...............................................
     @classmethod
-    def _standardize_map_output(
-            cls, output, service, query_status=None, prjscenariocodes=None, color=None, count_only=False, 
-            query_urls=[], errinfo={}):
-        occ_layer_rec = None
-        stdrecs = []
-            
-        # Records
+    def _get_occurrenceset_url(cls, output, errinfo):
+        """Return the metadata URL of the occurrenceset for projection records, and errinfo"""
+        occ_url = None
         if len(output) > 0:
             try:
                 occ_url = output[0]['occurrence_set']['metadata_url']
             except Exception as e:
                 msg = cls._get_error_message('Failed to return occurrence URL')
                 errinfo = add_errinfo(errinfo, 'error', msg)
-            else:
-                occ_rec = cls._get_occurrenceset_record(occ_url)
-                occ_layer_rec = cls._standardize_layer_record(occ_rec)
+        return occ_url, errinfo
+
+    # ...............................................
+    @classmethod
+    def _standardize_map_output(
+            cls, output, service, query_status=None, prjscenariocodes=None, color=None, count_only=False, 
+            query_urls=[], occ_rec=None, errinfo={}):
+        """Standardize projection records, with occ_rec the occurrenceset they were 
+        modeled from, as returned by _get_occurrenceset_record."""
+        occ_layer_rec = None
+        stdrecs = []
+            
+        # Records
+        if occ_rec is not None:
+            occ_layer_rec = cls._standardize_layer_record(occ_rec)
         
         if occ_layer_rec and not count_only:
             stdrecs.append(occ_layer_rec)
@@ -244,29 +252,52 @@ class LifemapperAPI(APIQuery):
             Lifemapper contains only 'Accepted' name froms the GBIF Backbone 
             Taxonomy and this method requires them for success.
         """
-        errinfo = {}
-        other_filters[Lifemapper.NAME_KEY] = name
-        other_filters[Lifemapper.ATOM_KEY] = 0
-        api = LifemapperAPI(
-            resource=Lifemapper.PROJ_RESOURCE, other_filters=other_filters)
-        
+        api = cls._get_map_layers_query(name, other_filters)
         try:
             api.query_by_get()
         except Exception as e:
-            tb = get_traceback()
-            errinfo = add_errinfo(errinfo, 'error', cls._get_error_message(err=tb))
-            
-            std_output = cls.get_api_failure(
-                S2nEndpoint.Map, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-        else:
-            errinfo = add_errinfo(errinfo, 'error', api.error)
-            
-            std_output = cls._standardize_map_output(
-                api.output, S2nEndpoint.Map, query_status=api.status_code, 
-                query_urls=[api.url], prjscenariocodes=prjscenariocodes, color=color, 
-                count_only=False, errinfo=errinfo)
+            return cls._get_query_failure(S2nEndpoint.Map, get_traceback())
+        errinfo = add_errinfo({}, 'error', api.error)
+        occ_rec = None
+        occ_url, errinfo = cls._get_occurrenceset_url(api.output, errinfo)
+        if occ_url is not None:
+            occ_rec = cls._get_occurrenceset_record(occ_url)
+        return cls._standardize_map_output(
+            api.output, S2nEndpoint.Map, query_status=api.status_code, 
+            query_urls=[api.url], prjscenariocodes=prjscenariocodes, color=color, 
+            count_only=False, occ_rec=occ_rec, errinfo=errinfo)
 
-        return std_output
+    # ...............................................
+    @classmethod
+    async def find_map_layers_by_name_async(
+            cls, name, prjscenariocodes=None, color=None, other_filters={}, 
+            logger=None):
+        """Asynchronous version of find_map_layers_by_name, with the same arguments 
+        and return value."""
+        api = cls._get_map_layers_query(name, other_filters)
+        try:
+            await api.query_by_get_async()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Map, get_traceback())
+        errinfo = add_errinfo({}, 'error', api.error)
+        occ_rec = None
+        occ_url, errinfo = cls._get_occurrenceset_url(api.output, errinfo)
+        if occ_url is not None:
+            occ_rec = await cls._get_occurrenceset_record_async(occ_url)
+        return cls._standardize_map_output(
+            api.output, S2nEndpoint.Map, query_status=api.status_code, 
+            query_urls=[api.url], prjscenariocodes=prjscenariocodes, color=color, 
+            count_only=False, occ_rec=occ_rec, errinfo=errinfo)
+
+    # ...............................................
+    @classmethod
+    def _get_map_layers_query(cls, name, other_filters):
+        # Copy so the caller's (or default) dictionary is not modified
+        other_filters = dict(other_filters)
+        other_filters[Lifemapper.NAME_KEY] = name
+        other_filters[Lifemapper.ATOM_KEY] = 0
+        return LifemapperAPI(
+            resource=Lifemapper.PROJ_RESOURCE, other_filters=other_filters)
    
     # ...............................................
     @classmethod
@@ -296,6 +327,20 @@ class LifemapperAPI(APIQuery):
                 pass
         return rec
 
+    # ...............................................
+    @classmethod
+    async def _get_occurrenceset_record_async(cls, url, logger=None):
+        """Asynchronous version of _get_occurrenceset_record"""
+        rec = None
+        api = APIQuery(url)            
+        try:
+            await api.query_by_get_async()
+        except Exception as e:
+            pass
+        else:
+            rec = api.output
+        return rec
+
 # .............................................................................
 if __name__ == '__main__':
     # test
@@ -49,38 +49,62 @@ class MorphoSourceAPI(APIQuery):
                 newrec[stdfld] =  val
         return newrec
     
+    # ...............................................
+    def _is_negative_output(self):
+        """Return True for an empty specimen search."""
+        try:
+            return self.output.get(MorphoSource.TOTAL_KEY) == 0
+        except AttributeError:
+            return not self.output
+
     # ...............................................
     @classmethod
-    def get_occurrences_by_occid_page1(cls, occid, count_only=False, logger=None):
-        start = 0
-        errinfo = {}
+    def _get_occid_page1_query(cls, occid):
         api = MorphoSourceAPI(
             resource=MorphoSource.OCC_RESOURCE, 
             q_filters={MorphoSource.OCCURRENCEID_KEY: occid},
-            other_filters={'start': start, 'limit': MorphoSource.LIMIT})
+            other_filters={'start': 0, 'limit': MorphoSource.LIMIT})
         # Handle bad SSL certificate on old MorphoSource API until v2 is working
         verify=True
         if api.url.index(MorphoSource.REST_URL) >= 0:
             verify=False
+        return api, verify
+
+    # ...............................................
+    @classmethod
+    def _standardize_occid_output(cls, api, count_only, errinfo):
+        # Standardize output from provider response
+        if api.error:
+            errinfo['error'] =  [api.error]
+
+        std_out = cls._standardize_output(
+            api.output, MorphoSource.TOTAL_KEY, MorphoSource.RECORDS_KEY, 
+            MorphoSource.RECORD_FORMAT, S2nEndpoint.Occurrence, 
+            query_status=api.status_code, query_urls=[api.url], count_only=count_only, 
+            errinfo=errinfo)
+        return std_out
+
+    # ...............................................
+    @classmethod
+    def get_occurrences_by_occid_page1(cls, occid, count_only=False, logger=None):
+        api, verify = cls._get_occid_page1_query(occid)
         try:
             api.query_by_get(verify=verify)
         except Exception as e:
-            tb = get_traceback()
-            errinfo = add_errinfo(errinfo, 'error', cls._get_error_message(err=tb))
-            std_out = cls.get_api_failure(
-                S2nEndpoint.Occurrence, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-        else:
-            # Standardize output from provider response
-            if api.error:
-                errinfo['error'] =  [api.error]
+            return cls._get_query_failure(S2nEndpoint.Occurrence, get_traceback())
+        return cls._standardize_occid_output(api, count_only, {})
 
-            std_out = cls._standardize_output(
-                api.output, MorphoSource.TOTAL_KEY, MorphoSource.RECORDS_KEY, 
-                MorphoSource.RECORD_FORMAT, S2nEndpoint.Occurrence, 
-                query_status=api.status_code, query_urls=[api.url], count_only=count_only, 
-                errinfo=errinfo)
-        
-        return std_out
+    # ...............................................
+    @classmethod
+    async def get_occurrences_by_occid_page1_async(cls, occid, count_only=False, logger=None):
+        """Asynchronous version of get_occurrences_by_occid_page1, with the same 
+        arguments and return value."""
+        api, verify = cls._get_occid_page1_query(occid)
+        try:
+            await api.query_by_get_async(verify=verify)
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Occurrence, get_traceback())
+        return cls._standardize_occid_output(api, count_only, {})
 
 # .............................................................................
 if __name__ == '__main__':
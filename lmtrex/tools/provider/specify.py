@@ -97,26 +97,51 @@ class SpecifyPortalAPI(APIQuery):
             in the Solr Specify Resolver but are not resolvable to the host 
             database.  URLs returned for these records begin with 'unknown_url'.
         """
+        std_output = cls._get_unqueried_output(url, count_only)
+        if std_output is not None:
+            return std_output
+        api = cls(url=url, logger=logger)
+        try:
+            api.query_by_get()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Occurrence, e)
+        return cls._standardize_record_response(api, url, count_only)
+
+    # ...............................................
+    @classmethod
+    async def get_specify_record_async(cls, occid, url, count_only, logger=None):
+        """Asynchronous version of get_specify_record, with the same arguments and 
+        return value."""
+        std_output = cls._get_unqueried_output(url, count_only)
+        if std_output is not None:
+            return std_output
+        api = cls(url=url, logger=logger)
+        try:
+            await api.query_by_get_async()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Occurrence, e)
+        return cls._standardize_record_response(api, url, count_only)
+
+    # ...............................................
+    @classmethod
+    def _get_unqueried_output(cls, url, count_only):
+        """Return output for a record URL that cannot be queried, or None."""
         errinfo = {}
         if url is None:
             errinfo = add_errinfo(errinfo, 'info', 'No URL to Specify record')
-            std_output = cls._standardize_output(
-                {}, S2nEndpoint.Occurrence, count_only=count_only, 
-                errinfo=errinfo)
-        elif url.startswith('http'):
-            api = APIQuery(url, headers=JSON_HEADERS, logger=logger)
-    
-            try:
-                api.query_by_get()
-            except Exception as e:
-                errinfo = add_errinfo(errinfo,'error', cls._get_error_message(err=e))
-                std_output = cls.get_api_failure(
-                    S2nEndpoint.Occurrence, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-            else:
-                errinfo = add_errinfo(errinfo,'error', api.error)
-                # Standardize output from provider response
-                std_output = cls._standardize_output(
-                    api.output, S2nEndpoint.Occurrence, query_status=api.status_code, 
-                    query_urls=[url], count_only=count_only, errinfo=errinfo)
-        
-        return std_output
+        elif not url.startswith('http'):
+            errinfo = add_errinfo(
+                errinfo, 'info', 'Specify record URL {} is not resolvable'.format(url))
+        else:
+            return None
+        return cls._standardize_output(
+            {}, S2nEndpoint.Occurrence, count_only=count_only, errinfo=errinfo)
+
+    # ...............................................
+    @classmethod
+    def _standardize_record_response(cls, api, url, count_only):
+        """Standardize output from a queried Specify record URL."""
+        errinfo = add_errinfo({}, 'error', api.error)
+        return cls._standardize_output(
+            api.output, S2nEndpoint.Occurrence, query_status=api.status_code, 
+            query_urls=[url], count_only=count_only, errinfo=errinfo)
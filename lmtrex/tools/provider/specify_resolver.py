@@ -1,8 +1,11 @@
 from http import HTTPStatus
 
-from lmtrex.common.lmconstants import (APIService, SYFTER, ServiceProvider)
+from lmtrex.common.lmconstants import (APIService, SPECIFY, SYFTER, ServiceProvider)
 from lmtrex.common.s2n_type import COMMUNITY_SCHEMA, S2nEndpoint, S2nKey, S2nOutput, S2nSchema
+from lmtrex.tools.misc import solr
 from lmtrex.tools.provider.api import APIQuery
+from lmtrex.tools.s2n.guid_filter import may_be_indexed
+from lmtrex.tools.s2n.guid_index import lookup_guid
 from lmtrex.tools.s2n.utils import get_traceback, add_errinfo
 
 # .............................................................................
@@ -107,6 +110,17 @@ class SpecifyResolverAPI(APIQuery):
                 count, S2nEndpoint.Resolve, provider=prov_meta, errors=errinfo)
         return std_output
 
+    # ...............................................
+    @staticmethod
+    def _get_indexed_record(guid):
+        """Return a resolver record with the id, dataset and URL of a GUID from the 
+        local GUID index, or None if it is not there."""
+        found = lookup_guid(guid)
+        if found is None:
+            return None
+        dataset_guid, url = found
+        return {'id': guid, 'dataset_guid': dataset_guid, 'url': url}
+
     # ...............................................
     @classmethod
     def resolve_guid_to_url(cls, occid):
@@ -123,6 +137,45 @@ class SpecifyResolverAPI(APIQuery):
                 url = rec[fldname]
         return url
 
+    # ...............................................
+    @classmethod
+    def resolve_guids_to_urls(
+            cls, guids, collection=SPECIFY.RESOLVER_COLLECTION, 
+            solr_location=SPECIFY.RESOLVER_SOLR_LOCATION):
+        """Resolve many GUIDs to the URLs of their Specify records.
+        
+        Args:
+            guids: list of unique identifiers for specimen records
+            collection: name of the Solr resolver index
+            solr_location: IP or FQDN for the Solr resolver index
+
+        Return:
+            a dictionary of each guid to its record URL, or None if it is not in the 
+            resolver, like resolve_guid_to_url
+            
+        Note:
+            Queries the resolver's Solr index directly, one request for each 
+            SPECIFY.RESOLVER_BATCH_SIZE guids, and raises an exception if a request fails.
+            GUIDs that the local GUID filter shows are not indexed are not queried, 
+            and those in the local GUID index are resolved from it.
+        """
+        urls = {}
+        missing = []
+        for guid in guids:
+            found = lookup_guid(guid)
+            if found is not None:
+                urls[guid] = found[1]
+            elif may_be_indexed(guid):
+                missing.append(guid)
+        docs = solr.query_guids(missing, collection, solr_location, fields=('id', 'url'))
+        for guid in guids:
+            if guid not in urls:
+                try:
+                    urls[guid] = docs[guid]['url']
+                except KeyError:
+                    urls[guid] = None
+        return urls
+
 # ...............................................
     @classmethod
     def query_for_guid(cls, guid, logger=None):
@@ -140,22 +193,51 @@ class SpecifyResolverAPI(APIQuery):
         Example URL: 
             http://services.itis.gov/?q=nameWOInd:Spinus\%20tristis&wt=json
         """
-        errinfo = {}
+        std_output = cls._get_local_output(guid)
+        if std_output is not None:
+            return std_output
         api = SpecifyResolverAPI(ident=guid, logger=logger)
-
         try:
             api.query_by_get(output_type='json')
         except Exception as e:
-            errinfo = add_errinfo(errinfo, 'error', cls._get_error_message(err=e))
-            std_output = cls.get_api_failure(
-                S2nEndpoint.Resolve, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-        else:
-            if api.error:
-                errinfo['error'] =  [api.error]
-            # Standardize output from provider response
-            std_output = cls._standardize_output(
-                api.output, query_status=api.status_code, query_urls=[api.url], errinfo=errinfo)
-        return std_output
+            return cls._get_query_failure(S2nEndpoint.Resolve, e)
+        return cls._standardize_guid_response(api)
+
+# ...............................................
+    @classmethod
+    async def query_for_guid_async(cls, guid, logger=None):
+        """Asynchronous version of query_for_guid, with the same arguments and return value."""
+        std_output = cls._get_local_output(guid)
+        if std_output is not None:
+            return std_output
+        api = SpecifyResolverAPI(ident=guid, logger=logger)
+        try:
+            await api.query_by_get_async(output_type='json')
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Resolve, e)
+        return cls._standardize_guid_response(api)
+
+# ...............................................
+    @classmethod
+    def _get_local_output(cls, guid):
+        """Return output for GUIDs certainly not in the index, or in the local GUID 
+        index, without a query; None for GUIDs to query."""
+        if not may_be_indexed(guid):
+            return cls._standardize_output(None, errinfo={})
+        indexed = cls._get_indexed_record(guid)
+        if indexed is not None:
+            return cls._standardize_output(indexed, errinfo={})
+        return None
+
+# ...............................................
+    @classmethod
+    def _standardize_guid_response(cls, api):
+        """Standardize output from a queried resolver."""
+        errinfo = {}
+        if api.error:
+            errinfo['error'] =  [api.error]
+        return cls._standardize_output(
+            api.output, query_status=api.status_code, query_urls=[api.url], errinfo=errinfo)
 
     
 # ...............................................
@@ -176,29 +176,40 @@ class WormsAPI(APIQuery):
         Returns:
             Either a dictionary containing a matching record .  
         """
-        status = None
-        errinfo = {}
-        if is_accepted:
-            status = 'accepted'
-        name_clean = namestr.strip()
-        api = WormsAPI(name_clean, other_filters={'marine_only': 'true'}, logger=logger)
-        
+        api = cls._get_match_query(namestr, logger=logger)
         try:
             api.query()
         except Exception as e:
-            tb = get_traceback()
-            errinfo['error'] =  [cls._get_error_message(err=tb)]
-            std_output = cls.get_api_failure(
-                S2nEndpoint.Name, HTTPStatus.INTERNAL_SERVER_ERROR, errinfo=errinfo)
-        else:
-            if api.error:
-                errinfo['error'] =  [api.error]
-            # Standardize output from provider response
-            std_output = cls._standardize_output(
-                api.output, S2nEndpoint.Name, query_status=api.status_code, query_urls=[api.url], 
-                is_accepted=is_accepted, errinfo=errinfo)
-            
-        return std_output
+            return cls._get_query_failure(S2nEndpoint.Name, get_traceback())
+        return cls._standardize_match_response(api, is_accepted)
+
+    # ...............................................
+    @classmethod
+    async def match_name_async(cls, namestr, is_accepted=False, logger=None):
+        """Asynchronous version of match_name, with the same arguments and return value."""
+        api = cls._get_match_query(namestr, logger=logger)
+        try:
+            await api.query_async()
+        except Exception as e:
+            return cls._get_query_failure(S2nEndpoint.Name, get_traceback())
+        return cls._standardize_match_response(api, is_accepted)
+
+    # ...............................................
+    @classmethod
+    def _get_match_query(cls, namestr, logger=None):
+        return WormsAPI(
+            namestr.strip(), other_filters={'marine_only': 'true'}, logger=logger)
+
+    # ...............................................
+    @classmethod
+    def _standardize_match_response(cls, api, is_accepted):
+        """Standardize output from a queried name match."""
+        errinfo = {}
+        if api.error:
+            errinfo['error'] =  [api.error]
+        return cls._standardize_output(
+            api.output, S2nEndpoint.Name, query_status=api.status_code, query_urls=[api.url], 
+            is_accepted=is_accepted, errinfo=errinfo)
 
 
 
@@ -208,6 +219,11 @@ class WormsAPI(APIQuery):
         """
         APIQuery.query_by_get(self, output_type='json')
 
+    # ...............................................
+    async def query_async(self):
+        """Asynchronous version of query"""
+        await APIQuery.query_by_get_async(self, output_type='json')
+
 
 
 
@@ -0,0 +1,321 @@
+"""Module containing caches for provider query results"""
+import asyncio
+from collections import OrderedDict
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import weakref
+
+
+# .............................................................................
+class TTLCache:
+    """Thread-safe dictionary whose values expire a fixed time after being set.
+
+    Note:
+        When maxsize is reached, the least recently used values are removed.  
+        Expired values are removed when they are next read, or when they reach the 
+        least recently used end.
+    """
+    # ...............................................
+    def __init__(self, ttl, maxsize=None):
+        """Constructor
+
+        Args:
+            ttl: seconds a value remains valid after it is set
+            maxsize: optional maximum number of values to hold
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # key: (expiration time, value), oldest first
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ...............................................
+    def __len__(self):
+        return len(self._data)
+
+    # ...............................................
+    def get(self, key, default=None):
+        """Return the value for key, or default if it is missing or expired."""
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    # ...............................................
+    def set(self, key, value, ttl=None):
+        """Save a value for key, valid for ttl seconds (default self.ttl)."""
+        if ttl is None:
+            ttl = self.ttl
+        now = time.monotonic()
+        with self._lock:
+            self._data.pop(key, None)
+            if self.maxsize is not None:
+                while len(self._data) >= self.maxsize:
+                    self._data.popitem(last=False)
+            self._data[key] = (now + ttl, value)
+
+    # ...............................................
+    def clear(self):
+        """Remove all values."""
+        with self._lock:
+            self._data.clear()
+
+# .............................................................................
+class ResponseCache:
+    """Cache of provider responses in memory, optionally shared through a directory.
+    
+    Note:
+        Values are pickled, so each get returns a new copy that callers may modify.
+        Disk entries are one file per key, named by the key's hash, with the 
+        expiration time saved as the file's modification time.  All processes 
+        using the same directory share entries.  Expired files are removed in a 
+        background thread.
+    """
+    # Remove expired files from disk after this many writes
+    PURGE_INTERVAL = 1000
+    
+    # ...............................................
+    def __init__(self, ttl, maxsize=None, disk_path=None):
+        """Constructor
+
+        Args:
+            ttl: default seconds a value remains valid after it is set
+            maxsize: optional maximum number of values to hold in memory
+            disk_path: optional directory to save values in.  If it cannot be 
+                created, values are held only in memory.
+        """
+        self._memory = TTLCache(ttl, maxsize=maxsize)
+        self.disk_path = None
+        if disk_path is not None:
+            try:
+                os.makedirs(disk_path, exist_ok=True)
+            except OSError:
+                pass
+            else:
+                self.disk_path = disk_path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._purge_thread = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ...............................................
+    @property
+    def ttl(self):
+        return self._memory.ttl
+
+    # ...............................................
+    def _get_filename(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.disk_path, digest[:2], digest)
+
+    # ...............................................
+    def _read_disk(self, key):
+        """Return (seconds remaining, pickled value) from disk, or None."""
+        fname = self._get_filename(key)
+        try:
+            remaining = os.stat(fname).st_mtime - time.time()
+            if remaining <= 0:
+                return None
+            with open(fname, 'rb') as in_file:
+                return remaining, in_file.read()
+        except OSError:
+            return None
+
+    # ...............................................
+    def _write_disk(self, key, data, ttl):
+        fname = self._get_filename(key)
+        try:
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(fname))
+            with os.fdopen(fd, 'wb') as out_file:
+                out_file.write(data)
+            expires = time.time() + ttl
+            os.utime(tmpname, (expires, expires))
+            os.replace(tmpname, fname)
+        except OSError:
+            pass
+
+    # ...............................................
+    def _start_purge(self):
+        """Remove expired files in a background thread, unless one is running."""
+        with self._lock:
+            if self._purge_thread is not None and self._purge_thread.is_alive():
+                return
+            self._purge_thread = threading.Thread(
+                target=self._purge_disk, name='ResponseCachePurge', daemon=True)
+            self._purge_thread.start()
+
+    # ...............................................
+    def _purge_disk(self):
+        now = time.time()
+        for dirpath, _, fnames in os.walk(self.disk_path):
+            for fname in fnames:
+                fullname = os.path.join(dirpath, fname)
+                try:
+                    if os.stat(fullname).st_mtime <= now:
+                        os.remove(fullname)
+                except OSError:
+                    pass
+
+    # ...............................................
+    def get(self, key, default=None):
+        """Return a copy of the value for key, or default if it is missing or expired."""
+        data = self._memory.get(key)
+        if data is not None:
+            with self._lock:
+                self.hits += 1
+            return pickle.loads(data)
+        if self.disk_path is not None:
+            found = self._read_disk(key)
+            if found is not None:
+                remaining, data = found
+                self._memory.set(key, data, ttl=remaining)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return pickle.loads(data)
+        with self._lock:
+            self.misses += 1
+        return default
+
+    # ...............................................
+    def set(self, key, value, ttl=None):
+        """Save a value for key, valid for ttl seconds (default self.ttl)."""
+        if ttl is None:
+            ttl = self.ttl
+        data = pickle.dumps(value)
+        self._memory.set(key, data, ttl=ttl)
+        if self.disk_path is not None:
+            self._write_disk(key, data, ttl)
+            with self._lock:
+                self._writes += 1
+                purge = (self._writes % self.PURGE_INTERVAL == 0)
+            if purge:
+                self._start_purge()
+
+    # ...............................................
+    def stats(self):
+        """Return a dictionary of hit and miss counts for this process."""
+        with self._lock:
+            return {
+                'hits': self.hits, 'disk_hits': self.disk_hits, 
+                'misses': self.misses, 'size': len(self._memory),
+                'disk_path': self.disk_path}
+
+    # ...............................................
+    def clear(self):
+        """Remove all values from memory and disk, and reset counts."""
+        self._memory.clear()
+        if self.disk_path is not None:
+            for dirpath, _, fnames in os.walk(self.disk_path):
+                for fname in fnames:
+                    try:
+                        os.remove(os.path.join(dirpath, fname))
+                    except OSError:
+                        pass
+        with self._lock:
+            self.hits = self.disk_hits = self.misses = self._writes = 0
+
+# .............................................................................
+class SingleFlight:
+    """Share one call among concurrent callers with the same key.
+    
+    Note:
+        The first caller for a key runs the function; callers arriving before it 
+        finishes wait for it, and receive a copy of its result or its exception. 
+        Threads, and coroutines on each event loop, are coalesced separately.
+    """
+    # ...............................................
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key: (threading.Event, [result, exception])
+        self._calls = {}
+        # event loop: {key: asyncio.Future}
+        self._async_calls = weakref.WeakKeyDictionary()
+        self.coalesced = 0
+
+    # ...............................................
+    def do(self, key, func):
+        """Return func(), or a copy of the result of a call in progress for key."""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = (threading.Event(), [None, None])
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+        done, outcome = call
+        if not is_leader:
+            done.wait()
+            result, err = outcome
+            if err is not None:
+                raise err
+            return copy.deepcopy(result)
+
+        try:
+            outcome[0] = func()
+        except Exception as e:
+            outcome[1] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            done.set()
+        return outcome[0]
+
+    # ...............................................
+    async def do_async(self, key, coro_func):
+        """Return await coro_func(), or a copy of the result of a call in progress 
+        for key on this event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._async_calls.setdefault(loop, {})
+            fut = calls.get(key)
+            is_leader = fut is None
+            if is_leader:
+                fut = loop.create_future()
+                calls[key] = fut
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            # shield so a cancelled follower does not cancel the shared call
+            return copy.deepcopy(await asyncio.shield(fut))
+
+        try:
+            result = await coro_func()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # Retrieve the exception so it is not reported if no followers wait
+            fut.exception()
+            raise
+        else:
+            fut.set_result(result)
+        finally:
+            with self._lock:
+                del calls[key]
+        return result
+
+    # ...............................................
+    def stats(self):
+        """Return a dictionary with the number of coalesced and in-flight calls."""
+        with self._lock:
+            in_flight = len(self._calls) + sum(
+                len(calls) for calls in self._async_calls.values())
+            return {'coalesced': self.coalesced, 'in_flight': in_flight}
@@ -0,0 +1,322 @@
+"""Module containing a compact filter of the GUIDs in the Specify resolver index"""
+import fcntl
+import hashlib
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from lmtrex.common.lmconstants import GUID_FILTER, SOLR_EXPORT, SPECIFY
+import lmtrex.tools.misc.solr as SpSolr
+
+# Filter loaded by this process, and when its file was last checked
+_FILTER = None
+_FILTER_MTIME = None
+_FILTER_CHECKED = None
+# When the Solr index last changed, checked with the filter file
+_INDEX_MODIFIED = None
+_FILTER_LOCK = threading.Lock()
+
+# .............................................................................
+class GuidFilter:
+    """Bloom filter of GUIDs.
+
+    Note:
+        A GUID that was never added is reported as possibly present with
+        probability about error_rate; a GUID that was added is always reported.
+        GUIDs cannot be removed, so records deleted from the index remain in the
+        filter until it is rebuilt.  The build time is kept with the filter, so 
+        that a filter not rebuilt recently is not trusted, and the time it last 
+        matched the index, so that a filter older than the last change to the 
+        index is not trusted.
+    """
+    MAGIC = b'S2NGUIDF'
+    VERSION = 3
+    # magic, version, build time, update time, number of bits, number of hashes, 
+    # capacity, GUIDs added
+    HEADER = struct.Struct('<8sHddQHQQ')
+
+    # ...............................................
+    def __init__(self, capacity, error_rate=GUID_FILTER.ERROR_RATE):
+        """Constructor
+
+        Args:
+            capacity: number of GUIDs the filter holds with error_rate
+            error_rate: probability that a GUID not added is reported as present
+        """
+        capacity = max(1, int(capacity))
+        nbits = math.ceil(-capacity * math.log(error_rate) / math.log(2)**2)
+        self.nbits = max(8, (nbits + 7) // 8 * 8)
+        self.nhashes = max(1, round(self.nbits / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self.built = time.time()
+        # Time the filter last held every GUID in the index
+        self.updated = self.built
+        self._bits = bytearray(self.nbits // 8)
+
+    # ...............................................
+    def __len__(self):
+        return self.count
+
+    # ...............................................
+    def _get_positions(self, guid):
+        digest = hashlib.blake2b(guid.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        # Odd step, so positions differ for every hash
+        h2 |= 1
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+    # ...............................................
+    def add(self, guid):
+        """Add a GUID to the filter."""
+        for pos in self._get_positions(guid):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    # ...............................................
+    def __contains__(self, guid):
+        bits = self._bits
+        for pos in self._get_positions(guid):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    # ...............................................
+    def is_stale(self, max_age=None, index_modified=None):
+        """Return True if the filter was built more than max_age seconds ago 
+        (default GUID_FILTER.MAX_AGE), or last updated before index_modified, 
+        the time in seconds since the epoch that the index last changed."""
+        if max_age is None:
+            max_age = GUID_FILTER.MAX_AGE
+        if index_modified is not None and index_modified > self.updated:
+            return True
+        return time.time() - self.built > max_age
+
+    # ...............................................
+    def is_full(self):
+        """Return True if more GUIDs were added than the filter was sized for."""
+        return self.count > self.capacity
+
+    # ...............................................
+    def write(self, fname):
+        """Write the filter to a file, replacing any existing file at once."""
+        dirname = os.path.dirname(fname) or '.'
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as out_file:
+                out_file.write(self.HEADER.pack(
+                    self.MAGIC, self.VERSION, self.built, self.updated, 
+                    self.nbits, self.nhashes, self.capacity, self.count))
+                out_file.write(self._bits)
+            os.replace(tmpname, fname)
+        except Exception:
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+            raise
+
+    # ...............................................
+    @classmethod
+    def read(cls, fname):
+        """Read a filter from a file written by GuidFilter.write."""
+        with open(fname, 'rb') as in_file:
+            header = in_file.read(cls.HEADER.size)
+            bits = in_file.read()
+        try:
+            (magic, version, built, updated, nbits, nhashes, capacity, 
+             count) = cls.HEADER.unpack(header)
+        except struct.error:
+            raise Exception('{} is not a GUID filter'.format(fname))
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise Exception('{} is not a version {} GUID filter'.format(
+                fname, cls.VERSION))
+        if len(bits) != nbits // 8:
+            raise Exception('GUID filter {} is truncated'.format(fname))
+        gfilter = cls.__new__(cls)
+        gfilter.built = built
+        gfilter.updated = updated
+        gfilter.nbits = nbits
+        gfilter.nhashes = nhashes
+        gfilter.capacity = capacity
+        gfilter.count = count
+        gfilter._bits = bytearray(bits)
+        return gfilter
+
+# .............................................................................
+class _FilterLock:
+    """Exclusive lock on a filter file, held while it is read and replaced.
+
+    Note:
+        The filter file itself is replaced on write, so the lock is taken on a
+        separate file next to it.
+    """
+    # ...............................................
+    def __init__(self, fname):
+        self.lock_fname = fname + '.lock'
+        self._lock_file = None
+
+    # ...............................................
+    def __enter__(self):
+        dirname = os.path.dirname(self.lock_fname) or '.'
+        os.makedirs(dirname, exist_ok=True)
+        self._lock_file = open(self.lock_fname, 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        return self
+
+    # ...............................................
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+        return False
+
+# .............................................................................
+def build_guid_filter(
+        fname=GUID_FILTER.FILENAME, collection=SPECIFY.RESOLVER_COLLECTION,
+        solr_location=SPECIFY.RESOLVER_SOLR_LOCATION,
+        error_rate=GUID_FILTER.ERROR_RATE, page_size=SOLR_EXPORT.PAGE_SIZE):
+    """Build a filter of every GUID in a Solr collection and write it to a file.
+
+    Args:
+        fname: output filename
+        collection: name of the Solr resolver index
+        solr_location: IP or FQDN for the Solr resolver index
+        error_rate: probability that a GUID not in the index is reported as present
+        page_size: number of GUIDs read from Solr at once
+
+    Return:
+        the new GuidFilter
+
+    Note:
+        The file is locked while the index is read, so index runs posting 
+        records meanwhile add their GUIDs to the new filter once it is written.
+    """
+    with _FilterLock(fname):
+        count = SpSolr.count_docs(collection, solr_location)
+        capacity = max(
+            GUID_FILTER.MIN_CAPACITY, count * GUID_FILTER.CAPACITY_FACTOR)
+        gfilter = GuidFilter(capacity, error_rate=error_rate)
+        for doc in SpSolr.export_docs(
+                collection, solr_location, fields=[SOLR_EXPORT.UNIQUE_KEY],
+                page_size=page_size):
+            gfilter.add(doc[SOLR_EXPORT.UNIQUE_KEY])
+        gfilter.write(fname)
+    return gfilter
+
+# .............................................................................
+def add_guids_to_filter(guids, fname=GUID_FILTER.FILENAME):
+    """Add newly indexed GUIDs to an existing filter file.
+
+    Args:
+        guids: iterable of GUIDs
+        fname: filter filename
+
+    Return:
+        the updated GuidFilter, or None if there is no filter file to update
+
+    Note:
+        Broker processes read the updated file within GUID_FILTER.RELOAD_INTERVAL
+        seconds.  If the filter holds more GUIDs than its capacity, its error rate
+        grows, and it should be rebuilt with build_guid_filter.  Concurrent 
+        updates wait for each other, so no GUIDs are lost.  Call this once the 
+        GUIDs are committed to the index, as the filter is then marked as 
+        matching the index.
+    """
+    with _FilterLock(fname):
+        if not os.path.exists(fname):
+            return None
+        gfilter = GuidFilter.read(fname)
+        for guid in guids:
+            gfilter.add(guid)
+        gfilter.updated = time.time()
+        gfilter.write(fname)
+    return gfilter
+
+# .............................................................................
+def get_guid_filter():
+    """Return the process-wide GUID filter, or None if it is disabled, missing or 
+    stale.
+
+    Note:
+        The filter file is checked for changes at most every
+        GUID_FILTER.RELOAD_INTERVAL seconds, and read again when it is replaced.
+        If GUID_FILTER.CHECK_INDEX is True, the time the Solr index last changed 
+        is checked then too, and a filter not updated since is not used.
+    """
+    global _FILTER, _FILTER_MTIME, _FILTER_CHECKED, _INDEX_MODIFIED
+    if not GUID_FILTER.ENABLED:
+        return None
+    now = time.monotonic()
+    with _FILTER_LOCK:
+        if (_FILTER_CHECKED is None or
+                now - _FILTER_CHECKED >= GUID_FILTER.RELOAD_INTERVAL):
+            _FILTER_CHECKED = now
+            try:
+                mtime = os.path.getmtime(GUID_FILTER.FILENAME)
+            except OSError:
+                _FILTER = _FILTER_MTIME = None
+            else:
+                if mtime != _FILTER_MTIME:
+                    try:
+                        _FILTER = GuidFilter.read(GUID_FILTER.FILENAME)
+                    except Exception as e:
+                        print('Failed to read GUID filter {} ({}), querying every GUID'.format(
+                            GUID_FILTER.FILENAME, e))
+                        _FILTER = None
+                    _FILTER_MTIME = mtime
+            if _FILTER is not None and GUID_FILTER.CHECK_INDEX:
+                _INDEX_MODIFIED = _get_index_modified()
+        gfilter = _FILTER
+        index_modified = _INDEX_MODIFIED
+    if gfilter is None or gfilter.is_stale(index_modified=index_modified):
+        return None
+    return gfilter
+
+# .............................................................................
+def _get_index_modified():
+    """Return when the Specify resolver index last changed, in seconds since the 
+    epoch, or infinity if that cannot be found, so that the filter is not used."""
+    try:
+        modified = SpSolr.get_index_modified(
+            SPECIFY.RESOLVER_COLLECTION, SPECIFY.RESOLVER_SOLR_LOCATION, 
+            timeout=GUID_FILTER.CHECK_TIMEOUT)
+    except Exception as e:
+        print('Failed to find when Solr index {} changed ({}), querying every GUID'.format(
+            SPECIFY.RESOLVER_COLLECTION, e))
+        return float('inf')
+    return modified
+
+# .............................................................................
+def may_be_indexed(guid):
+    """Return False only if a GUID is certainly not in the Specify resolver index."""
+    gfilter = get_guid_filter()
+    return gfilter is None or guid in gfilter
+
+
+# .............................................................................
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=('Build a filter of the GUIDs in the Specify resolver index.'))
+    parser.add_argument(
+        '--filename', type=str, default=GUID_FILTER.FILENAME,
+        help='Output filter file')
+    parser.add_argument(
+        '--collection', type=str, default=SPECIFY.RESOLVER_COLLECTION,
+        help='Solr resolver collection')
+    parser.add_argument(
+        '--solr_location', type=str, default=SPECIFY.RESOLVER_SOLR_LOCATION,
+        help='IP or FQDN for the Solr resolver index')
+    args = parser.parse_args()
+
+    gfilter = build_guid_filter(
+        args.filename, collection=args.collection,
+        solr_location=args.solr_location)
+    print('Wrote {} GUIDs to {}, {} bytes'.format(
+        len(gfilter), args.filename, gfilter.nbits // 8))
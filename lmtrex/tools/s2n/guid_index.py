@@ -0,0 +1,257 @@
+"""Module containing a memory-mapped index of Specify resolver GUIDs to record URLs"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from uuid import UUID
+
+from lmtrex.common.lmconstants import GUID_INDEX, SOLR_EXPORT, SPECIFY
+import lmtrex.tools.misc.solr as SpSolr
+
+# Index mapped by this process, and when its file was last checked
+_INDEX = None
+_INDEX_MTIME = None
+_INDEX_CHECKED = None
+_INDEX_LOCK = threading.Lock()
+
+# .............................................................................
+def _get_key(guid):
+    """Return the 16 bytes of a canonical UUID string, or None for other GUIDs."""
+    try:
+        uuid_obj = UUID(guid)
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if str(uuid_obj) != guid:
+        return None
+    return uuid_obj.bytes
+
+# .............................................................................
+class GuidIndex:
+    """Read-only index of UUIDs to record URLs, in a memory-mapped file.
+
+    Note:
+        The file holds a header, entries sorted by UUID bytes, a heap of URL
+        suffixes, and a JSON list of [dataset_guid, URL prefix] pairs.  Each entry
+        is the UUID, the number of its dataset, and the offset and length of its
+        URL suffix in the heap.  Most URLs end with their own GUID, so store no
+        suffix.  Processes mapping the same file share its memory.
+    """
+    MAGIC = b'S2NGUIDX'
+    VERSION = 1
+    # magic, version, build time, number of entries, heap offset, datasets offset
+    HEADER = struct.Struct('<8sHdQQQ')
+    # UUID bytes, dataset number, suffix offset, suffix length
+    ENTRY = struct.Struct('<16sIQI')
+    # Suffix length of URLs that end with the GUID
+    GUID_SUFFIX = 0xFFFFFFFF
+
+    # ...............................................
+    def __init__(self, fname):
+        """Constructor
+
+        Args:
+            fname: index file written by build_guid_index
+        """
+        self.fname = fname
+        with open(fname, 'rb') as in_file:
+            self._mm = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self.built, self.count, self._heap_start,
+             datasets_start) = self.HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            raise Exception('{} is not a GUID index'.format(fname))
+        if magic != self.MAGIC or version != self.VERSION:
+            raise Exception('{} is not a version {} GUID index'.format(
+                fname, self.VERSION))
+        self._datasets = json.loads(self._mm[datasets_start:].decode('utf-8'))
+
+    # ...............................................
+    def __len__(self):
+        return self.count
+
+    # ...............................................
+    def is_stale(self, max_age=None):
+        """Return True if the index was built more than max_age seconds ago 
+        (default GUID_INDEX.MAX_AGE)."""
+        if max_age is None:
+            max_age = GUID_INDEX.MAX_AGE
+        return time.time() - self.built > max_age
+
+    # ...............................................
+    def _find(self, key):
+        """Return the entry for UUID bytes, or None."""
+        mm = self._mm
+        size = self.ENTRY.size
+        start = self.HEADER.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = start + mid * size
+            mid_key = mm[offset:offset + 16]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return self.ENTRY.unpack_from(mm, offset)
+        return None
+
+    # ...............................................
+    def lookup(self, guid):
+        """Return (dataset_guid, url) for a GUID, or None if it is not indexed."""
+        key = _get_key(guid)
+        if key is None:
+            return None
+        entry = self._find(key)
+        if entry is None:
+            return None
+        _, ds_num, suffix_offset, suffix_len = entry
+        dataset_guid, prefix = self._datasets[ds_num]
+        if suffix_len == self.GUID_SUFFIX:
+            suffix = guid
+        else:
+            start = self._heap_start + suffix_offset
+            suffix = self._mm[start:start + suffix_len].decode('utf-8')
+        return dataset_guid, prefix + suffix
+
+# .............................................................................
+def build_guid_index(
+        fname=GUID_INDEX.FILENAME, collection=SPECIFY.RESOLVER_COLLECTION,
+        solr_location=SPECIFY.RESOLVER_SOLR_LOCATION,
+        page_size=SOLR_EXPORT.PAGE_SIZE):
+    """Build an index of every UUID in a Solr collection to its record URL.
+
+    Args:
+        fname: output filename
+        collection: name of the Solr resolver index
+        solr_location: IP or FQDN for the Solr resolver index
+        page_size: number of records read from Solr at once
+
+    Return:
+        number of GUIDs in the index
+
+    Note:
+        Records whose id is not a canonical UUID, or without a URL, are left out,
+        and are resolved in Solr.  Entries are sorted in memory, about 80 bytes
+        per record.
+    """
+    built = time.time()
+    entries = []
+    heap = bytearray()
+    # (dataset_guid, URL prefix): dataset number
+    datasets = {}
+    for doc in SpSolr.export_docs(
+            collection, solr_location, page_size=page_size,
+            fields=[SOLR_EXPORT.UNIQUE_KEY, 'dataset_guid', 'url']):
+        guid = doc[SOLR_EXPORT.UNIQUE_KEY]
+        url = doc.get('url')
+        key = _get_key(guid)
+        if key is None or not url:
+            continue
+        if url.endswith(guid):
+            prefix = url[:len(url) - len(guid)]
+            suffix_offset, suffix_len = 0, GuidIndex.GUID_SUFFIX
+        else:
+            prefix, sep, suffix = url.rpartition('/')
+            prefix += sep
+            suffix = suffix.encode('utf-8')
+            suffix_offset, suffix_len = len(heap), len(suffix)
+            heap.extend(suffix)
+        ds_num = datasets.setdefault((doc.get('dataset_guid'), prefix), len(datasets))
+        entries.append(GuidIndex.ENTRY.pack(key, ds_num, suffix_offset, suffix_len))
+    entries.sort()
+
+    heap_start = GuidIndex.HEADER.size + len(entries) * GuidIndex.ENTRY.size
+    datasets_start = heap_start + len(heap)
+    dirname = os.path.dirname(fname) or '.'
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as out_file:
+            out_file.write(GuidIndex.HEADER.pack(
+                GuidIndex.MAGIC, GuidIndex.VERSION, built, len(entries),
+                heap_start, datasets_start))
+            for entry in entries:
+                out_file.write(entry)
+            out_file.write(heap)
+            out_file.write(json.dumps(
+                [list(ds_prefix) for ds_prefix in datasets]).encode('utf-8'))
+        os.replace(tmpname, fname)
+    except Exception:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+        raise
+    return len(entries)
+
+# .............................................................................
+def get_guid_index():
+    """Return the process-wide GUID index, or None if it is disabled, missing or
+    stale.
+
+    Note:
+        The index file is checked for changes at most every
+        GUID_INDEX.RELOAD_INTERVAL seconds, and mapped again when it is replaced.
+    """
+    global _INDEX, _INDEX_MTIME, _INDEX_CHECKED
+    if not GUID_INDEX.ENABLED:
+        return None
+    now = time.monotonic()
+    with _INDEX_LOCK:
+        if (_INDEX_CHECKED is None or
+                now - _INDEX_CHECKED >= GUID_INDEX.RELOAD_INTERVAL):
+            _INDEX_CHECKED = now
+            try:
+                mtime = os.path.getmtime(GUID_INDEX.FILENAME)
+            except OSError:
+                _INDEX = _INDEX_MTIME = None
+            else:
+                if mtime != _INDEX_MTIME:
+                    try:
+                        _INDEX = GuidIndex(GUID_INDEX.FILENAME)
+                    except Exception as e:
+                        print('Failed to read GUID index {} ({}), resolving in Solr'.format(
+                            GUID_INDEX.FILENAME, e))
+                        _INDEX = None
+                    _INDEX_MTIME = mtime
+        gindex = _INDEX
+    if gindex is None or gindex.is_stale():
+        return None
+    return gindex
+
+# .............................................................................
+def lookup_guid(guid):
+    """Return (dataset_guid, url) for a GUID from the GUID index, or None if it is
+    not there, or there is no current index."""
+    gindex = get_guid_index()
+    if gindex is None:
+        return None
+    return gindex.lookup(guid)
+
+
+# .............................................................................
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=('Build an index of Specify resolver GUIDs to record URLs.'))
+    parser.add_argument(
+        '--filename', type=str, default=GUID_INDEX.FILENAME,
+        help='Output index file')
+    parser.add_argument(
+        '--collection', type=str, default=SPECIFY.RESOLVER_COLLECTION,
+        help='Solr resolver collection')
+    parser.add_argument(
+        '--solr_location', type=str, default=SPECIFY.RESOLVER_SOLR_LOCATION,
+        help='IP or FQDN for the Solr resolver index')
+    args = parser.parse_args()
+
+    count = build_guid_index(
+        args.filename, collection=args.collection,
+        solr_location=args.solr_location)
+    print('Wrote {} GUIDs to {}, {} bytes'.format(
+        count, args.filename, os.path.getsize(args.filename)))
@@ -1,10 +1,20 @@
+from collections import deque
+import concurrent.futures
+import contextvars
 import sys
+import threading
+import time
 import traceback
 from uuid import UUID
 
 from lmtrex.common.lmconstants import ICON_API, ServiceProvider
 from lmtrex.common.s2n_type import S2nEndpoint
 
+# Thread pools shared by all requests in this process, keyed by name
+_EXECUTORS = {}
+_EXECUTOR_LOCK = threading.Lock()
+# time.monotonic() by which the running provider call must finish, if it has a deadline
+_DEADLINE = contextvars.ContextVar('s2n_deadline', default=None)
 
 # ......................................................
 def is_valid_uuid(uuid_to_test, version=4):
@@ -94,7 +104,162 @@ def add_errinfo(errinfo, key, val):
         except:
             errinfo[key] = [val]
     return errinfo
-    
+
+# ...............................................
+def get_executor(name, max_workers):
+    """Return a process-wide thread pool with this name, creating it on first use.
+
+    Args:
+        name: name of the pool, also used as prefix for its thread names
+        max_workers: maximum number of threads in a newly created pool
+    """
+    with _EXECUTOR_LOCK:
+        try:
+            executor = _EXECUTORS[name]
+        except KeyError:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=name)
+            _EXECUTORS[name] = executor
+    return executor
+
+# ...............................................
+def get_time_remaining():
+    """Return seconds left before the deadline of the running call, or None.
+
+    Note:
+        Calls run by run_with_deadlines with an executor, or by run_with_deadline, 
+        have a deadline; other code does not.
+    """
+    deadline = _DEADLINE.get()
+    if deadline is None:
+        return None
+    return max(0, deadline - time.monotonic())
+
+# ...............................................
+def _call_with_deadline(func, args, deadline):
+    """Call func with the deadline returned by get_time_remaining while it runs."""
+    token = _DEADLINE.set(deadline)
+    try:
+        return func(*args)
+    finally:
+        _DEADLINE.reset(token)
+
+# ...............................................
+def run_with_deadlines(calls, timeouts, executor=None):
+    """Run functions concurrently, waiting for each no longer than its own timeout.
+
+    Args:
+        calls: ordered list of (function, args) tuples
+        timeouts: list of seconds to wait for each call, measured from submission.
+            None waits indefinitely.
+        executor: concurrent.futures.Executor for the calls.  If None, calls are
+            run one after another in this thread, without deadlines.
+
+    Return:
+        list of (result, exception) tuples in the same order as calls.  Exception is
+            None on success, concurrent.futures.TimeoutError if the call missed its
+            deadline, or the exception raised by the call.
+
+    Note:
+        Calls that miss their deadline are not interrupted, they finish in the
+        background and their results are discarded.  Each call can read its 
+        deadline with get_time_remaining to limit its own network waits.
+    """
+    results = []
+    if executor is None:
+        for func, args in calls:
+            try:
+                results.append((func(*args), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    start = time.monotonic()
+    futures = []
+    for (func, args), timeout in zip(calls, timeouts):
+        deadline = None if timeout is None else start + timeout
+        futures.append(executor.submit(_call_with_deadline, func, args, deadline))
+    for fut, timeout in zip(futures, timeouts):
+        remaining = None
+        if timeout is not None:
+            remaining = max(0, start + timeout - time.monotonic())
+        try:
+            results.append((fut.result(timeout=remaining), None))
+        except concurrent.futures.TimeoutError as e:
+            fut.cancel()
+            results.append((None, e))
+        except Exception as e:
+            results.append((None, e))
+    return results
+
+# ...............................................
+def run_with_deadline(func, args, timeout, name=None):
+    """Run one function in its own thread, waiting no longer than timeout.
+
+    Args:
+        func: function to call
+        args: sequence of arguments for func
+        timeout: seconds to wait for the call, None waits indefinitely
+        name: optional name of the thread
+
+    Return:
+        (result, exception) tuple, like an element of the list returned by 
+            run_with_deadlines
+
+    Note:
+        The call is not interrupted if it misses its deadline; it finishes in a 
+        daemon thread and its result is discarded.  The call can read its deadline 
+        with get_time_remaining.
+    """
+    outcome = []
+    deadline = None if timeout is None else time.monotonic() + timeout
+    def _call():
+        try:
+            outcome.append((_call_with_deadline(func, args, deadline), None))
+        except Exception as e:
+            outcome.append((None, e))
+    thread = threading.Thread(target=_call, name=name, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if not outcome:
+        return None, concurrent.futures.TimeoutError()
+    return outcome[0]
+
+# ...............................................
+def run_bounded(calls, executor, max_in_flight):
+    """Run functions concurrently, with no more than max_in_flight submitted at once.
+
+    Args:
+        calls: iterable of (function, args) tuples
+        executor: concurrent.futures.Executor for the calls
+        max_in_flight: maximum number of calls submitted and not yet yielded
+
+    Yields:
+        (result, exception) tuples in the same order as calls.  Exception is None on 
+            success, or the exception raised by the call.
+
+    Note:
+        If the generator is closed early, calls not yet started are cancelled.
+    """
+    pending = deque()
+    try:
+        for func, args in calls:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= max_in_flight:
+                yield _get_outcome(pending.popleft())
+        while pending:
+            yield _get_outcome(pending.popleft())
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+# ...............................................
+def _get_outcome(future):
+    try:
+        return future.result(), None
+    except Exception as e:
+        return None, e
+
 
 if __name__ == '__main__':
     import doctest
@@ -0,0 +1,152 @@
+import json
+import threading
+
+import pytest
+
+from lmtrex.common.lmconstants import CONCURRENCY
+from lmtrex.common.s2n_type import S2nOutput
+from lmtrex.flask_app.broker.name import NameSvc
+from lmtrex.flask_app.broker.occ import OccurrenceSvc
+from lmtrex.flask_app.broker.routes import app
+from lmtrex.tools.provider.gbif import GbifAPI
+from lmtrex.tools.provider.idigbio import IdigbioAPI
+from lmtrex.tools.provider.specify_resolver import SpecifyResolverAPI
+
+NAMES = ['Notropis atherinoides', 'Acer Linnaeus, 1753', 'Notropis atherinoides']
+CANONICAL_NAMES = {NAMES[0]: 'Notropis atherinoides', NAMES[1]: 'Acer'}
+OCCIDS = [
+    '2facc7a2-dd88-44af-b95a-733cc27527d4', '84fe1494-c378-4657-be15-8c812b228bf4',
+    '04c05e26-4876-4114-9e1d-984f78e89c15']
+
+# ...............................................
+@pytest.fixture
+def client(monkeypatch):
+    """Flask test client whose services answer without querying providers."""
+    def get_name_records(
+            namestr, req_providers, is_accepted, gbif_count, kingdom, timeouts=None):
+        return S2nOutput(1, 'name', records=[{'name': namestr}])
+
+    def get_occ_records(
+            occid, req_providers, count_only, gbif_dataset_key=None, guid_urls=None):
+        return S2nOutput(1, 'occ', records=[{'occid': occid}])
+
+    def parse_names(names):
+        return {name: CANONICAL_NAMES[name] for name in names}
+
+    monkeypatch.setattr(NameSvc, '_get_records', get_name_records)
+    monkeypatch.setattr(NameSvc, '_parse_names_with_gbif', parse_names)
+    monkeypatch.setattr(OccurrenceSvc, '_get_records', get_occ_records)
+    return app.test_client()
+
+# ...............................................
+def _read_ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+# ............................
+def test_occ_batch(client, monkeypatch):
+    monkeypatch.setattr(
+        SpecifyResolverAPI, 'resolve_guids_to_urls',
+        classmethod(lambda cls, guids: {guid: None for guid in guids}))
+    response = client.post(
+        '/api/v1/occ/batch',
+        json={'occids': OCCIDS, 'provider': 'specify', 'format': 'json'})
+    assert(response.status_code == 200)
+    assert(response.mimetype == 'application/json')
+    outputs = json.loads(response.get_data(as_text=True))
+    assert([out['records'][0]['occid'] for out in outputs] == OCCIDS)
+    assert(all('warning' not in out['errors'] for out in outputs))
+
+# ............................
+def test_occ_batch_resolver_failure(client, monkeypatch):
+    def fail(cls, guids):
+        raise Exception('Solr is down')
+    monkeypatch.setattr(SpecifyResolverAPI, 'resolve_guids_to_urls', classmethod(fail))
+    response = client.post(
+        '/api/v1/occ/batch', json={'occids': OCCIDS, 'provider': 'specify'})
+    assert(response.status_code == 200)
+    outputs = _read_ndjson(response)
+    assert(len(outputs) == len(OCCIDS))
+    # Each response reports that GUIDs were resolved separately
+    for out in outputs:
+        assert(any('Solr is down' in msg for msg in out['errors']['warning']))
+
+# ............................
+def test_bad_batch(client):
+    for body in (
+            {'occids': '2facc7a2-dd88-44af-b95a-733cc27527d4'}, {'occids': []}, 
+            {'occids': [1, 2]}, {'occids': OCCIDS, 'format': 'xml'},
+            {'occids': OCCIDS * CONCURRENCY.BATCH_MAX_SIZE}):
+        response = client.post('/api/v1/occ/batch', json=body)
+        assert(response.status_code == 400)
+    response = client.post('/api/v1/occ/batch', data='not json')
+    assert(response.status_code == 400)
+
+# ............................
+def test_name_batch(client):
+    response = client.post(
+        '/api/v1/name/batch', json={'names': NAMES, 'provider': 'gbif,itis'})
+    assert(response.status_code == 200)
+    assert(response.mimetype == 'application/x-ndjson')
+    outputs = _read_ndjson(response)
+    # One response per name, in order, queried with the canonical name
+    assert([out['records'][0]['name'] for out in outputs] ==
+           ['Notropis atherinoides', 'Acer', 'Notropis atherinoides'])
+
+# ............................
+def test_name_batch_gbif_parse(client):
+    # JSON null parses names, like a missing value
+    response = client.post(
+        '/api/v1/name/batch', json={'names': NAMES, 'gbif_parse': None})
+    assert(response.status_code == 200)
+    assert(_read_ndjson(response)[1]['records'][0]['name'] == 'Acer')
+
+    response = client.post(
+        '/api/v1/name/batch', json={'names': NAMES, 'gbif_parse': False})
+    assert(response.status_code == 200)
+    assert(_read_ndjson(response)[1]['records'][0]['name'] == NAMES[1])
+
+    response = client.post(
+        '/api/v1/name/batch', json={'names': NAMES, 'gbif_parse': 'maybe'})
+    assert(response.status_code == 400)
+    assert('gbif_parse' in response.get_data(as_text=True))
+    assert('Traceback' not in response.get_data(as_text=True))
+
+# ............................
+def test_bad_name_batch(client):
+    for body in (
+            {'names': 'Acer'}, {'names': []}, {'names': [1, 2]},
+            {'names': ['Acer'], 'format': 'xml'},
+            {'names': ['Acer'] * (CONCURRENCY.BATCH_MAX_SIZE + 1)}):
+        response = client.post('/api/v1/name/batch', json=body)
+        assert(response.status_code == 400)
+
+# ............................
+def test_resolve_batch(client, monkeypatch):
+    urls = {
+        OCCIDS[0]: 'https://notyeti.example.org/specimens/{}'.format(OCCIDS[0]),
+        OCCIDS[1]: None, OCCIDS[2]: 'ark:/99999/{}'.format(OCCIDS[2])}
+    monkeypatch.setattr(
+        SpecifyResolverAPI, 'resolve_guids_to_urls',
+        classmethod(lambda cls, guids, collection=None, solr_location=None:
+                    {guid: urls[guid] for guid in guids}))
+    response = client.post('/api/v1/resolve/batch', json={'occids': OCCIDS})
+    assert(response.status_code == 200)
+    # URLs without direct record access are null
+    assert(response.get_json() == {OCCIDS[0]: urls[OCCIDS[0]], OCCIDS[1]: None, OCCIDS[2]: None})
+
+# ............................
+def test_batch_provider_pool():
+    def get_thread_name():
+        return threading.current_thread().name
+
+    def query(item):
+        queries = [
+            (GbifAPI, get_thread_name, ()), (IdigbioAPI, get_thread_name, ())]
+        return OccurrenceSvc._query_providers(queries)
+
+    # Batch items query providers in their own pool, interactive requests in the 
+    # shared one
+    for thread_names in OccurrenceSvc._query_batch(query, OCCIDS, '{}'):
+        assert(all(name.startswith('s2n_batch_provider') for name in thread_names))
+    thread_names = query(OCCIDS[0])
+    assert(all(name.startswith('s2n_provider') for name in thread_names))
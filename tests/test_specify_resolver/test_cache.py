@@ -0,0 +1,281 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import time
+
+import pytest
+
+from lmtrex.common.lmconstants import RESPONSE_CACHE, ServiceProvider
+from lmtrex.common.s2n_type import S2nKey
+from lmtrex.tools.provider import api as provider_api
+from lmtrex.tools.provider.api import APIQuery
+from lmtrex.tools.s2n import cache
+from lmtrex.tools.s2n.cache import ResponseCache, SingleFlight, TTLCache
+
+RECORDS = b'{"count": 1, "results": [{"key": 1}]}'
+
+# ...............................................
+class _Clock:
+    """Replace the time module of lmtrex.tools.s2n.cache with a clock set by tests."""
+    def __init__(self):
+        self.now = time.time()
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+# ...............................................
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+# ...............................................
+def _list_files(path):
+    return [fname for _, _, fnames in os.walk(path) for fname in fnames]
+
+# ............................
+def test_ttl_expiry(clock):
+    tcache = TTLCache(10)
+    tcache.set('a', 1)
+    tcache.set('b', 2, ttl=100)
+    clock.now += 9
+    assert(tcache.get('a') == 1)
+    clock.now += 1
+    assert(tcache.get('a') is None)
+    assert(tcache.get('b') == 2)
+    # Expired values are removed when read
+    assert(len(tcache) == 1)
+
+# ............................
+def test_lru_eviction(clock):
+    tcache = TTLCache(10, maxsize=3)
+    for key in ('a', 'b', 'c'):
+        tcache.set(key, key)
+    # Reading a makes b the least recently used
+    assert(tcache.get('a') == 'a')
+    tcache.set('d', 'd')
+    assert(len(tcache) == 3)
+    assert(tcache.get('b') is None)
+    assert([tcache.get(key) for key in ('a', 'c', 'd')] == ['a', 'c', 'd'])
+
+# ............................
+def test_shared_disk_cache(tmp_path, clock):
+    path = str(tmp_path)
+    # Caches of two processes sharing a directory
+    cache1 = ResponseCache(10, disk_path=path)
+    cache2 = ResponseCache(10, disk_path=path)
+    value = {'records': [{'key': 1}]}
+    cache1.set('q', value)
+    cache1.set('short', value, ttl=2)
+    assert(cache2.get('q') == value)
+    assert(cache2.stats()['disk_hits'] == 1)
+    # Each get returns a copy
+    cache2.get('q')['records'].append({'key': 2})
+    assert(cache2.get('q') == value)
+    assert(cache2.stats()['disk_hits'] == 1)
+
+    clock.now += 5
+    assert(ResponseCache(10, disk_path=path).get('short') is None)
+    assert(cache2.get('q') == value)
+    clock.now += 5
+    assert(cache2.get('q') is None)
+    assert(cache2.stats()['misses'] == 1)
+
+# ............................
+def test_purge_disk_cache(tmp_path, clock, monkeypatch):
+    path = str(tmp_path)
+    rcache = ResponseCache(10, disk_path=path)
+    monkeypatch.setattr(rcache, 'PURGE_INTERVAL', 3)
+    rcache.set('old', 1, ttl=1)
+    rcache.set('new', 2)
+    assert(len(_list_files(path)) == 2)
+    clock.now += 5
+    # The third write starts removing expired files in the background
+    rcache.set('newer', 3)
+    rcache._purge_thread.join()
+    assert(len(_list_files(path)) == 2)
+    assert(ResponseCache(10, disk_path=path).get('new') == 2)
+    assert(ResponseCache(10, disk_path=path).get('old') is None)
+
+# ...............................................
+class _ProviderHandler(BaseHTTPRequestHandler):
+    """Answer /found with records, /empty with no records, and /bad with an error."""
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.path.startswith('/bad'):
+            status, body = 400, b'Bad request'
+        elif self.path.startswith('/empty'):
+            status, body = 200, b'{}'
+        else:
+            status, body = 200, RECORDS
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# ...............................................
+class _GbifQuery(APIQuery):
+    PROVIDER = ServiceProvider.GBIF
+
+# ...............................................
+class _RecordingCache(ResponseCache):
+    """Memory cache that keeps the ttl of each value set."""
+    def __init__(self):
+        ResponseCache.__init__(self, RESPONSE_CACHE.DEFAULT_TTL)
+        self.ttls = {}
+
+    def set(self, key, value, ttl=None):
+        self.ttls[key[1]] = ttl
+        ResponseCache.set(self, key, value, ttl=ttl)
+
+# ...............................................
+@pytest.fixture
+def provider_server(monkeypatch):
+    monkeypatch.setattr(RESPONSE_CACHE, 'ENABLED', True)
+    monkeypatch.setattr(provider_api, '_RESPONSE_CACHE', _RecordingCache())
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ProviderHandler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+# ............................
+def test_provider_responses_cached(provider_server):
+    rcache = provider_api.get_response_cache()
+    for path in ('/found', '/empty'):
+        url = provider_server.url + path
+        for _ in range(2):
+            api = _GbifQuery(url)
+            api.query_by_get()
+            assert(api.error is None)
+        # The second query is answered from the cache
+        assert(provider_server.paths.count(path) == 1)
+    # Responses without records expire sooner
+    assert(rcache.ttls[provider_server.url + '/found'] ==
+           RESPONSE_CACHE.TTLS[ServiceProvider.GBIF[S2nKey.PARAM]])
+    assert(rcache.ttls[provider_server.url + '/empty'] == RESPONSE_CACHE.NEGATIVE_TTL)
+    assert(RESPONSE_CACHE.NEGATIVE_TTL < RESPONSE_CACHE.DEFAULT_TTL)
+
+# ............................
+def test_errors_not_cached(provider_server):
+    url = provider_server.url + '/bad'
+    for _ in range(2):
+        api = _GbifQuery(url)
+        api.query_by_get()
+        assert(api.error is not None)
+    assert(provider_server.paths.count('/bad') == 2)
+    assert(provider_api.get_response_cache().ttls == {})
+
+# ............................
+def test_other_queries_not_cached(provider_server):
+    # Solr and RSS feeds are queried with APIQuery, which has no provider
+    url = provider_server.url + '/found'
+    for _ in range(2):
+        api = APIQuery(url)
+        api.query_by_get()
+        assert(api.output['count'] == 1)
+    assert(provider_server.paths.count('/found') == 2)
+    assert(provider_api.get_response_cache().ttls == {})
+
+# ............................
+def test_single_flight():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def query():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'records': [{'key': 1}]}
+
+    results = []
+    def run():
+        results.append(flight.do('q', query))
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while flight.stats()['coalesced'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    # One upstream call, each caller gets its own copy
+    assert(len(calls) == 1)
+    assert(results == [{'records': [{'key': 1}]}] * 4)
+    assert(len(set(id(result) for result in results)) == 4)
+    assert(flight.stats() == {'coalesced': 3, 'in_flight': 0})
+
+# ............................
+def test_single_flight_error():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def query():
+        started.set()
+        release.wait(5)
+        raise ValueError('provider failed')
+
+    errors = []
+    def run():
+        try:
+            flight.do('q', query)
+        except ValueError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while flight.stats()['coalesced'] < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert(len(errors) == 3)
+    # The next call runs again
+    assert(flight.do('q', lambda: 1) == 1)
+
+# ............................
+def test_single_flight_async():
+    flight = SingleFlight()
+    calls = []
+
+    async def query():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {'records': [{'key': 1}]}
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError('provider failed')
+
+    async def run():
+        results = await asyncio.gather(*[flight.do_async('q', query) for _ in range(4)])
+        errors = await asyncio.gather(
+            *[flight.do_async('f', fail) for _ in range(3)], return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(run())
+    assert(len(calls) == 2)
+    assert(results == [{'records': [{'key': 1}]}] * 4)
+    assert(len(set(id(result) for result in results)) == 4)
+    assert(all(isinstance(err, ValueError) for err in errors))
+    assert(flight.stats() == {'coalesced': 5, 'in_flight': 0})
@@ -0,0 +1,122 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import os
+import threading
+import zipfile
+
+import pytest
+
+from lmtrex.tools.misc.dwca import (
+    assemble_download_filename, download_dwca_if_changed, DOWNLOAD_PART_EXT,
+    _read_download_meta, _write_download_meta, DOWNLOAD_META_EXT)
+
+# ...............................................
+def _make_zip(text):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zfile:
+        zfile.writestr('occurrence.csv', text)
+    return buf.getvalue()
+
+# ...............................................
+class _DwcaHandler(BaseHTTPRequestHandler):
+    """Serve one file with an ETag, answering conditional and range requests."""
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        data = server.data
+        start = 0
+        rng = self.headers.get('Range')
+        if rng and self.headers.get('If-Range') == server.etag:
+            start = int(rng[len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', 'bytes {}-{}/{}'.format(start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+# ...............................................
+@pytest.fixture
+def dwca_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _DwcaHandler)
+    server.data = _make_zip('id\n' * 5000)
+    server.etag = '"v1"'
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}/test_dwca.zip'.format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+# ............................
+def test_download_if_changed(tmp_path, dwca_server):
+    outpath = str(tmp_path)
+    fname, is_new = download_dwca_if_changed(dwca_server.url, outpath)
+    assert(is_new)
+    assert(fname == assemble_download_filename(dwca_server.url, outpath))
+    with open(fname, 'rb') as inf:
+        assert(inf.read() == dwca_server.data)
+    meta = _read_download_meta(fname + DOWNLOAD_META_EXT)
+    assert(meta['etag'] == dwca_server.etag)
+    assert(meta['size'] == len(dwca_server.data))
+
+    # Unchanged file is not downloaded again
+    fname, is_new = download_dwca_if_changed(dwca_server.url, outpath)
+    assert(not is_new)
+    assert(dwca_server.requests[-1]['If-None-Match'] == dwca_server.etag)
+
+    # Changed file is
+    dwca_server.data = _make_zip('id\n' * 6000)
+    dwca_server.etag = '"v2"'
+    fname, is_new = download_dwca_if_changed(dwca_server.url, outpath)
+    assert(is_new)
+    with open(fname, 'rb') as inf:
+        assert(inf.read() == dwca_server.data)
+
+# ............................
+def test_resume_download(tmp_path, dwca_server):
+    outpath = str(tmp_path)
+    fname = assemble_download_filename(dwca_server.url, outpath)
+    part_fname = fname + DOWNLOAD_PART_EXT
+    half = len(dwca_server.data) // 2
+    # Interrupted download of the current file
+    os.makedirs(os.path.dirname(fname))
+    with open(part_fname, 'wb') as outf:
+        outf.write(dwca_server.data[:half])
+    _write_download_meta(fname + DOWNLOAD_META_EXT, {
+        'partial': {'etag': dwca_server.etag, 'last_modified': None, 'size': None}})
+
+    fname, is_new = download_dwca_if_changed(dwca_server.url, outpath)
+    assert(is_new)
+    assert(dwca_server.requests[-1]['Range'] == 'bytes={}-'.format(half))
+    assert(not os.path.exists(part_fname))
+    with open(fname, 'rb') as inf:
+        assert(inf.read() == dwca_server.data)
+
+# ............................
+def test_resume_changed_download(tmp_path, dwca_server):
+    outpath = str(tmp_path)
+    fname = assemble_download_filename(dwca_server.url, outpath)
+    part_fname = fname + DOWNLOAD_PART_EXT
+    # Interrupted download of a file that changed since
+    os.makedirs(os.path.dirname(fname))
+    with open(part_fname, 'wb') as outf:
+        outf.write(b'x' * 100)
+    _write_download_meta(fname + DOWNLOAD_META_EXT, {
+        'partial': {'etag': '"v0"', 'last_modified': None, 'size': None}})
+
+    fname, is_new = download_dwca_if_changed(dwca_server.url, outpath)
+    assert(is_new)
+    with open(fname, 'rb') as inf:
+        assert(inf.read() == dwca_server.data)
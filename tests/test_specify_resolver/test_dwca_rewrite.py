@@ -0,0 +1,199 @@
+import csv
+import io
+import os
+import uuid
+import zipfile
+
+from lmtrex.tools.misc.dwca import (
+    commit_manifest, DwCArchive, find_record_offsets, get_manifest_filename,
+    read_manifest, write_manifest, MANIFEST_PENDING_EXT, SolrRecordTransformer)
+from lmtrex.common.lmconstants import (
+    DWCA, SPCOCO_FIELDS, SPECIFY_ARK_PREFIX, SPECIFY7_RECORD_ENDPOINT, 
+    SPECIFY7_SERVER_KEY)
+
+DS_UUID = '2c1becd5-e641-4e83-b3f5-76a55206539a'
+FIELDNAMES = ['id', 'datasetName', 'basisOfRecord', 'year', 'month', 'day']
+
+# ...............................................
+def _get_fileinfo():
+    return {
+        DWCA.LOCATION_KEY: 'occurrence.csv', DWCA.DELIMITER_KEY: ',',
+        DWCA.LINE_DELIMITER_KEY: '\n', DWCA.QUOTE_CHAR_KEY: '"',
+        DWCA.UUID_KEY: 'id', DWCA.FLDS_KEY: FIELDNAMES,
+        SPECIFY7_SERVER_KEY: 'https://notyeti.example.org'}
+
+# ...............................................
+def _write_core(path, rows):
+    with open(os.path.join(path, 'occurrence.csv'), 'w', newline='') as outf:
+        wtr = csv.writer(outf, escapechar='\\', quoting=csv.QUOTE_NONE)
+        wtr.writerow(FIELDNAMES)
+        wtr.writerows(rows)
+
+# ...............................................
+def _read_ids(fname):
+    with open(fname, newline='') as inf:
+        rdr = csv.reader(inf, escapechar='\\', quoting=csv.QUOTE_NONE)
+        next(rdr)
+        return [row[0] for row in rdr]
+
+# ............................
+def test_manifest_round_trip(tmp_path):
+    hashes = {str(uuid.uuid4()): 'ab12cd34ef56ab78' for _ in range(100)}
+    manifest_fname = get_manifest_filename(str(tmp_path), DS_UUID)
+    assert(read_manifest(manifest_fname) == {})
+    write_manifest(manifest_fname, hashes)
+    assert(read_manifest(manifest_fname) == hashes)
+
+# ............................
+def test_rewrite_changed_recs(tmp_path):
+    path = str(tmp_path)
+    manifest_path = os.path.join(path, 'manifest')
+    guids = [str(uuid.uuid4()) for _ in range(5)]
+    rows = [[guid, 'KU Fish', 'PreservedSpecimen', '2021', '6', '3'] for guid in guids]
+    _write_core(path, rows)
+    archive = DwCArchive(path)
+    fileinfo = _get_fileinfo()
+
+    # First run rewrites every record, nothing is deleted
+    solr_fname, changed, deleted, manifest_fname = archive.rewrite_changed_recs_for_solr(
+        fileinfo, DS_UUID, manifest_path)
+    assert(changed == 5)
+    assert(deleted == [])
+    assert(sorted(_read_ids(solr_fname)) == sorted(guids))
+    # The manifest is pending until committed
+    assert(read_manifest(manifest_fname) == {})
+    commit_manifest(manifest_fname)
+    assert(not os.path.exists(manifest_fname + MANIFEST_PENDING_EXT))
+    assert(set(read_manifest(manifest_fname)) == set(guids))
+
+    # Change one record, delete one, add one
+    new_guid = str(uuid.uuid4())
+    rows[0][2] = 'FossilSpecimen'
+    del rows[1]
+    rows.append([new_guid, 'KU Fish', 'PreservedSpecimen', '2021', '6', '4'])
+    _write_core(path, rows)
+    solr_fname, changed, deleted, manifest_fname = archive.rewrite_changed_recs_for_solr(
+        fileinfo, DS_UUID, manifest_path)
+    assert(changed == 2)
+    assert(deleted == [guids[1]])
+    assert(sorted(_read_ids(solr_fname)) == sorted([guids[0], new_guid]))
+
+    # Without committing, the same changes are found again
+    _, changed, deleted, _ = archive.rewrite_changed_recs_for_solr(
+        fileinfo, DS_UUID, manifest_path)
+    assert(changed == 2)
+    assert(deleted == [guids[1]])
+    commit_manifest(manifest_fname)
+    _, changed, deleted, _ = archive.rewrite_changed_recs_for_solr(
+        fileinfo, DS_UUID, manifest_path)
+    assert(changed == 0)
+    assert(deleted == [])
+
+# ............................
+def test_record_offsets(tmp_path):
+    rows = []
+    for i in range(2000):
+        # Escaped delimiters and newlines, and unbalanced quotes
+        name = 'Fish, "big\nand small' if i % 7 == 0 else 'Fish"'
+        rows.append([str(i), name, 'PreservedSpecimen'])
+    buf = io.StringIO(newline='')
+    csv.writer(buf, escapechar='\\', quoting=csv.QUOTE_NONE).writerows(rows)
+    fname = os.path.join(str(tmp_path), 'occurrence.csv')
+    with open(fname, 'w', newline='') as outf:
+        outf.write(buf.getvalue())
+    with open(fname, 'rb') as inf:
+        data = inf.read()
+
+    for chunk_size in (10, 1000, len(data) * 2):
+        offsets = find_record_offsets(fname, chunk_size)
+        assert(offsets[0] == 0 and offsets[-1] == len(data))
+        assert(offsets == sorted(set(offsets)))
+        read_rows = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            text = data[start:end].decode('utf-8')
+            read_rows.extend(csv.reader(
+                io.StringIO(text, newline=''), escapechar='\\',
+                quoting=csv.QUOTE_NONE))
+        assert(read_rows == rows)
+
+# ............................
+def test_rewrite_parallel_from_zip(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    rows = []
+    for i in range(300):
+        name = 'KU, Fish' if i % 5 == 0 else 'KU Fish'
+        rows.append([str(uuid.uuid4()), name, 'PreservedSpecimen', '2021', '6', str(i % 28 + 1)])
+    _write_core(path, rows)
+    # Core file in a subdirectory of the zipfile
+    zip_fname = os.path.join(path, 'dataset.zip')
+    with zipfile.ZipFile(zip_fname, 'w') as zfile:
+        zfile.write(os.path.join(path, 'occurrence.csv'), 'dataset/occurrence.csv')
+    os.remove(os.path.join(path, 'occurrence.csv'))
+    archive = DwCArchive(zip_fname)
+    fileinfo = _get_fileinfo()
+
+    solr_fname, _, _ = archive.rewrite_recs_for_solr(fileinfo, DS_UUID, from_zip=True)
+    with open(solr_fname, newline='') as inf:
+        serial = inf.read()
+    monkeypatch.setattr(DWCA, 'REWRITE_CHUNK_BYTES', 1000)
+    solr_fname, _, _ = archive.rewrite_recs_for_solr_parallel(
+        fileinfo, DS_UUID, max_workers=2)
+    with open(solr_fname, newline='') as inf:
+        parallel = inf.read()
+    assert(parallel == serial)
+    assert(len(_read_ids(solr_fname)) == len(rows))
+
+# ...............................................
+def _previous_rewrite(rows, fileinfo, ds_uuid):
+    """Rewrite rows one record at a time, like DwCArchive did before 
+    SolrRecordTransformer."""
+    inf = io.StringIO(newline='')
+    csv.writer(inf, escapechar='\\', quoting=csv.QUOTE_NONE).writerows(rows)
+    inf.seek(0)
+    rdr = csv.DictReader(
+        inf, fieldnames=fileinfo[DWCA.FLDS_KEY], escapechar='\\', 
+        quoting=csv.QUOTE_NONE)
+    outf = io.StringIO(newline='')
+    wtr = csv.DictWriter(
+        outf, fieldnames=SPCOCO_FIELDS, escapechar='\\', quoting=csv.QUOTE_NONE)
+    url_prefix = '{}/{}/{}/'.format(
+        fileinfo[SPECIFY7_SERVER_KEY], SPECIFY7_RECORD_ENDPOINT, ds_uuid)
+    for dwc_rec in rdr:
+        occ_uuid = dwc_rec['id']
+        coll_date = ''
+        try:
+            int(dwc_rec['year'])
+            coll_date = dwc_rec['year']
+            int(dwc_rec['month'])
+            coll_date = '{}-{}'.format(coll_date, dwc_rec['month'])
+            int(dwc_rec['day'])
+            coll_date = '{}-{}'.format(coll_date, dwc_rec['day'])
+        except:
+            pass
+        solr_rec = {
+            'id': occ_uuid, 'dataset_guid': ds_uuid, 'who': dwc_rec['datasetName'],
+            'what': dwc_rec['basisOfRecord'], 'when': coll_date,
+            'where': SPECIFY_ARK_PREFIX + occ_uuid, 'url': url_prefix + occ_uuid}
+        wtr.writerow(solr_rec)
+    return outf.getvalue()
+
+# ............................
+def test_transformer_to_line():
+    fileinfo = _get_fileinfo()
+    rows = []
+    for i in range(100):
+        rows.append([
+            str(uuid.uuid4()), 'KU Fish', 'PreservedSpecimen', str(1900 + i), 
+            str(i % 12 + 1), str(i % 28 + 1)])
+    # Escaped characters, partial and invalid dates, missing columns, other ids
+    rows[1][1] = 'KU, "Fish"\\Ichthyology'
+    rows[2][2] = 'Fossil\nSpecimen'
+    rows[3][4] = ''
+    rows[4][3] = 'unknown'
+    rows[5][5] = '3rd'
+    rows[6] = rows[6][:4]
+    rows[7][0] = 'KU:Fish:1234'
+    rows[8][0] = 'ku,fish'
+    transformer = SolrRecordTransformer(fileinfo, DS_UUID)
+    lines = ''.join(transformer.to_line(row) for row in rows)
+    assert(lines == _previous_rewrite(rows, fileinfo, DS_UUID))
@@ -0,0 +1,209 @@
+import inspect
+import os
+
+import pytest
+
+ogr = pytest.importorskip('osgeo.ogr')
+pytest.importorskip('rtree')
+
+from lmtrex.tools.fileop.geotools import (
+    _create_empty_dataset, CENTROID_FIELD, get_clustered_spatial_index, 
+    _get_index_filenames, intersect_polygon_with_grid, _iter_complex_shapefile, 
+    RegularGrid, simplify_merge_polygon_shapefiles)
+
+CELL_SIZE = 10
+# Grid of 4 columns and 3 rows of 10 degree cells
+GRID_EXTENT = (0, 40, 0, 30)
+PRIMARY_POLYGONS = [
+    ('POLYGON ((2 2, 27 4, 18 26, 3 15, 2 2))', 'triangle'),
+    # Boundaries along cell edges
+    ('POLYGON ((10 0, 30 0, 30 10, 10 10, 10 0))', 'edges'),
+    ('MULTIPOLYGON (((31 21, 39 21, 39 29, 31 29, 31 21)), '
+     '((5 25, 15 25, 15 28, 5 28, 5 25)))', 'parts'),
+    ]
+
+# ...............................................
+def _write_shapefile(fname, fields, features):
+    """Write a polygon shapefile of (WKT, {fieldname: value}) features."""
+    dataset, lyr = _create_empty_dataset(fname, fields, ogr.wkbPolygon, 4326)
+    for wkt, vals in features:
+        feat = ogr.Feature(lyr.GetLayerDefn())
+        feat.SetGeometryDirectly(ogr.CreateGeometryFromWkt(wkt))
+        for fldname, fldval in vals.items():
+            feat.SetField(fldname, fldval)
+        lyr.CreateFeature(feat)
+        feat.Destroy()
+    dataset.Destroy()
+
+# ...............................................
+def _write_grid(fname, extent=GRID_EXTENT):
+    xmin, xmax, ymin, ymax = extent
+    cells = []
+    for y in range(ymin, ymax, CELL_SIZE):
+        for x in range(xmin, xmax, CELL_SIZE):
+            wkt = 'POLYGON (({0} {1}, {0} {3}, {2} {3}, {2} {1}, {0} {1}))'.format(
+                x, y, x + CELL_SIZE, y + CELL_SIZE)
+            cells.append((wkt, {'cell': len(cells)}))
+    _write_shapefile(fname, [('cell', ogr.OFTInteger)], cells)
+
+# ...............................................
+def _write_inputs(path):
+    grid_fname = os.path.join(path, 'grid.shp')
+    primary_fname = os.path.join(path, 'primary.shp')
+    _write_grid(grid_fname)
+    _write_shapefile(
+        primary_fname, [('NAME', ogr.OFTString)],
+        [(wkt, {'NAME': name}) for wkt, name in PRIMARY_POLYGONS])
+    return primary_fname, grid_fname
+
+# ...............................................
+def _read_features(fname):
+    """Return (FID, WKT, NAME, centroid) of the features of a shapefile."""
+    datasrc = ogr.GetDriverByName('ESRI Shapefile').Open(fname, 0)
+    feats = []
+    for feat in datasrc.GetLayer():
+        feats.append((
+            feat.GetFID(), feat.GetGeometryRef().ExportToWkt(),
+            feat.GetFieldAsString('NAME'), feat.GetFieldAsString(CENTROID_FIELD)))
+    datasrc = None
+    return feats
+
+# ...............................................
+def _get_shapes(feats):
+    """Return the attributes, rounded envelope and area of features, sorted."""
+    shapes = []
+    for _, wkt, name, centroid in feats:
+        geom = ogr.CreateGeometryFromWkt(wkt)
+        shapes.append((
+            name, centroid, tuple(round(val, 6) for val in geom.GetEnvelope()),
+            round(geom.GetArea(), 6)))
+    return sorted(shapes)
+
+# ...............................................
+def _intersect(path, name, primary_fname, grid_fname, **kwargs):
+    out_fname = os.path.join(path, '{}.shp'.format(name))
+    intersect_polygon_with_grid(
+        primary_fname, grid_fname, {CENTROID_FIELD: ogr.OFTString}, out_fname,
+        **kwargs)
+    return _read_features(out_fname)
+
+# ............................
+def test_grid_cell_range():
+    grid = RegularGrid.from_extent((-180, 180, -90, 90), 2.5)
+    assert((grid.ncols, grid.nrows) == (144, 72))
+    # Inside one cell
+    assert(grid.get_cell_range(1, 2, 1, 2) == (72, 72, 36, 36))
+    # Cells touching the envelope at their edges are included
+    assert(grid.get_cell_range(0, 2.5, 0, 2.5) == (72, 73, 36, 37))
+    # Clipped to the grid, including at its east and north edges
+    assert(grid.get_cell_range(-190, 180, -100, 90) == (0, 143, 0, 71))
+    # Outside the grid, first is greater than last
+    col_min, col_max, row_min, row_max = grid.get_cell_range(185, 190, 0, 1)
+    assert(col_min > col_max)
+    col_min, col_max, row_min, row_max = grid.get_cell_range(0, 1, -100, -95)
+    assert(row_min > row_max)
+    assert(list(grid.get_cells(185, 190, 0, 1)) == [])
+    cells = list(grid.get_cells(-1, 1, -1, 1))
+    assert([cell.GetEnvelope() for cell in cells] == [
+        (-2.5, 0, -2.5, 0), (0, 2.5, -2.5, 0), (-2.5, 0, 0, 2.5), (0, 2.5, 0, 2.5)])
+    # Extents within TOLERANCE of a whole number of cells
+    grid = RegularGrid.from_extent((0, 10.0000000001, 0, 5), 2.5)
+    assert((grid.ncols, grid.nrows) == (4, 2))
+
+# ............................
+def test_grid_and_index_intersect(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    primary_fname, grid_fname = _write_inputs(path)
+    grid = RegularGrid.detect(grid_fname)
+    assert((grid.xmin, grid.ymin, grid.dx, grid.dy) == (0, 0, CELL_SIZE, CELL_SIZE))
+    assert((grid.ncols, grid.nrows) == (4, 3))
+
+    regular = _intersect(path, 'regular', primary_fname, grid_fname)
+    sized = _intersect(
+        path, 'sized', primary_fname, grid_fname, cell_size=CELL_SIZE)
+    monkeypatch.setattr(RegularGrid, 'detect', classmethod(lambda cls, fname: None))
+    indexed = _intersect(path, 'indexed', primary_fname, grid_fname)
+    # Same polygons, in cell order instead of index order
+    assert(_get_shapes(regular) == _get_shapes(indexed))
+    assert(regular == sized)
+    # Nothing is lost or created, and polygons on cell edges are not split
+    areas = {}
+    for name, _, _, area in _get_shapes(regular):
+        areas[name] = areas.get(name, 0) + area
+    assert(areas['edges'] == 200)
+    assert(areas['parts'] == 64 + 30)
+    assert(len([name for name, _, _, _ in _get_shapes(regular) if name == 'edges']) == 2)
+
+# ............................
+def test_parallel_intersect(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    primary_fname, grid_fname = _write_inputs(path)
+    # Output FIDs and content do not depend on the number of processes
+    serial = _intersect(path, 'serial', primary_fname, grid_fname)
+    parallel = _intersect(path, 'parallel', primary_fname, grid_fname, processes=3)
+    assert(len(serial) > len(PRIMARY_POLYGONS))
+    assert(parallel == serial)
+    assert([fid for fid, _, _, _ in parallel] == list(range(len(parallel))))
+
+    monkeypatch.setattr(RegularGrid, 'detect', classmethod(lambda cls, fname: None))
+    serial = _intersect(path, 'serial_index', primary_fname, grid_fname)
+    parallel = _intersect(
+        path, 'parallel_index', primary_fname, grid_fname, processes=3)
+    assert(parallel == serial)
+
+# ............................
+def test_spatial_index(tmp_path):
+    path = str(tmp_path)
+    grid_fname = os.path.join(path, 'grid.shp')
+    _write_grid(grid_fname)
+    # xmin, xmax, ymin, ymax
+    envelope = (5, 15, 5, 6)
+    spindex = get_clustered_spatial_index(grid_fname)
+    cells = sorted(
+        ogr.CreateGeometryFromWkb(item.object).GetEnvelope() 
+        for item in spindex.intersection(envelope, objects=True))
+    assert(cells == [(0, 10, 0, 10), (10, 20, 0, 10)])
+    spindex.close()
+
+    # An index newer than its shapefile is reused, an older one is rebuilt
+    _, index_fnames = _get_index_filenames(grid_fname)
+    index_mtime = min(os.path.getmtime(fn) for fn in index_fnames)
+    _write_grid(grid_fname, extent=(10, 40, 0, 30))
+    base, _ = os.path.splitext(grid_fname)
+    for mtime, cell_count in ((index_mtime - 10, 2), (index_mtime + 10, 1)):
+        for fn in (grid_fname, base + '.shx'):
+            if os.path.exists(fn):
+                os.utime(fn, (mtime, mtime))
+        spindex = get_clustered_spatial_index(grid_fname)
+        cells = list(spindex.intersection(envelope, objects=True))
+        spindex.close()
+        assert(len(cells) == cell_count)
+    assert(ogr.CreateGeometryFromWkb(cells[0].object).GetEnvelope() == (10, 20, 0, 10))
+
+# ............................
+def test_iter_complex_shapefile(tmp_path):
+    path = str(tmp_path)
+    primary_fname, _ = _write_inputs(path)
+    feats = _iter_complex_shapefile(primary_fname)
+    # Features are read one at a time
+    assert(inspect.isgenerator(feats))
+    feats = list(feats)
+    assert([feat['NAME'] for feat in feats] == [name for _, name in PRIMARY_POLYGONS])
+    # Multipolygons are split into simple polygons
+    assert([len(feat['geometries']) for feat in feats] == [1, 1, 2])
+    for feat in feats:
+        for wkb in feat['geometries']:
+            assert(ogr.CreateGeometryFromWkb(wkb).GetGeometryName() == 'POLYGON')
+    centroid = ogr.CreateGeometryFromWkt(feats[1][CENTROID_FIELD])
+    assert((centroid.GetX(), centroid.GetY()) == (20, 5))
+
+    other_fname = os.path.join(path, 'other.shp')
+    _write_shapefile(
+        other_fname, [('ISO', ogr.OFTString)],
+        [('POLYGON ((0 0, 1 0, 1 1, 0 0))', {'ISO': 'XX'})])
+    out_fname = os.path.join(path, 'merged.shp')
+    simplify_merge_polygon_shapefiles(
+        [primary_fname, other_fname], {CENTROID_FIELD: ogr.OFTString}, out_fname)
+    merged = _read_features(out_fname)
+    assert([name for _, _, name, _ in merged] == ['triangle', 'edges', 'parts', 'parts', ''])
+    assert(merged[1][3] == feats[1][CENTROID_FIELD])
@@ -0,0 +1,106 @@
+import os
+import uuid
+
+import lmtrex.tools.misc.solr as SpSolr
+from lmtrex.common.lmconstants import GUID_FILTER, SOLR_EXPORT
+from lmtrex.tools.s2n import guid_filter
+from lmtrex.tools.s2n.guid_filter import (
+    add_guids_to_filter, build_guid_filter, GuidFilter)
+
+# ...............................................
+def _get_docs(count):
+    return [{SOLR_EXPORT.UNIQUE_KEY: str(uuid.uuid4())} for _ in range(count)]
+
+# ...............................................
+def _use_solr_docs(monkeypatch, docs):
+    """Answer the Solr queries of the filter builder with docs."""
+    monkeypatch.setattr(
+        SpSolr, 'count_docs', lambda collection, solr_location: len(docs))
+    monkeypatch.setattr(
+        SpSolr, 'export_docs',
+        lambda collection, solr_location, page_size=None, fields=None: iter(docs))
+
+# ............................
+def test_guid_filter_round_trip(tmp_path):
+    fname = os.path.join(str(tmp_path), 'guids.bloom')
+    guids = [str(uuid.uuid4()) for _ in range(1000)]
+    gfilter = GuidFilter(len(guids))
+    for guid in guids:
+        gfilter.add(guid)
+    gfilter.write(fname)
+
+    read_filter = GuidFilter.read(fname)
+    assert(len(read_filter) == len(guids))
+    assert(read_filter.built == gfilter.built)
+    assert(all(guid in read_filter for guid in guids))
+    others = [str(uuid.uuid4()) for _ in range(1000)]
+    false_positives = sum(1 for guid in others if guid in read_filter)
+    assert(false_positives < 5 * GUID_FILTER.ERROR_RATE * len(others))
+
+# ............................
+def test_add_guids_to_filter(tmp_path, monkeypatch):
+    fname = os.path.join(str(tmp_path), 'guids.bloom')
+    assert(add_guids_to_filter(['a'], fname=fname) is None)
+    docs = _get_docs(100)
+    _use_solr_docs(monkeypatch, docs)
+    build_guid_filter(fname=fname)
+    new_guids = [str(uuid.uuid4()) for _ in range(10)]
+    add_guids_to_filter(new_guids, fname=fname)
+
+    gfilter = GuidFilter.read(fname)
+    assert(len(gfilter) == 110)
+    assert(all(doc[SOLR_EXPORT.UNIQUE_KEY] in gfilter for doc in docs))
+    assert(all(guid in gfilter for guid in new_guids))
+
+# ...............................................
+def _use_filter_file(monkeypatch, fname, index_modified):
+    """Load the broker's filter from fname, with the Solr index last changed at 
+    index_modified."""
+    monkeypatch.setattr(GUID_FILTER, 'FILENAME', fname)
+    monkeypatch.setattr(GUID_FILTER, 'CHECK_INDEX', True)
+    for name in ('_FILTER', '_FILTER_MTIME', '_FILTER_CHECKED', '_INDEX_MODIFIED'):
+        monkeypatch.setattr(guid_filter, name, None)
+    monkeypatch.setattr(
+        SpSolr, 'get_index_modified', 
+        lambda collection, solr_location, timeout=None: index_modified)
+
+# ............................
+def test_stale_guid_filter(tmp_path, monkeypatch):
+    fname = os.path.join(str(tmp_path), 'guids.bloom')
+    gfilter = GuidFilter(10)
+    gfilter.built -= GUID_FILTER.MAX_AGE + 1
+    gfilter.updated = gfilter.built
+    gfilter.write(fname)
+    _use_filter_file(monkeypatch, fname, None)
+    assert(guid_filter.get_guid_filter() is None)
+    # Every GUID may be indexed without a current filter
+    assert(guid_filter.may_be_indexed(str(uuid.uuid4())))
+
+# ............................
+def test_guid_filter_older_than_index(tmp_path, monkeypatch):
+    fname = os.path.join(str(tmp_path), 'guids.bloom')
+    gfilter = GuidFilter(10)
+    gfilter.updated -= 10
+    gfilter.write(fname)
+    _use_filter_file(monkeypatch, fname, gfilter.updated - 1)
+    assert(guid_filter.get_guid_filter() is not None)
+    assert(not guid_filter.may_be_indexed(str(uuid.uuid4())))
+
+    # GUIDs were committed to Solr without adding them to the filter
+    _use_filter_file(monkeypatch, fname, gfilter.updated + 1)
+    assert(guid_filter.get_guid_filter() is None)
+    assert(guid_filter.may_be_indexed(str(uuid.uuid4())))
+
+    # Adding GUIDs after the commit brings the filter up to date
+    guid = str(uuid.uuid4())
+    add_guids_to_filter([guid], fname=fname)
+    _use_filter_file(monkeypatch, fname, gfilter.updated + 1)
+    assert(guid_filter.may_be_indexed(guid))
+    assert(not guid_filter.may_be_indexed(str(uuid.uuid4())))
+
+    # Solr cannot be checked
+    def fail(collection, solr_location, timeout=None):
+        raise Exception('Solr is down')
+    _use_filter_file(monkeypatch, fname, None)
+    monkeypatch.setattr(SpSolr, 'get_index_modified', fail)
+    assert(guid_filter.get_guid_filter() is None)
@@ -0,0 +1,56 @@
+import os
+import uuid
+
+import lmtrex.tools.misc.solr as SpSolr
+from lmtrex.common.lmconstants import SOLR_EXPORT
+from lmtrex.tools.s2n.guid_index import build_guid_index, GuidIndex
+
+DS_GUID = '2c1becd5-e641-4e83-b3f5-76a55206539a'
+URL_PREFIX = 'https://notyeti.example.org/api/v1/sp_cache/collection/kufish/specimens/'
+
+# ...............................................
+def _get_docs(count):
+    docs = []
+    for _ in range(count):
+        guid = str(uuid.uuid4())
+        docs.append({
+            SOLR_EXPORT.UNIQUE_KEY: guid, 'dataset_guid': DS_GUID,
+            'url': URL_PREFIX + guid})
+    return docs
+
+# ...............................................
+def _use_solr_docs(monkeypatch, docs):
+    """Answer the Solr queries of the index builder with docs."""
+    monkeypatch.setattr(
+        SpSolr, 'count_docs', lambda collection, solr_location: len(docs))
+    monkeypatch.setattr(
+        SpSolr, 'export_docs',
+        lambda collection, solr_location, page_size=None, fields=None: iter(docs))
+
+# ............................
+def test_guid_index_round_trip(tmp_path, monkeypatch):
+    fname = os.path.join(str(tmp_path), 'guids.idx')
+    docs = _get_docs(500)
+    # URL not ending with its GUID, and ids that are not canonical UUIDs
+    other_guid = str(uuid.uuid4())
+    docs.append({
+        SOLR_EXPORT.UNIQUE_KEY: other_guid, 'dataset_guid': DS_GUID,
+        'url': URL_PREFIX + 'other'})
+    docs.append({
+        SOLR_EXPORT.UNIQUE_KEY: 'not-a-uuid', 'dataset_guid': DS_GUID,
+        'url': URL_PREFIX + 'not-a-uuid'})
+    docs.append({
+        SOLR_EXPORT.UNIQUE_KEY: str(uuid.uuid4()).upper(),
+        'dataset_guid': DS_GUID, 'url': URL_PREFIX + 'upper'})
+    _use_solr_docs(monkeypatch, docs)
+    assert(build_guid_index(fname=fname) == 501)
+
+    gindex = GuidIndex(fname)
+    assert(len(gindex) == 501)
+    assert(not gindex.is_stale())
+    for doc in docs[:500]:
+        guid = doc[SOLR_EXPORT.UNIQUE_KEY]
+        assert(gindex.lookup(guid) == (DS_GUID, URL_PREFIX + guid))
+    assert(gindex.lookup(other_guid) == (DS_GUID, URL_PREFIX + 'other'))
+    assert(gindex.lookup('not-a-uuid') is None)
+    assert(gindex.lookup(str(uuid.uuid4())) is None)
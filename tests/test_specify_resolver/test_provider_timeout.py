@@ -0,0 +1,99 @@
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+from lmtrex.common.lmconstants import HTTP_POOL, RESPONSE_CACHE, ServiceProvider
+from lmtrex.common.s2n_type import S2nKey
+from lmtrex.flask_app.broker.occ import OccurrenceSvc
+from lmtrex.tools.provider.api import APIQuery, get_request_timeout
+from lmtrex.tools.s2n.utils import run_with_deadline
+
+SLOW_SECONDS = 10
+DEADLINE = 0.5
+
+# ...............................................
+class _ProviderHandler(BaseHTTPRequestHandler):
+    """Answer /fast at once, and /slow only after SLOW_SECONDS."""
+    def do_GET(self):
+        # Give up without answering when the test ends
+        if self.path.startswith('/slow') and self.server.stop.wait(SLOW_SECONDS):
+            return
+        body = b'{"count": 1}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# ...............................................
+class _GbifQuery(APIQuery):
+    PROVIDER = ServiceProvider.GBIF
+
+class _IdbQuery(APIQuery):
+    PROVIDER = ServiceProvider.iDigBio
+
+class _ItisQuery(APIQuery):
+    PROVIDER = ServiceProvider.ITISSolr
+
+# ...............................................
+@pytest.fixture
+def provider_server(monkeypatch):
+    monkeypatch.setattr(RESPONSE_CACHE, 'ENABLED', False)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ProviderHandler)
+    server.daemon_threads = True
+    server.stop = threading.Event()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_port)
+    yield server
+    server.stop.set()
+    server.shutdown()
+    server.server_close()
+
+# ...............................................
+def _make_query(api_class, url, finished):
+    def query():
+        api = api_class(url)
+        api.query_by_get()
+        finished[api_class] = (time.monotonic(), api.error)
+        return api_class.get_api_failure(
+            OccurrenceSvc.SERVICE_TYPE['endpoint'], api.status_code).response
+    return query
+
+# ............................
+def test_request_timeout():
+    assert(get_request_timeout() == (HTTP_POOL.CONNECT_TIMEOUT, HTTP_POOL.READ_TIMEOUT))
+    # Within a deadline, requests wait no longer than the time left
+    timeout, err = run_with_deadline(get_request_timeout, (), DEADLINE)
+    assert(err is None)
+    assert(0 < timeout[0] <= DEADLINE and 0 < timeout[1] <= DEADLINE)
+
+# ............................
+def test_slow_provider(provider_server):
+    finished = {}
+    queries = [
+        (_GbifQuery, _make_query(_GbifQuery, provider_server.url + '/slow', finished), ()),
+        (_IdbQuery, _make_query(_IdbQuery, provider_server.url + '/fast', finished), ()),
+        (_ItisQuery, _make_query(_ItisQuery, provider_server.url + '/fast?q=1', finished), ())]
+    timeouts = {ServiceProvider.GBIF[S2nKey.PARAM]: DEADLINE}
+    start = time.monotonic()
+    responses = OccurrenceSvc._query_providers(queries, timeouts=timeouts)
+    statuses = [resp[S2nKey.PROVIDER][S2nKey.PROVIDER_STATUS_CODE] for resp in responses]
+    assert(statuses == [HTTPStatus.GATEWAY_TIMEOUT, HTTPStatus.OK, HTTPStatus.OK])
+    assert(time.monotonic() - start < SLOW_SECONDS / 2)
+
+    # The abandoned query gives up on its socket soon after its deadline, long
+    # before the provider answers, and frees its thread
+    for _ in range(50):
+        if _GbifQuery in finished:
+            break
+        time.sleep(0.1)
+    end, error = finished[_GbifQuery]
+    assert(end - start < DEADLINE + 3)
+    assert(error is not None)
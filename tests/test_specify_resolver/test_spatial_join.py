@@ -0,0 +1,99 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+
+ogr = pytest.importorskip('osgeo.ogr')
+pytest.importorskip('rtree')
+
+from lmtrex.tools.fileop.geotools import _create_empty_dataset
+from lmtrex.tools.fileop.spatial_join import (
+    annotate_occurrence_csv, PolygonBuckets, PreparedPolygon)
+
+BUCKET_SIZE = 10
+POLYGONS = [
+    # A whole bucket
+    ('POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))', 'full'),
+    ('POLYGON ((10 0, 20 0, 15 10, 10 0))', 'triangle'),
+    ('POLYGON ((22 2, 38 2, 38 18, 22 18, 22 2), (28 8, 32 8, 32 12, 28 12, 28 8))',
+     'hole'),
+    ('MULTIPOLYGON (((1 21, 4 21, 4 24, 1 24, 1 21)), '
+     '((11 21, 14 21, 14 24, 11 24, 11 21)))', 'parts'),
+    # Overlaps full and triangle, which are earlier in the file
+    ('POLYGON ((5 5, 15 5, 15 8, 5 8, 5 5))', 'overlap'),
+    ]
+# (x, y), name of the polygon containing the point
+POINTS = [
+    ((5, 5), 'full'), ((0.5, 9.5), 'full'), ((15, 2), 'triangle'), ((11, 9), None),
+    ((25, 5), 'hole'), ((30, 10), None), ((35, 15), 'hole'), ((2, 22), 'parts'),
+    ((12, 22), 'parts'), ((35, 25), None), ((50, 5), None), ((190, 5), None),
+    ((12, 6), 'overlap'), ((14, 6), 'triangle'), ((float('nan'), float('nan')), None),
+    ]
+
+# ...............................................
+def _write_polygons(fname):
+    dataset, lyr = _create_empty_dataset(
+        fname, [('NAME', ogr.OFTString)], ogr.wkbPolygon, 4326)
+    for wkt, name in POLYGONS:
+        feat = ogr.Feature(lyr.GetLayerDefn())
+        feat.SetGeometryDirectly(ogr.CreateGeometryFromWkt(wkt))
+        feat.SetField('NAME', name)
+        lyr.CreateFeature(feat)
+        feat.Destroy()
+    dataset.Destroy()
+
+# ............................
+def test_polygon_buckets(tmp_path, monkeypatch):
+    fname = os.path.join(str(tmp_path), 'polygons.shp')
+    _write_polygons(fname)
+    buckets = PolygonBuckets(fname, bucket_size=BUCKET_SIZE)
+    assert(buckets.fieldnames == ['NAME'])
+    assert([vals[0] for vals in buckets.values] == [name for _, name in POLYGONS])
+
+    x = np.array([pt[0] for pt, _ in POINTS], dtype=np.float64)
+    y = np.array([pt[1] for pt, _ in POINTS], dtype=np.float64)
+    found = buckets.find(x, y)
+    names = [None if idx < 0 else buckets.values[idx][0] for idx in found.tolist()]
+    assert(names == [name for _, name in POINTS])
+
+    # The whole bucket is assigned without testing points, and is not in the
+    # bucket it touches at its east edge
+    col, _, row, _ = buckets.grid.get_cell_range(5, 5, 5, 5)
+    full_key = row * buckets.grid.ncols + col
+    assert(buckets._full == {full_key: 0})
+    assert([prepared.value_idx for prepared in buckets._buckets[full_key + 1]] == [1, 4])
+    tested = []
+    def contains(prepared, px, py):
+        tested.append(prepared.value_idx)
+        return original(prepared, px, py)
+    original = PreparedPolygon.contains
+    monkeypatch.setattr(PreparedPolygon, 'contains', contains)
+    found = buckets.find(np.array([1.0, 5, 9.9]), np.array([1.0, 5, 9.9]))
+    assert(found.tolist() == [0, 0, 0])
+    assert(tested == [])
+
+# ............................
+def test_annotate_occurrence_csv(tmp_path):
+    path = str(tmp_path)
+    poly_fname = os.path.join(path, 'polygons.shp')
+    in_fname = os.path.join(path, 'occ.csv')
+    out_fname = os.path.join(path, 'occ_annotated.csv')
+    _write_polygons(poly_fname)
+    with open(in_fname, 'w', newline='') as outf:
+        wtr = csv.writer(outf)
+        wtr.writerow(['id', 'decimalLatitude', 'decimalLongitude'])
+        for i, ((x, y), _) in enumerate(POINTS):
+            wtr.writerow([i, y, x])
+        wtr.writerow([len(POINTS), 'unknown', ''])
+
+    rec_count, found_count = annotate_occurrence_csv(
+        in_fname, out_fname, poly_fname, bucket_size=BUCKET_SIZE, batch_size=4)
+    expected = [name or '' for _, name in POINTS] + ['']
+    assert(rec_count == len(expected))
+    assert(found_count == len([name for name in expected if name]))
+    with open(out_fname, newline='') as inf:
+        rows = list(csv.reader(inf))
+    assert(rows[0] == ['id', 'decimalLatitude', 'decimalLongitude', 'NAME'])
+    assert([row[0] for row in rows[1:]] == [str(i) for i in range(len(expected))])
+    assert([row[3] for row in rows[1:]] == expected)